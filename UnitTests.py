@@ -1,11 +1,37 @@
-from math import sqrt
+from factorgraphs import CompiledSchedule, ConvergenceBudget, Factor, FactorGraphProfiler, LoopStop, \
+	ScheduleSequence, ScheduleStep
+import fastnumerics
+from fastnumerics import NumericsMode
+from leaderboard import Leaderboard
+from math import sqrt, isnan
+from matchmaking import Matchmaker
 from numerics import GaussianDistribution, logRatioNormalization, \
 	absoluteDifference, at, cumulativeTo, logProductNormalization, Matrix, \
-	_SquareMatrix, _IdentityMatrix, Decimal
+	_SquareMatrix, _IdentityMatrix, Decimal, inverseCumulativeTo, vwExceedsMargin, vwWithinMargin
 from objects import sortByRank, Player, GameInfo, defaultGameInfo, Team, Rating
+from ratingindex import RatingIndex
+from ratingstore import ArrayRatingStore
+from replay import ReplayEngine, ReplayMatch, groupIntoConflictFreeBatches, readCsv, readJsonLines
+from snapshot import RatingSnapshot, writeSnapshot
+from service import LatencyHistogram, RatingService, RatingServiceBusy, RatingServiceClient, RatingServiceServer
+from trueskill_factorgraph.convergence import ConvergenceStatistics
+from trueskill_factorgraph.flatgraph import FactorGraphBackend
+from trueskill_factorgraph.graphcache import FactorGraphCache
+from trueskill_factorgraph.layers import TrueSkillFactorGraph
 from trueskill_factorgraph.ts_factorgraph import FactorGraphTrueSkillCalculator
 from trueskill_simple import TwoPlayerTrueSkillCalculator, \
 	TwoTeamTrueSkillCalculator, getDrawMarginFromDrawProbability
+from StringIO import StringIO
+import logging
+import os
+import pickle
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 _errorTolerance = 0.085
@@ -91,6 +117,42 @@ class TwoPlayerTrueSkillCalculatorTests(unittest.TestCase):
 			else:
 				self.assertRating(1185.0383099003536, 42.485604606897752, newRating[1])
 	
+class TwoPlayerTrueSkillCalculatorBatchTests(unittest.TestCase):
+	def setUp(self):
+		self.calculator = TwoPlayerTrueSkillCalculator()
+		self.gameInfo = defaultGameInfo()
+
+	def assertBatchMatchesScalar(self, gameInfo, winnerRatings, loserRatings, wasDraw):
+		newWinnerMeans, newWinnerStandardDeviations, newLoserMeans, newLoserStandardDeviations = self.calculator.calculateNewRatingsBatch(
+			gameInfo,
+			[rating.mean for rating in winnerRatings], [rating.standardDeviation for rating in winnerRatings],
+			[rating.mean for rating in loserRatings], [rating.standardDeviation for rating in loserRatings],
+			wasDraw)
+		for i in range(len(winnerRatings)):
+			winner = Player(1)
+			loser = Player(2)
+			teams = [Team(winner, winnerRatings[i]), Team(loser, loserRatings[i])]
+			ranks = [1, 1] if wasDraw[i] else [1, 2]
+			for player, rating in self.calculator.calculateNewRatings(gameInfo, teams, ranks):
+				if player == winner:
+					self.assertAlmostEqual(rating.mean, newWinnerMeans[i], delta = _errorTolerance)
+					self.assertAlmostEqual(rating.standardDeviation, newWinnerStandardDeviations[i], delta = _errorTolerance)
+				else:
+					self.assertAlmostEqual(rating.mean, newLoserMeans[i], delta = _errorTolerance)
+					self.assertAlmostEqual(rating.standardDeviation, newLoserStandardDeviations[i], delta = _errorTolerance)
+
+	def test_batchMatchesScalar(self):
+		winnerRatings = [self.gameInfo.defaultRating, self.gameInfo.defaultRating, self.gameInfo.defaultRating, Rating(50, 12.5), Rating(10, 2)]
+		loserRatings = [self.gameInfo.defaultRating, self.gameInfo.defaultRating, Rating(50, 12.5), self.gameInfo.defaultRating, Rating(45, 1.5)]
+		self.assertBatchMatchesScalar(self.gameInfo, winnerRatings, loserRatings, [False, True, True, False, False])
+
+	def test_batchChessMatchesScalar(self):
+		gameInfo = GameInfo(1200.0, 1200.0 / 3.0, 200.0, 1200.0 / 300.0, 0.03)
+		self.assertBatchMatchesScalar(gameInfo, [Rating(1301.0007, 42.9232), Rating(1188.7560, 42.5570)], [Rating(1188.7560, 42.5570), Rating(1301.0007, 42.9232)], [False, True])
+
+	def test_emptyBatch(self):
+		self.assertEqual(([], [], [], []), self.calculator.calculateNewRatingsBatch(self.gameInfo, [], [], [], [], []))
+
 class TwoTeamTrueSkillCalculatorTests(TwoPlayerTrueSkillCalculatorTests):
 	def setUp(self):
 		self.calculator = TwoTeamTrueSkillCalculator()
@@ -316,11 +378,942 @@ class TwoTeamTrueSkillCalculatorTests(TwoPlayerTrueSkillCalculatorTests):
 				self.assertRating(36.211, 4.768, newRating[1])
 		self.assertMatchQuality(0.084, self.calculator.calculateMatchQuality(self.gameInfo, teams))
 		
+class TwoTeamTrueSkillCalculatorBatchTests(unittest.TestCase):
+	def setUp(self):
+		self.calculator = TwoTeamTrueSkillCalculator()
+		self.gameInfo = defaultGameInfo()
+
+	def test_batchMatchesScalar(self):
+		games = [
+			([Rating(40, 6)], [Rating(20, 7), Rating(25, 8)], False),
+			([Rating(15, 8), Rating(20, 6)], [Rating(25, 4), Rating(30, 3)], True),
+			([Rating(20, 8), Rating(25, 6)], [Rating(35, 7), Rating(40, 5)], False),
+			([self.gameInfo.defaultRating], [self.gameInfo.defaultRating] * 3, True),
+			([self.gameInfo.defaultRating] * 5, [self.gameInfo.defaultRating] * 5, False)]
+		means = list()
+		standardDeviations = list()
+		teamOffsets = [0]
+		for winningRatings, losingRatings, wasDraw in games:
+			for teamRatings in (winningRatings, losingRatings):
+				means.extend(rating.mean for rating in teamRatings)
+				standardDeviations.extend(rating.standardDeviation for rating in teamRatings)
+				teamOffsets.append(len(means))
+		newMeans, newStandardDeviations = self.calculator.calculateNewRatingsBatch(
+			self.gameInfo, means, standardDeviations, teamOffsets, [game[2] for game in games])
+
+		playerIndex = 0
+		for winningRatings, losingRatings, wasDraw in games:
+			teams = list()
+			players = list()
+			for teamRatings in (winningRatings, losingRatings):
+				team = Team()
+				for rating in teamRatings:
+					player = Player(playerIndex)
+					players.append(player)
+					team.addPlayer(player, rating)
+					playerIndex += 1
+				teams.append(team)
+			newRatings = dict((player.id, rating) for player, rating in self.calculator.calculateNewRatings(self.gameInfo, teams, [1, 1] if wasDraw else [1, 2]))
+			for player in players:
+				self.assertAlmostEqual(newRatings[player.id].mean, newMeans[player.id], delta = _errorTolerance)
+				self.assertAlmostEqual(newRatings[player.id].standardDeviation, newStandardDeviations[player.id], delta = _errorTolerance)
+
 class FactorGraphTrueSkillCalculatorTests(TwoTeamTrueSkillCalculatorTests):
 	def setUp(self):
 		self.calculator = FactorGraphTrueSkillCalculator()
 		self.gameInfo = defaultGameInfo()
 
+class FactorGraphMatchQualityTests(unittest.TestCase):
+	def setUp(self):
+		self.calculator = FactorGraphTrueSkillCalculator()
+		self.gameInfo = defaultGameInfo()
+
+	def createTeams(self, teamRatings):
+		teams = list()
+		playerId = 0
+		for ratings in teamRatings:
+			team = Team()
+			for rating in ratings:
+				playerId += 1
+				team.addPlayer(Player(playerId), rating)
+			teams.append(team)
+		return teams
+
+	def assertMatchQuality(self, expectedMatchQuality, teamRatings):
+		actualMatchQuality = self.calculator.calculateMatchQuality(self.gameInfo, self.createTeams(teamRatings))
+		self.assertAlmostEqual(expectedMatchQuality, actualMatchQuality, delta = 0.0005)
+
+	def test_twoTeamMatchQualityMatchesTwoTeamCalculator(self):
+		twoTeamCalculator = TwoTeamTrueSkillCalculator()
+		for teamRatings in ([[self.gameInfo.defaultRating], [self.gameInfo.defaultRating]],
+				[[Rating(40, 6)], [Rating(20, 7), Rating(25, 8)]],
+				[[Rating(15, 8), Rating(20, 6)], [Rating(25, 4), Rating(30, 3)]],
+				[[Rating(20, 8), Rating(25, 6)], [Rating(35, 7), Rating(40, 5)]]):
+			expected = twoTeamCalculator.calculateMatchQuality(self.gameInfo, self.createTeams(teamRatings))
+			self.assertMatchQuality(expected, teamRatings)
+
+	def test_multipleTeamsOfOne(self):
+		self.assertMatchQuality(0.200, [[self.gameInfo.defaultRating]] * 3)
+		self.assertMatchQuality(0.089, [[self.gameInfo.defaultRating]] * 4)
+		self.assertMatchQuality(0.040, [[self.gameInfo.defaultRating]] * 5)
+		self.assertMatchQuality(0.004, [[self.gameInfo.defaultRating]] * 8)
+
+	def test_twoOnFourOnTwo(self):
+		self.assertMatchQuality(0.367, [[Rating(40, 4), Rating(45, 3)], [Rating(20, 7), Rating(19, 6), Rating(30, 9), Rating(10, 4)], [Rating(50, 5), Rating(30, 2)]])
+
+	def test_closedFormMatchesMatrices(self):
+		teams = self.createTeams([[Rating(40, 4), Rating(45, 3)], [Rating(20, 7), Rating(19, 6), Rating(30, 9), Rating(10, 4)], [Rating(50, 5), Rating(30, 2)], [Rating(33, 1)]])
+		teams.append(Team(Player('partial', 0.25), Rating(31, 5)).addPlayer(Player('full'), Rating(18, 3)))
+		teams.append(Team(Player('mostly', 0.75), Rating(27, 6)))
+		expected = self.calculator._calculateMatchQualityFromMatrices(self.gameInfo, teams)
+		self.assertAlmostEqual(expected, self.calculator.calculateMatchQuality(self.gameInfo, teams), delta = 0.0000000001)
+		for teamCount in (2, 3, 16):
+			teams = self.createTeams([[Rating(20 + i, 3 + (i % 5))] for i in range(teamCount)])
+			expected = self.calculator._calculateMatchQualityFromMatrices(self.gameInfo, teams)
+			self.assertAlmostEqual(expected, self.calculator.calculateMatchQuality(self.gameInfo, teams), delta = 0.0000000001)
+
+class FactorGraphCacheTests(unittest.TestCase):
+	def setUp(self):
+		self.cache = FactorGraphCache(2)
+		self.cachedCalculator = FactorGraphTrueSkillCalculator(self.cache)
+		self.calculator = FactorGraphTrueSkillCalculator()
+		self.gameInfo = defaultGameInfo()
+
+	def assertSameRatings(self, teams, teamRanks):
+		expected = self.calculator.calculateNewRatings(self.gameInfo, teams, teamRanks)
+		actual = self.cachedCalculator.calculateNewRatings(self.gameInfo, teams, teamRanks)
+		self.assertEqual(len(expected), len(actual))
+		for (expectedPlayer, expectedRating), (actualPlayer, actualRating) in zip(expected, actual):
+			self.assertEqual(expectedPlayer, actualPlayer)
+			self.assertEqual(expectedRating.mean, actualRating.mean)
+			self.assertEqual(expectedRating.standardDeviation, actualRating.standardDeviation)
+
+	def test_cachedGraphGivesSameRatings(self):
+		self.assertSameRatings([Team(Player(1), self.gameInfo.defaultRating), Team(Player(2), self.gameInfo.defaultRating)], [1, 2])
+		self.assertSameRatings([Team(Player(3), Rating(30, 4)), Team(Player(4), Rating(20, 7))], [1, 2])
+		self.assertSameRatings([Team(Player(5), Rating(30, 4)), Team(Player(6), Rating(20, 7))], [2, 1])
+		self.assertEqual(1, self.cache.misses)
+		self.assertEqual(2, self.cache.hits)
+		fourTeams = [Team(Player(i), Rating(20 + i, 8 - 0.5 * i)) for i in range(4)]
+		self.assertSameRatings(fourTeams, [1, 2, 3, 4])
+		self.assertSameRatings(list(reversed(fourTeams)), [1, 2, 3, 4])
+		self.assertEqual(2, self.cache.misses)
+		self.assertEqual(3, self.cache.hits)
+
+	def test_shapeKey(self):
+		twoTeams = [Team(Player(1), self.gameInfo.defaultRating), Team(Player(2), self.gameInfo.defaultRating)]
+		self.cachedCalculator.calculateNewRatings(self.gameInfo, twoTeams, [1, 2])
+		self.cachedCalculator.calculateNewRatings(self.gameInfo, twoTeams, [1, 1])
+		self.cachedCalculator.calculateNewRatings(self.gameInfo, [Team(Player(1, 0.5), self.gameInfo.defaultRating), Team(Player(2), self.gameInfo.defaultRating)], [1, 2])
+		self.assertEqual(3, self.cache.misses)
+		self.assertEqual(0, self.cache.hits)
+
+	def test_leastRecentlyUsedEviction(self):
+		def play(teamSizes):
+			teams = [Team() for teamSize in teamSizes]
+			for team, teamSize in zip(teams, teamSizes):
+				for i in range(teamSize):
+					team.addPlayer(Player(i), self.gameInfo.defaultRating)
+			self.cachedCalculator.calculateNewRatings(self.gameInfo, teams, range(1, len(teams) + 1))
+		play([1, 1])
+		play([1, 2])
+		play([1, 1])
+		play([2, 2])
+		self.assertEqual(2, self.cache.size)
+		play([1, 1])
+		self.assertEqual(2, self.cache.hits)
+		play([1, 2])
+		self.assertEqual(4, self.cache.misses)
+
+class FlatFactorGraphTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+
+	def createTeams(self, teamSizes):
+		teams = list()
+		for teamIndex in range(len(teamSizes)):
+			team = Team()
+			for playerIndex in range(teamSizes[teamIndex]):
+				team.addPlayer(Player("%i-%i" % (teamIndex, playerIndex), 1.0 - 0.1 * playerIndex), Rating(20 + 3 * teamIndex + playerIndex, 8 - teamIndex))
+			teams.append(team)
+		return teams
+
+	def assertSameValue(self, expected, actual):
+		if isnan(expected):
+			self.assertTrue(isnan(actual))
+		else:
+			self.assertEqual(expected, actual)
+
+	def test_everyUpdateMatchesObjectGraph(self):
+		for teamSizes, teamRanks in (([1, 1], [1, 2]), ([2, 1, 3], [1, 2, 2]), ([1, 1, 1, 1], [1, 1, 3, 4])):
+			factorGraph = TrueSkillFactorGraph(self.gameInfo, self.createTeams(teamSizes), teamRanks)
+			factorGraph.buildGraph()
+			flatGraph = factorGraph.createFlatGraph()
+			self.assertEqual(len(factorGraph.factors), flatGraph.numberOfFactors)
+			for factor in factorGraph.factors + factorGraph.factors:
+				factorIndex = flatGraph.getFactorIndex(factor)
+				for messageIndex in range(factor.numberOfMessages):
+					self.assertSameValue(factor.updateMessage(messageIndex), flatGraph.updateMessage(factorIndex, messageIndex))
+					for variable in factor.variables:
+						marginal = flatGraph.getMarginal(variable)
+						self.assertSameValue(variable.value.precision, marginal.precision)
+						self.assertSameValue(variable.value.precisionMean, marginal.precisionMean)
+
+	def test_arraysBackendGivesSameRatings(self):
+		objectsCalculator = FactorGraphTrueSkillCalculator()
+		arraysCalculator = FactorGraphTrueSkillCalculator(FactorGraphCache(), FactorGraphBackend.ARRAYS)
+		for teamSizes, teamRanks in (([1, 1], [1, 2]), ([2, 2], [1, 1]), ([1, 2, 3, 1], [1, 2, 3, 4]), ([1, 2, 3, 1], [1, 2, 3, 4])):
+			teams = self.createTeams(teamSizes)
+			expected = objectsCalculator.calculateNewRatings(self.gameInfo, teams, teamRanks)
+			actual = arraysCalculator.calculateNewRatings(self.gameInfo, teams, teamRanks)
+			for (expectedPlayer, expectedRating), (actualPlayer, actualRating) in zip(expected, actual):
+				self.assertEqual(expectedPlayer, actualPlayer)
+				self.assertSameValue(expectedRating.mean, actualRating.mean)
+				self.assertSameValue(expectedRating.standardDeviation, actualRating.standardDeviation)
+
+	def test_compiledScheduleMatchesScheduleTree(self):
+		for teamSizes, teamRanks in (([1, 1], [1, 2]), ([2, 1, 3], [1, 2, 2]), ([1, 1, 1, 1], [1, 1, 3, 4])):
+			visitedGraph = TrueSkillFactorGraph(self.gameInfo, self.createTeams(teamSizes), teamRanks)
+			visitedGraph.buildGraph()
+			compiledGraph = TrueSkillFactorGraph(self.gameInfo, self.createTeams(teamSizes), teamRanks)
+			compiledGraph.buildGraph()
+			compiledSchedule = CompiledSchedule(compiledGraph._createFullSchedule())
+			self.assertSameValue(visitedGraph._createFullSchedule().visit(), compiledSchedule.run())
+			for visitedFactor, compiledFactor in zip(visitedGraph.factors, compiledGraph.factors):
+				for visitedVariable, compiledVariable in zip(visitedFactor.variables, compiledFactor.variables):
+					self.assertSameValue(visitedVariable.value.precision, compiledVariable.value.precision)
+					self.assertSameValue(visitedVariable.value.precisionMean, compiledVariable.value.precisionMean)
+
+class ConvergenceStatisticsTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		
+	def createTeams(self, teamSizes):
+		teams = list()
+		for teamIndex in range(len(teamSizes)):
+			team = Team()
+			for playerIndex in range(teamSizes[teamIndex]):
+				team.addPlayer(Player("%i-%i" % (teamIndex, playerIndex)), Rating(20 + 3 * teamIndex + playerIndex, 8 - teamIndex))
+			teams.append(team)
+		return teams
+		
+	def test_reportsEveryLoop(self):
+		for backend in (FactorGraphBackend.OBJECTS, FactorGraphBackend.ARRAYS):
+			statistics = ConvergenceStatistics()
+			calculator = FactorGraphTrueSkillCalculator(FactorGraphCache(), backend, statistics)
+			self.assertEqual(None, calculator.lastConvergenceReport)
+			calculator.calculateNewRatings(self.gameInfo, self.createTeams([1, 2, 1]), [1, 2, 3])
+			report = calculator.lastConvergenceReport
+			self.assertEqual(1, len(report.loops))
+			loop = report.loops[0]
+			self.assertEqual(loop.iterations, len(loop.passSeconds))
+			self.assertEqual(loop.iterations, report.iterations)
+			self.assertTrue(loop.iterations >= 1)
+			self.assertTrue(report.seconds >= loop.seconds)
+			self.assertEqual(loop.deltas[-1] <= loop.maxDelta, report.converged)
+			
+	def test_aggregatesByShape(self):
+		statistics = ConvergenceStatistics()
+		calculator = FactorGraphTrueSkillCalculator(convergenceStatistics = statistics)
+		for teamRanks in ([1, 2, 3], [1, 2, 3], [1, 1, 3]):
+			calculator.calculateNewRatings(self.gameInfo, self.createTeams([1, 1, 1]), teamRanks)
+		calculator.calculateNewRatings(self.gameInfo, self.createTeams([1, 1]), [1, 2])
+		self.assertEqual(4, statistics.calls)
+		self.assertEqual(3, len(statistics.shapes))
+		shapeStatistics = statistics.getShapeStatistics(self.createTeams([1, 1, 1]), [1, 2, 3])
+		self.assertEqual(2, shapeStatistics.calls)
+		self.assertTrue(shapeStatistics.maxIterations >= 1)
+		# two teams have no loop to iterate
+		self.assertEqual(0, statistics.getShapeStatistics(self.createTeams([1, 1]), [1, 2]).iterations)
+		self.assertEqual(None, statistics.getShapeStatistics(self.createTeams([2, 1]), [1, 2]))
+		
+class ConvergenceBudgetTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		self.teams = [Team(Player(i), Rating(25 + 5 * i, 8)) for i in range(4)]
+		
+	def runWithBudget(self, budget):
+		calculator = FactorGraphTrueSkillCalculator(convergenceBudget = budget)
+		ratings = calculator.calculateNewRatings(self.gameInfo, self.teams, [1, 2, 3, 4])
+		return ratings, calculator.lastConvergenceReport.loops[0]
+		
+	def test_unlimitedBudgetConverges(self):
+		ratings, loop = self.runWithBudget(ConvergenceBudget())
+		self.assertEqual(LoopStop.CONVERGED, loop.stoppedBy)
+		self.assertTrue(loop.iterations > 1)
+		
+	def test_maxIterationsStopsLoop(self):
+		ratings, loop = self.runWithBudget(ConvergenceBudget(maxIterations = 1))
+		self.assertEqual(1, loop.iterations)
+		self.assertEqual(LoopStop.MAX_ITERATIONS, loop.stoppedBy)
+		self.assertFalse(loop.converged)
+		self.assertEqual(4, len(ratings))
+		
+	def test_deadlineStopsLoop(self):
+		ratings, loop = self.runWithBudget(ConvergenceBudget(deadlineSeconds = 0))
+		self.assertEqual(1, loop.iterations)
+		self.assertEqual(LoopStop.DEADLINE, loop.stoppedBy)
+		
+	def test_toleranceReplacesMaxDelta(self):
+		ratings, loop = self.runWithBudget(ConvergenceBudget(tolerance = float("inf")))
+		self.assertEqual(1, loop.iterations)
+		self.assertEqual(float("inf"), loop.maxDelta)
+		self.assertTrue(loop.converged)
+		
+class FactorGraphProfilerTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		self.teams = [Team(Player(i), Rating(25 + 5 * i, 8)) for i in range(4)]
+		
+	def profile(self, backend):
+		calculator = FactorGraphTrueSkillCalculator(FactorGraphCache(), backend)
+		with FactorGraphProfiler() as profiler:
+			calculator.calculateNewRatings(self.gameInfo, self.teams, [1, 2, 3, 4])
+		return profiler
+		
+	def test_countsEveryStep(self):
+		graph = TrueSkillFactorGraph(self.gameInfo, self.teams, [1, 2, 3, 4])
+		graph.buildGraph()
+		with FactorGraphProfiler() as profiler:
+			graph._createFullSchedule().visit()
+		visited = self.profile(FactorGraphBackend.OBJECTS)
+		flat = self.profile(FactorGraphBackend.ARRAYS)
+		for compiled in (visited, flat):
+			self.assertEqual(sorted((name, calls) for name, (calls, seconds) in profiler.factorStatistics.items()),
+				sorted((name, calls) for name, (calls, seconds) in compiled.factorStatistics.items()))
+			self.assertEqual(sorted((name, calls) for name, (calls, seconds) in profiler.scheduleStatistics.items()),
+				sorted((name, calls) for name, (calls, seconds) in compiled.scheduleStatistics.items()))
+		self.assertEqual(4, profiler.factorStatistics["GaussianPriorFactor"][0])
+		self.assertEqual(1, profiler.scheduleStatistics["Full Schedule"][0])
+		self.assertAlmostEqual(profiler.seconds, profiler.scheduleStatistics["Full Schedule"][1])
+		
+	def test_stopsProfiling(self):
+		profiler = self.profile(FactorGraphBackend.OBJECTS)
+		self.assertFalse(profiler.started)
+		calls = profiler.factorStatistics["GaussianPriorFactor"][0]
+		FactorGraphTrueSkillCalculator().calculateNewRatings(self.gameInfo, self.teams, [1, 2, 3, 4])
+		self.assertEqual(calls, profiler.factorStatistics["GaussianPriorFactor"][0])
+		profiler.reset()
+		self.assertEqual(0.0, profiler.seconds)
+		
+	def test_threadsKeepTheirOwnStacks(self):
+		class SlowFactor(Factor):
+			def updateMessage(self, messageIndex):
+				# gives the other thread a chance to push its schedules in between
+				time.sleep(0.001)
+				return 0.0
+		schedules = [ScheduleSequence(name, [ScheduleSequence(name + " inner", [ScheduleStep("step", SlowFactor(name), 0)])])
+			for name in ("first", "second")]
+		def visitRepeatedly(schedule):
+			for i in range(20):
+				schedule.visit()
+		with FactorGraphProfiler() as profiler:
+			threads = [threading.Thread(target = visitRepeatedly, args = (schedule,)) for schedule in schedules]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		self.assertEqual(["first;first inner;SlowFactor", "second;second inner;SlowFactor"],
+			[line.rsplit(" ", 1)[0] for line in profiler.collapsedStacks().split("\n")])
+		self.assertEqual(40, profiler.factorStatistics["SlowFactor"][0])
+		self.assertEqual(20, profiler.scheduleStatistics["second inner"][0])
+		
+	def test_exports(self):
+		profiler = self.profile(FactorGraphBackend.OBJECTS)
+		table = profiler.table()
+		self.assertTrue("GaussianWeightedSumFactor" in table)
+		self.assertTrue("Full Schedule" in table)
+		for line in profiler.collapsedStacks().split("\n"):
+			stack, microseconds = line.rsplit(" ", 1)
+			self.assertTrue(stack.startswith("Full Schedule;"))
+			self.assertTrue(stack.split(";")[-1] in profiler.factorStatistics)
+			self.assertTrue(int(microseconds) >= 0)
+			
+class ReplayTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		
+	def test_readJsonLines(self):
+		lines = StringIO('{"teams": [["a"], ["b", "c"]], "ranks": [2, 1]}\n\n{"teams": [["a"], ["b"], ["c"]], "ranks": [1, 1, 2]}\n')
+		matches = list(readJsonLines(lines))
+		self.assertEqual(2, len(matches))
+		self.assertEqual([["a"], ["b", "c"]], matches[0].teams)
+		self.assertEqual([2, 1], matches[0].ranks)
+		self.assertEqual([1, 1, 2], matches[1].ranks)
+		
+	def test_readCsv(self):
+		lines = StringIO("match,team,player,rank\n1,x,a,1\n1,y,b,2\n1,y,c,2\n2,0,c,1\n2,1,a,2\n2,2,b,3\n")
+		matches = list(readCsv(lines))
+		self.assertEqual(2, len(matches))
+		self.assertEqual([["a"], ["b", "c"]], matches[0].teams)
+		self.assertEqual([1, 2], matches[0].ranks)
+		self.assertEqual([["c"], ["a"], ["b"]], matches[1].teams)
+		self.assertEqual([1, 2, 3], matches[1].ranks)
+		
+	def test_replayMatchesCallingCalculators(self):
+		matches = [ReplayMatch([["a"], ["b"]], [1, 2]),
+			ReplayMatch([["a", "c"], ["b"]], [2, 1]),
+			ReplayMatch([["a"], ["b"], ["c"]], [1, 2, 2])]
+		engine = ReplayEngine(self.gameInfo)
+		statistics = engine.replay(iter(matches))
+		self.assertEqual(3, statistics.matches)
+		self.assertEqual({"TwoPlayerTrueSkillCalculator": 1, "TwoTeamTrueSkillCalculator": 1, "FactorGraphTrueSkillCalculator": 1},
+			statistics.matchesByCalculator)
+		
+		ratings = dict()
+		calculators = [TwoPlayerTrueSkillCalculator(), TwoTeamTrueSkillCalculator(), FactorGraphTrueSkillCalculator()]
+		for match, calculator in zip(matches, calculators):
+			teams = list()
+			for playerIds in match.teams:
+				team = Team()
+				for playerId in playerIds:
+					team.addPlayer(Player(playerId), ratings.get(playerId, self.gameInfo.defaultRating))
+				teams.append(team)
+			for player, rating in calculator.calculateNewRatings(self.gameInfo, teams, match.ranks):
+				ratings[player.id] = rating
+		
+		self.assertEqual(3, len(engine.store))
+		for playerId, rating in ratings.items():
+			self.assertEqual(rating.mean, engine.store.get(playerId, None).mean)
+			self.assertEqual(rating.standardDeviation, engine.store.get(playerId, None).standardDeviation)
+		
+class ParallelReplayTests(unittest.TestCase):
+	def createMatches(self, count):
+		generator = random.Random(7)
+		matches = list()
+		for i in range(count):
+			teamCount = generator.choice([2, 2, 3, 4])
+			playersPerTeam = generator.choice([1, 1, 2])
+			playerIds = generator.sample(range(40), teamCount * playersPerTeam)
+			teams = [[str(playerId) for playerId in playerIds[j * playersPerTeam:(j + 1) * playersPerTeam]] for j in range(teamCount)]
+			matches.append(ReplayMatch(teams, [generator.randint(1, teamCount) for j in range(teamCount)]))
+		return matches
+		
+	def test_batchesAreConflictFreeAndInOrder(self):
+		matches = self.createMatches(200)
+		batches = list(groupIntoConflictFreeBatches(iter(matches), 5))
+		self.assertEqual(matches, [match for batch in batches for match in batch])
+		for batch in batches:
+			self.assertTrue(len(batch) <= 5)
+			playerIds = [playerId for match in batch for team in match.teams for playerId in team]
+			self.assertEqual(len(playerIds), len(set(playerIds)))
+		
+	def test_parallelReplayMatchesSequentialReplay(self):
+		gameInfo = defaultGameInfo()
+		matches = self.createMatches(150)
+		sequentialEngine = ReplayEngine(gameInfo, ArrayRatingStore())
+		sequentialEngine.replay(matches)
+		parallelEngine = ReplayEngine(gameInfo, ArrayRatingStore())
+		statistics = parallelEngine.replayParallel(iter(matches), processes = 2)
+		self.assertEqual(150, statistics.matches)
+		self.assertEqual(sequentialEngine.statistics.matchesByCalculator, statistics.matchesByCalculator)
+		self.assertEqual(sequentialEngine.store.playerIds, parallelEngine.store.playerIds)
+		for playerId in sequentialEngine.store.playerIds:
+			self.assertSameValue(sequentialEngine.store.get(playerId, None).mean, parallelEngine.store.get(playerId, None).mean)
+			self.assertSameValue(sequentialEngine.store.get(playerId, None).standardDeviation, parallelEngine.store.get(playerId, None).standardDeviation)
+		
+	def assertSameValue(self, expected, actual):
+		if isnan(expected):
+			self.assertTrue(isnan(actual))
+		else:
+			self.assertEqual(expected, actual)
+		
+class RatingServiceTests(unittest.TestCase):
+	def createMatch(self, generator, teamSizes):
+		teams = list()
+		for teamIndex in range(len(teamSizes)):
+			team = Team()
+			for playerIndex in range(teamSizes[teamIndex]):
+				team.addPlayer(Player("%i-%i" % (teamIndex, playerIndex)), Rating(generator.gauss(25.0, 8.0), generator.uniform(1.0, 8.0)))
+			teams.append(team)
+		return (teams, [generator.randint(1, len(teamSizes)) for team in teams])
+		
+	def assertSameRatings(self, expected, actual):
+		self.assertEqual([player.id for player, rating in expected], [player.id for player, rating in actual])
+		for (expectedPlayer, expectedRating), (actualPlayer, actualRating) in zip(expected, actual):
+			for expectedValue, actualValue in ((expectedRating.mean, actualRating.mean), (expectedRating.standardDeviation, actualRating.standardDeviation)):
+				if isnan(expectedValue):
+					self.assertTrue(isnan(actualValue))
+				else:
+					self.assertAlmostEqual(expectedValue, actualValue, delta = 1e-12)
+		
+	def getExpectedRatings(self, gameInfo, teams, teamRanks):
+		if len(teams) == 2 and teams[0].size == 1 and teams[1].size == 1:
+			calculator = TwoPlayerTrueSkillCalculator()
+		elif len(teams) == 2:
+			calculator = TwoTeamTrueSkillCalculator()
+		else:
+			calculator = FactorGraphTrueSkillCalculator()
+		return calculator.calculateNewRatings(gameInfo, teams, teamRanks)
+		
+	def test_concurrentRequestsAreBatched(self):
+		gameInfo = defaultGameInfo()
+		generator = random.Random(21)
+		matches = [self.createMatch(generator, generator.choice([[1, 1], [1, 1], [2, 3], [1, 1, 1]])) for i in range(60)]
+		with RatingService(gameInfo, batchWindowSeconds = 0.05) as service:
+			futures = [service.submit(teams, teamRanks) for teams, teamRanks in matches]
+			for (teams, teamRanks), future in zip(matches, futures):
+				self.assertSameRatings(self.getExpectedRatings(gameInfo, teams, teamRanks), future.result(5.0))
+		statistics = service.statistics
+		self.assertEqual(60, statistics.requests)
+		self.assertTrue(statistics.batches < 60)
+		self.assertEqual(60, statistics.latency.count)
+		self.assertEqual(60, statistics.queueLatency.count)
+		self.assertEqual(0, service.pending)
+		
+	def test_invalidRequestOnlyFailsItsOwnFuture(self):
+		gameInfo = defaultGameInfo()
+		generator = random.Random(22)
+		goodTeams, goodRanks = self.createMatch(generator, [1, 1])
+		badTeams, badRanks = self.createMatch(generator, [1, 1])
+		with RatingService(gameInfo, batchWindowSeconds = 0.05) as service:
+			badFuture = service.submit(badTeams, [1, 2, 3])
+			goodFuture = service.submit(goodTeams, goodRanks)
+			self.assertTrue(isinstance(badFuture.exception(5.0), ValueError))
+			self.assertRaises(ValueError, badFuture.result)
+			self.assertSameRatings(self.getExpectedRatings(gameInfo, goodTeams, goodRanks), goodFuture.result(5.0))
+		
+	def test_backpressure(self):
+		generator = random.Random(23)
+		service = RatingService(defaultGameInfo(), batchWindowSeconds = 60.0, maxPending = 2)
+		service.start()
+		futures = [service.submit(*self.createMatch(generator, [1, 1])) for i in range(2)]
+		self.assertEqual(2, service.pending)
+		self.assertRaises(RatingServiceBusy, service.submit, *self.createMatch(generator, [1, 1]), block = False)
+		self.assertRaises(RatingServiceBusy, service.submit, *self.createMatch(generator, [1, 1]), timeout = 0.01)
+		callbackFutures = list()
+		futures[0].addDoneCallback(callbackFutures.append)
+		service.stop()
+		self.assertTrue(futures[0].done() and futures[1].done())
+		self.assertEqual([futures[0]], callbackFutures)
+		self.assertRaises(RuntimeError, service.submit, *self.createMatch(generator, [1, 1]))
+		
+	def test_raisingCallbacksOnlyGetLogged(self):
+		gameInfo = defaultGameInfo()
+		generator = random.Random(24)
+		records = list()
+		handler = logging.Handler()
+		handler.emit = records.append
+		logging.getLogger("service").addHandler(handler)
+		def raiseError(future):
+			raise ValueError("callback")
+		try:
+			with RatingService(gameInfo, batchWindowSeconds = 0.2) as service:
+				firstTeams, firstRanks = self.createMatch(generator, [1, 1])
+				secondTeams, secondRanks = self.createMatch(generator, [1, 1])
+				firstFuture = service.submit(firstTeams, firstRanks)
+				secondFuture = service.submit(secondTeams, secondRanks)
+				badFuture = service.submit(secondTeams, [1, 2, 3])
+				firstFuture.addDoneCallback(raiseError)
+				badFuture.addDoneCallback(raiseError)
+				self.assertSameRatings(self.getExpectedRatings(gameInfo, firstTeams, firstRanks), firstFuture.result(5.0))
+				self.assertSameRatings(self.getExpectedRatings(gameInfo, secondTeams, secondRanks), secondFuture.result(5.0))
+				self.assertTrue(isinstance(badFuture.exception(5.0), ValueError))
+				self.assertSameRatings(self.getExpectedRatings(gameInfo, firstTeams, firstRanks), service.rate(firstTeams, firstRanks, 5.0))
+				self.assertEqual(0, service.pending)
+		finally:
+			logging.getLogger("service").removeHandler(handler)
+		self.assertEqual(2, len(records))
+		
+	def test_unixSocketClients(self):
+		gameInfo = defaultGameInfo()
+		directory = tempfile.mkdtemp()
+		try:
+			with RatingService(gameInfo, batchWindowSeconds = 0.01) as service:
+				server = RatingServiceServer(service, os.path.join(directory, "ratings.sock"))
+				serverThread = threading.Thread(target = server.serve_forever)
+				serverThread.start()
+				results = dict()
+				def runClient(clientNumber):
+					generator = random.Random(clientNumber)
+					with RatingServiceClient(os.path.join(directory, "ratings.sock"), 5.0) as client:
+						for i in range(10):
+							teams, teamRanks = self.createMatch(generator, generator.choice([[1, 1], [2, 2]]))
+							results[(clientNumber, i)] = (self.getExpectedRatings(gameInfo, teams, teamRanks), client.rate(teams, teamRanks))
+				clients = [threading.Thread(target = runClient, args = (clientNumber,)) for clientNumber in range(4)]
+				for client in clients:
+					client.start()
+				for client in clients:
+					client.join()
+				server.shutdown()
+				server.server_close()
+				serverThread.join()
+			self.assertEqual(40, len(results))
+			for expected, actual in results.itervalues():
+				self.assertSameRatings(expected, actual)
+			self.assertEqual(40, service.statistics.requests)
+		finally:
+			shutil.rmtree(directory)
+		
+	def test_latencyHistogram(self):
+		histogram = LatencyHistogram()
+		self.assertEqual(0.0, histogram.percentile(50))
+		for i in range(1, 101):
+			histogram.record(i / 1000.0)
+		self.assertEqual(100, histogram.count)
+		self.assertAlmostEqual(0.0505, histogram.mean)
+		self.assertEqual(0.1, histogram.max)
+		self.assertTrue(0.050 <= histogram.percentile(50) <= 0.050 * 2.0**0.25)
+		self.assertTrue(0.099 <= histogram.percentile(99) <= 0.1)
+		self.assertEqual(100, sum(count for upperBound, count in histogram.buckets))
+		
+class ArrayRatingStoreTests(unittest.TestCase):
+	def test_putAndGet(self):
+		store = ArrayRatingStore()
+		defaultRating = Rating(25, 8)
+		self.assertTrue(store.get("a", defaultRating) is defaultRating)
+		store.put("a", Rating(30, 4), 12.0)
+		store.put("b", Rating(20, 6))
+		self.assertEqual(2, len(store))
+		self.assertEqual(0, store.getSlot("a"))
+		rating = store.get("a", defaultRating)
+		self.assertEqual(30, rating.mean)
+		self.assertEqual(4, rating.standardDeviation)
+		self.assertEqual(18, rating.conservativeRating)
+		self.assertEqual(16, rating.getVariance())
+		self.assertEqual(12.0, store.getLastPlayed("a"))
+		self.assertEqual(None, store.getLastPlayed("b"))
+		rating.mean = 31
+		self.assertEqual(31, store.get("a", defaultRating).mean)
+		
+	def test_getManyAndPutMany(self):
+		store = ArrayRatingStore()
+		store.putMany(["a", "b"], [30.0, 20.0], [4.0, 6.0], 3.0)
+		self.assertEqual(([30.0, 25.0, 20.0], [4.0, 8.0, 6.0]), store.getMany(["a", "c", "b"], Rating(25, 8)))
+		self.assertEqual(3.0, store.getLastPlayed("b"))
+		
+	def test_replayGivesSameRatingsAsObjectStore(self):
+		gameInfo = defaultGameInfo()
+		matches = [ReplayMatch([["a"], ["b"]], [1, 2]), ReplayMatch([["a", "c"], ["b", "d"]], [2, 1]),
+			ReplayMatch([["a"], ["b"], ["d"]], [1, 2, 3])]
+		objectEngine = ReplayEngine(gameInfo)
+		objectEngine.replay(matches)
+		arrayEngine = ReplayEngine(gameInfo, ArrayRatingStore())
+		arrayEngine.replay(matches)
+		for playerId in ["a", "b", "c", "d"]:
+			self.assertEqual(objectEngine.store.get(playerId, None).mean, arrayEngine.store.get(playerId, None).mean)
+			self.assertEqual(objectEngine.store.get(playerId, None).standardDeviation, arrayEngine.store.get(playerId, None).standardDeviation)
+		self.assertTrue(arrayEngine.store.bytesPerPlayer > 0)
+		
+class RatingSnapshotTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "ratings.snapshot")
+		
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		
+	def test_writeAndRead(self):
+		gameInfo = GameInfo(1200.0, 400.0, 200.0, 4.0, 0.05)
+		store = ArrayRatingStore()
+		store.put("carol", Rating(1300.5, 100.25))
+		store.put(u"alice", Rating(1100.0, 350.0))
+		store.put(42, Rating(900.0, 80.0))
+		writeSnapshot(self.path, gameInfo, store, 17)
+		self.assertEqual([], [name for name in os.listdir(self.directory) if name.endswith(".tmp")])
+		with RatingSnapshot(self.path) as snapshot:
+			self.assertEqual(3, len(snapshot))
+			self.assertEqual(17, snapshot.matchCount)
+			self.assertEqual(1200.0, snapshot.gameInfo.initialMean)
+			self.assertEqual(0.05, snapshot.gameInfo.drawProbability)
+			self.assertEqual(1300.5, snapshot.get("carol", None).mean)
+			self.assertEqual(100.25, snapshot.get("carol", None).standardDeviation)
+			self.assertEqual(1100.0, snapshot.get("alice", None).mean)
+			self.assertEqual(900.0, snapshot.get(42, None).mean)
+			self.assertEqual(None, snapshot.get("bob", None))
+			restored = snapshot.toArrayRatingStore()
+		self.assertEqual(["carol", "alice", 42], restored.playerIds)
+		self.assertEqual(350.0, restored.get("alice", None).standardDeviation)
+		
+	def test_idsKeepTheirType(self):
+		store = ArrayRatingStore()
+		store.put(1, Rating(29.5, 7.0))
+		store.put("1", Rating(20.0, 6.0))
+		store.put(u"j\xf6rg", Rating(31.0, 5.0))
+		store.put("j\xc3\xb6rg", Rating(18.0, 4.0))
+		store.put(2 ** 70, Rating(22.0, 3.0))
+		writeSnapshot(self.path, defaultGameInfo(), store)
+		with RatingSnapshot(self.path) as snapshot:
+			self.assertEqual(29.5, snapshot.get(1, None).mean)
+			self.assertEqual(20.0, snapshot.get("1", None).mean)
+			self.assertEqual(31.0, snapshot.get(u"j\xf6rg", None).mean)
+			self.assertEqual(None, snapshot.get((1,), None))
+			restored = snapshot.toArrayRatingStore()
+		self.assertEqual([1, "1", u"j\xf6rg", "j\xc3\xb6rg", 2 ** 70], restored.playerIds)
+		self.assertEqual([int, str, unicode, str, long], [type(playerId) for playerId in restored.playerIds])
+		self.assertTrue(1 in restored)
+		self.assertEqual(29.5, restored.get(1, None).mean)
+		self.assertEqual(18.0, restored.get("j\xc3\xb6rg", None).mean)
+		
+	def test_rejectsOtherIds(self):
+		store = ArrayRatingStore()
+		store.put((1, 2), Rating(25.0, 8.0))
+		self.assertRaises(TypeError, writeSnapshot, self.path, defaultGameInfo(), store)
+		self.assertFalse(os.path.exists(self.path))
+		
+	def test_checkpointedReplayResumes(self):
+		gameInfo = defaultGameInfo()
+		matches = [ReplayMatch([["a"], ["b"]], [1, 2]), ReplayMatch([["a", "c"], ["b", "d"]], [2, 1]),
+			ReplayMatch([["c"], ["b"]], [1, 1]), ReplayMatch([["a"], ["d"]], [2, 1]), ReplayMatch([["b"], ["c"]], [1, 2])]
+		fullEngine = ReplayEngine(gameInfo, ArrayRatingStore())
+		statistics = fullEngine.replay(matches, self.path, 2)
+		self.assertEqual(3, statistics.checkpoints)
+		
+		firstEngine = ReplayEngine(gameInfo, ArrayRatingStore())
+		firstEngine.replay(matches[:3], self.path, 2)
+		with RatingSnapshot(self.path) as snapshot:
+			self.assertEqual(3, snapshot.matchCount)
+			resumedEngine = ReplayEngine(snapshot.gameInfo, snapshot.toArrayRatingStore(), matchCount = snapshot.matchCount)
+		resumedEngine.replay(matches[3:])
+		self.assertEqual(5, resumedEngine.matchCount)
+		for playerId in ["a", "b", "c", "d"]:
+			self.assertEqual(fullEngine.store.get(playerId, None).mean, resumedEngine.store.get(playerId, None).mean)
+			self.assertEqual(fullEngine.store.get(playerId, None).standardDeviation, resumedEngine.store.get(playerId, None).standardDeviation)
+		
+	def test_rejectsOtherFiles(self):
+		with open(self.path, "wb") as otherFile:
+			otherFile.write(b"not a snapshot, but long enough to hold a whole header of one" * 2)
+		self.assertRaises(ValueError, RatingSnapshot, self.path)
+		
+class MatchmakerTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		
+	def test_qualityBatchMatchesCalculators(self):
+		ratings = [Rating(25, 8), Rating(30, 3), Rating(18, 5.5), Rating(26, 2)]
+		calculator = TwoPlayerTrueSkillCalculator()
+		qualities = calculator.calculateMatchQualityBatch(self.gameInfo, [r.mean for r in ratings[:2]], [r.standardDeviation for r in ratings[:2]],
+			[r.mean for r in ratings[2:]], [r.standardDeviation for r in ratings[2:]])
+		for i in range(2):
+			self.assertEqual(calculator.calculateMatchQuality(self.gameInfo, [Team(Player(1), ratings[i]), Team(Player(2), ratings[i + 2])]), qualities[i])
+		team1 = Team(Player(1), ratings[0])
+		team1.addPlayer(Player(2), ratings[1])
+		team2 = Team(Player(3), ratings[2])
+		calculator = TwoTeamTrueSkillCalculator()
+		qualities = calculator.calculateMatchQualityBatch(self.gameInfo, [team1.meanSum], [team1.standardDeviationSquaredSum],
+			[team2.meanSum], [team2.standardDeviationSquaredSum], [3])
+		self.assertEqual(calculator.calculateMatchQuality(self.gameInfo, [team1, team2]), qualities[0])
+		
+	def test_pairsClosestPlayers(self):
+		matchmaker = Matchmaker(self.gameInfo)
+		for playerId, mean in (("a", 10.0), ("b", 40.0), ("c", 11.0), ("d", 39.0), ("e", 60.0)):
+			matchmaker.enqueue(playerId, Rating(mean, 2.0), 0.0)
+		matches = matchmaker.tick(0.0)
+		self.assertEqual(set([("a", "c"), ("d", "b")]), set((match.teams[0][0], match.teams[1][0]) for match in matches))
+		self.assertEqual(1, len(matchmaker))
+		self.assertTrue("e" in matchmaker)
+		
+	def test_waitingLowersRequiredQuality(self):
+		matchmaker = Matchmaker(self.gameInfo, minQuality = 0.5, minQualityFloor = 0.0, qualityDecayPerSecond = 0.01)
+		matchmaker.enqueue("a", Rating(20.0, 2.0), 0.0)
+		matchmaker.enqueue("b", Rating(30.0, 2.0), 0.0)
+		self.assertEqual([], matchmaker.tick(1.0))
+		matches = matchmaker.tick(60.0)
+		self.assertEqual(1, len(matches))
+		self.assertTrue(matches[0].quality < 0.5)
+		self.assertEqual(0, len(matchmaker))
+		
+	def test_teamAssignment(self):
+		matchmaker = Matchmaker(self.gameInfo, playersPerTeam = 2, minQuality = 0.3)
+		for playerId in range(9):
+			matchmaker.enqueue(playerId, Rating(20.0 + playerId, 3.0), 0.0)
+		matches = matchmaker.tick(0.0)
+		self.assertEqual(2, len(matches))
+		playerIds = [playerId for match in matches for team in match.teams for playerId in team]
+		self.assertEqual(8, len(set(playerIds)))
+		for match in matches:
+			self.assertEqual([2, 2], [len(team) for team in match.teams])
+			self.assertTrue(match.quality >= 0.3)
+		self.assertEqual(1, len(matchmaker))
+		
+class RatingIndexTests(unittest.TestCase):
+	def setUp(self):
+		self.gameInfo = defaultGameInfo()
+		generator = random.Random(11)
+		self.store = ArrayRatingStore()
+		for playerId in range(500):
+			self.store.put(playerId, Rating(generator.gauss(25.0, 8.0), generator.uniform(0.5, 8.0)))
+		self.index = RatingIndex.fromStore(self.gameInfo, self.store)
+		
+	def getAllQualities(self, rating, excludePlayerId):
+		calculator = TwoPlayerTrueSkillCalculator()
+		qualities = list()
+		for playerId, otherRating in self.store.iterRatings():
+			if playerId != excludePlayerId:
+				qualities.append((calculator.calculateMatchQuality(self.gameInfo, [Team(Player(0), rating), Team(Player(1), otherRating)]), playerId))
+		qualities.sort(reverse = True)
+		return qualities
+		
+	def test_findOpponentsMatchesFullScan(self):
+		for playerId in (0, 17, 250):
+			rating = self.store.get(playerId, None)
+			for minQuality in (0.2, 0.5, 0.8):
+				expected = [entry for entry in self.getAllQualities(rating, playerId) if entry[0] >= minQuality]
+				self.assertEqual(expected, self.index.findOpponents(rating, minQuality, playerId))
+		
+	def test_findBestOpponentsMatchesFullScan(self):
+		for playerId in (3, 99, 400):
+			rating = self.store.get(playerId, None)
+			for count in (1, 10):
+				expected = self.getAllQualities(rating, playerId)[:count]
+				self.assertEqual([entry[0] for entry in expected], [entry[0] for entry in self.index.findBestOpponents(rating, count, playerId)])
+		
+	def test_putAndRemove(self):
+		self.index.put(0, Rating(1000.0, 1.0))
+		self.assertEqual([0], [playerId for quality, playerId in self.index.findOpponents(Rating(1000.0, 1.0), 0.5)])
+		self.assertTrue(self.index.remove(0))
+		self.assertFalse(self.index.remove(0))
+		self.assertEqual(499, len(self.index))
+		self.assertEqual([], self.index.findOpponents(Rating(1000.0, 1.0), 0.01))
+		
+class LeaderboardTests(unittest.TestCase):
+	def getSortedEntries(self, ratings):
+		return sorted(((-rating.conservativeRating, playerId) for playerId, rating in ratings.items()))
+		
+	def test_matchesFullSort(self):
+		generator = random.Random(5)
+		leaderboard = Leaderboard(seed = 1)
+		ratings = dict()
+		for step in range(2000):
+			playerId = generator.randrange(300)
+			if generator.random() < 0.1:
+				self.assertEqual(playerId in ratings, leaderboard.remove(playerId))
+				ratings.pop(playerId, None)
+			else:
+				rating = Rating(generator.gauss(25.0, 8.0), generator.uniform(1.0, 8.0))
+				ratings[playerId] = rating
+				leaderboard.update(playerId, rating)
+		entries = self.getSortedEntries(ratings)
+		self.assertEqual(len(entries), len(leaderboard))
+		for rank, (negativeConservativeRating, playerId) in enumerate(entries):
+			self.assertEqual(rank + 1, leaderboard.getRank(playerId))
+		self.assertEqual([(rank + 1, playerId, -negativeConservativeRating) for rank, (negativeConservativeRating, playerId) in enumerate(entries)],
+			leaderboard.getPage(1, len(entries) + 5))
+		self.assertEqual([entry[1] for entry in entries[10:15]], [playerId for rank, playerId, conservativeRating in leaderboard.getPage(11, 5)])
+		self.assertEqual([], leaderboard.getPage(len(entries) + 1, 5))
+		self.assertEqual(None, leaderboard.getRank(1000))
+		
+	def test_replayKeepsLeaderboardCurrent(self):
+		leaderboard = Leaderboard()
+		engine = ReplayEngine(defaultGameInfo(), leaderboard = leaderboard)
+		engine.replay([ReplayMatch([["a"], ["b"]], [1, 2]), ReplayMatch([["a", "c"], ["b", "d"]], [1, 2])])
+		ratings = dict((playerId, engine.store.get(playerId, None)) for playerId in ["a", "b", "c", "d"])
+		self.assertEqual([playerId for key, playerId in self.getSortedEntries(ratings)], [playerId for rank, playerId, conservativeRating in leaderboard.getTop(4)])
+		self.assertEqual(1, leaderboard.getRank("a"))
+		
+class GameInfoProfileTests(unittest.TestCase):
+	def test_profileIsCachedAndInvalidated(self):
+		gameInfo = defaultGameInfo()
+		profile = gameInfo.profile
+		self.assertTrue(profile is gameInfo.profile)
+		self.assertEqual(gameInfo.beta**2.0, profile.betaSquared)
+		self.assertEqual(2.0*gameInfo.beta**2.0, profile.twoBetaSquared)
+		self.assertEqual(gameInfo.dynamicsFactor**2.0, profile.tauSquared)
+		self.assertEqual(getDrawMarginFromDrawProbability(gameInfo.drawProbability, gameInfo.beta), profile.drawMargin)
+		gameInfo.beta = 5.0
+		self.assertFalse(profile is gameInfo.profile)
+		self.assertEqual(25.0, gameInfo.profile.betaSquared)
+		gameInfo.drawProbability = 0.25
+		self.assertEqual(getDrawMarginFromDrawProbability(0.25, 5.0), gameInfo.profile.drawMargin)
+		gameInfo.dynamicsFactor = 0.5
+		self.assertEqual(0.25, gameInfo.profile.tauSquared)
+		self.assertRaises(AttributeError, setattr, gameInfo.profile, "betaSquared", 1.0)
+		
+	def test_pickledAfterRating(self):
+		gameInfo = defaultGameInfo()
+		TwoPlayerTrueSkillCalculator().calculateNewRatings(gameInfo, [Team(Player(1), gameInfo.defaultRating),
+			Team(Player(2), gameInfo.defaultRating)], [1, 2])
+		self.assertFalse(gameInfo._profile is None)
+		for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+			restored = pickle.loads(pickle.dumps(gameInfo, protocol))
+			self.assertEqual(gameInfo.beta, restored.beta)
+			self.assertEqual(gameInfo.drawProbability, restored.drawProbability)
+			self.assertEqual(gameInfo.profile.drawMargin, restored.profile.drawMargin)
+		
+class FastNumericsTests(unittest.TestCase):
+	def assertWithin(self, expected, actual, tolerance):
+		# absolute below 1, relative above, like the bounds documented in fastnumerics
+		self.assertTrue(abs(expected - actual) <= tolerance * max(1.0, abs(expected)), "%r != %r" % (expected, actual))
+		
+	def test_functionsMatchExactPath(self):
+		for i in range(-380, 381):
+			x = i / 10.0
+			self.assertWithin(cumulativeTo(x), fastnumerics.cumulativeTo(x), fastnumerics.maxCumulativeToError)
+			self.assertWithin(at(x), fastnumerics.at(x), fastnumerics.maxAtError)
+		probabilities = [10.0**-k for k in range(1, 300)] + [i / 100.0 for i in range(1, 100)] + [1.0 - 10.0**-k for k in range(1, 15)]
+		for probability in probabilities:
+			self.assertWithin(inverseCumulativeTo(probability), fastnumerics.inverseCumulativeTo(probability), fastnumerics.maxInverseCumulativeToError)
+		self.assertWithin(inverseCumulativeTo(0.3, 25.0, 8.0), fastnumerics.inverseCumulativeTo(0.3, 25.0, 8.0), fastnumerics.maxInverseCumulativeToError)
+		
+	def test_fusedCorrectionsMatchExactPath(self):
+		tolerance = fastnumerics.maxTruncatedGaussianError
+		for i in range(-300, 301):
+			difference = i / 10.0
+			for drawMargin in (0.0, 0.1, 0.74, 2.0, 10.0):
+				for exact, fast in zip(vwExceedsMargin(difference, drawMargin), fastnumerics.vwExceedsMargin(difference, drawMargin)):
+					self.assertWithin(exact, fast, tolerance)
+				if drawMargin > 0:
+					for exact, fast in zip(vwWithinMargin(difference, drawMargin), fastnumerics.vwWithinMargin(difference, drawMargin)):
+						self.assertWithin(exact, fast, tolerance)
+		for exact, fast in zip(vwExceedsMargin(3.0, 0.5, 2.0), fastnumerics.vwExceedsMargin(3.0, 0.5, 2.0)):
+			self.assertWithin(exact, fast, tolerance)
+		
+	def test_calculatorsMatchExactPath(self):
+		gameInfo = defaultGameInfo()
+		random.seed(20)
+		for exactCalculator, fastCalculator, playersPerTeam in (
+				(TwoPlayerTrueSkillCalculator(), TwoPlayerTrueSkillCalculator(NumericsMode.FAST), 1),
+				(TwoTeamTrueSkillCalculator(), TwoTeamTrueSkillCalculator(NumericsMode.FAST), 3)):
+			self.assertEqual(NumericsMode.FAST, fastCalculator.numerics)
+			for game in range(50):
+				teams = list()
+				for teamIndex in range(2):
+					team = Team()
+					for playerIndex in range(playersPerTeam):
+						team.addPlayer(Player((teamIndex, playerIndex)), Rating(random.gauss(25.0, 10.0), random.uniform(0.5, 8.0)))
+					teams.append(team)
+				teamRanks = [1, random.choice([1, 2])]
+				exactRatings = dict(exactCalculator.calculateNewRatings(gameInfo, teams, teamRanks))
+				for player, rating in fastCalculator.calculateNewRatings(gameInfo, teams, teamRanks):
+					self.assertAlmostEqual(exactRatings[player].mean, rating.mean, delta = 1e-9)
+					self.assertAlmostEqual(exactRatings[player].standardDeviation, rating.standardDeviation, delta = 1e-9)
+		
+	def test_unknownModeRaises(self):
+		self.assertRaises(ValueError, TwoPlayerTrueSkillCalculator, 2)
+		
+class ImportTests(unittest.TestCase):
+	def importInNewInterpreter(self, moduleName):
+		'''(modules loaded, whether sys.path changed) by importing moduleName in a new interpreter'''
+		code = "import sys; before = set(sys.modules); path = list(sys.path); import %s; " \
+			"print(' '.join(sorted(set(sys.modules) - before))); print(path != sys.path)" % moduleName
+		output = subprocess.check_output([sys.executable, "-c", code], cwd = os.path.dirname(os.path.abspath(__file__)))
+		lines = output.decode("ascii").splitlines()
+		return (lines[0].split(), lines[1] == "True")
+		
+	def test_simpleCalculatorsSkipFactorGraph(self):
+		loaded, pathChanged = self.importInNewInterpreter("trueskill_simple")
+		self.assertFalse(pathChanged)
+		for name in loaded:
+			self.assertFalse(name.startswith("trueskill_factorgraph") or name in ("factorgraphs", "numbers"), name)
+			
+	def test_packageImportIsLazy(self):
+		loaded, pathChanged = self.importInNewInterpreter("trueskill_factorgraph")
+		self.assertFalse(pathChanged)
+		self.assertEqual(["trueskill_factorgraph"], [name for name in loaded if name.startswith("trueskill_factorgraph")])
+		loaded, pathChanged = self.importInNewInterpreter("trueskill_factorgraph.ts_factorgraph")
+		self.assertFalse(pathChanged)
+		self.assertTrue("trueskill_factorgraph.layers" in loaded)
+		
+	def test_packageLoadsModulesOnAttributeAccess(self):
+		code = "import sys; import trueskill_factorgraph; " \
+			"before = sorted(name for name in sys.modules if name.startswith('trueskill_factorgraph.')); " \
+			"calculator = trueskill_factorgraph.ts_factorgraph.FactorGraphTrueSkillCalculator; " \
+			"from trueskill_factorgraph import graphcache; " \
+			"print(before); print(calculator.__name__ + ' ' + graphcache.FactorGraphCache.__name__); " \
+			"print(hasattr(trueskill_factorgraph, 'missing'))"
+		output = subprocess.check_output([sys.executable, "-c", code], cwd = os.path.dirname(os.path.abspath(__file__)))
+		self.assertEqual(["[]", "FactorGraphTrueSkillCalculator FactorGraphCache", "False"], output.decode("ascii").splitlines())
+		
 class DrawMarginTests(unittest.TestCase):
 	_errorTolerance = 0.000001
 	
@@ -417,6 +1410,19 @@ class MatrixTests(unittest.TestCase):
 		d = _SquareMatrix([-8, 18, -4, -5, 12, -1, 4, -6, 2])
 		self.assertEqual(d, c.adjugate)
 
+	def test_solveTests(self):
+		a = _SquareMatrix([0, 2, 1, 1, 1, 1, 2, 1, 3])
+		x = Matrix([[1.5], [-2], [0.25]])
+		self.assertEqual(x, a.solve(a * x))
+
+	def test_choleskyTests(self):
+		a = _SquareMatrix([4, 12, -16, 12, 37, -43, -16, -43, 98])
+		lower = a.cholesky
+		self.assertEqual(_SquareMatrix([2, 0, 0, 6, 1, 0, -8, 5, 3]), lower)
+		self.assertEqual(a, lower * lower.transpose)
+		self.assertAlmostEqual(36, lower.determinant**2, delta = 0.0000000001)
+		self.assertRaises(ValueError, lambda: _SquareMatrix([1, 2, 2, 1]).cholesky)
+
 	def test_inverseTests(self):
 		a = _SquareMatrix([4, 3, 3, 2])
 		b = _SquareMatrix([-2, 3, 3, -4])
@@ -464,13 +1470,13 @@ class GaussianDistributionTest(unittest.TestCase):
 		product = GaussianDistribution(0.2, 3.0 / sqrt(10))
 		standardNormal = GaussianDistribution(0, 1)
 		productDividedByStandardNormal = product/standardNormal
-		self.assertAlmostEqual(2.0, productDividedByStandardNormal.mean.value, delta=self.__errorTolerance)
-		self.assertAlmostEqual(3.0, productDividedByStandardNormal.standardDeviation.value, delta=self.__errorTolerance)
+		self.assertAlmostEqual(2.0, productDividedByStandardNormal.mean, delta=self.__errorTolerance)
+		self.assertAlmostEqual(3.0, productDividedByStandardNormal.standardDeviation, delta=self.__errorTolerance)
 		product2 = GaussianDistribution((4.0*(7**2)+6*(5**2))/((5**2)+(7**2)), sqrt(((5.0**2)*(7**2))/((5**2)+(7**2))))
 		m4s5 = GaussianDistribution(4, 5)
 		product2DividedByM4S5 = product2/m4s5
-		self.assertAlmostEqual(first=6.0, second=product2DividedByM4S5.mean.value, delta=self.__errorTolerance)
-		self.assertAlmostEqual(first=7.0, second=product2DividedByM4S5.standardDeviation.value, delta=self.__errorTolerance)
+		self.assertAlmostEqual(first=6.0, second=product2DividedByM4S5.mean, delta=self.__errorTolerance)
+		self.assertAlmostEqual(first=7.0, second=product2DividedByM4S5.standardDeviation, delta=self.__errorTolerance)
 
 	def test_logProductNormalizationTests(self):
 		standardNormal = GaussianDistribution(0, 1)
@@ -0,0 +1,252 @@
+'''
+End to end throughput and latency of the calculators, checked against stored baselines
+
+Every case of a matrix is run: TwoPlayerTrueSkillCalculator on one on one games, TwoTeamTrueSkillCalculator on two
+teams of 1 to 64 players, and FactorGraphTrueSkillCalculator on 2 to 32 teams of 1 to 64 players, with and without
+partial play, each at draw rates of 0 and 0.5. Cases with more than --max-players players are skipped, since a factor
+graph of thousands of players takes minutes a match in pure Python
+
+Each case rates random games one calculateNewRatings call at a time, in --rounds rounds of at least --seconds seconds
+and 200 games, with the garbage collector off as timeit does. It reports the best round's matches per second and p50
+and p99 latency of a call, the GaussianDistribution and Rating objects a match allocates (counted on untimed calls,
+through AllocationCounter) and, where the tracemalloc module exists (Python 3), the peak memory allocated by a match.
+Usage:
+
+	python benchmarks/calculators.py [--seconds 0.2] [--rounds 3] [--max-players 128] [--only text]
+		[--save baselines.json] [--baseline baselines.json] [--threshold 0.25]
+
+--save writes the results as a baseline file. --baseline compares the run with one and exits with status 1 if any
+case lost more than --threshold of its matches per second, or its p99 latency or allocations per match grew by more
+than that. Allocation counts are the same on every machine and every run, but timings only
+compare on the machine they were taken on: calculator_baselines.json next to this file is a full run on one core of
+a shared virtual machine, where cases of under a millisecond vary by up to 40% between runs, so save a baseline of
+your own before comparing against it
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from numerics import GaussianDistribution
+from objects import defaultGameInfo, Player, Rating, Team
+from trueskill_factorgraph.graphcache import FactorGraphCache
+from trueskill_factorgraph.ts_factorgraph import FactorGraphTrueSkillCalculator
+from trueskill_simple import TwoPlayerTrueSkillCalculator, TwoTeamTrueSkillCalculator
+import numerics
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+_teamCounts = (2, 4, 8, 16, 32)
+_teamSizes = (1, 2, 4, 8, 16, 32, 64)
+_drawRates = (0.0, 0.5)
+_samplesPerCase = 200
+_allocationSamples = 20
+
+class BenchmarkCase(object):
+	'''One cell of the matrix: a calculator and the shape of the games it rates'''
+	def __init__(self, calculatorName, createCalculator, teamCount, teamSize, drawRate, partialPlay):
+		self.calculatorName = calculatorName
+		self.createCalculator = createCalculator
+		self.teamCount = teamCount
+		self.teamSize = teamSize
+		self.drawRate = drawRate
+		self.partialPlay = partialPlay
+
+	@property
+	def name(self):
+		return "%s %ix%i draws=%.2f%s" % (self.calculatorName, self.teamCount, self.teamSize, self.drawRate,
+			" partial" if self.partialPlay else "")
+
+	@property
+	def players(self):
+		return self.teamCount * self.teamSize
+
+def getCases(maxPlayers):
+	'''Every case of the matrix with at most maxPlayers players'''
+	cases = list()
+	for drawRate in _drawRates:
+		cases.append(BenchmarkCase("TwoPlayer", TwoPlayerTrueSkillCalculator, 2, 1, drawRate, False))
+		for teamSize in _teamSizes:
+			cases.append(BenchmarkCase("TwoTeam", TwoTeamTrueSkillCalculator, 2, teamSize, drawRate, False))
+		for teamCount in _teamCounts:
+			for teamSize in _teamSizes:
+				for partialPlay in (False, True):
+					cases.append(BenchmarkCase("FactorGraph", lambda: FactorGraphTrueSkillCalculator(FactorGraphCache()),
+						teamCount, teamSize, drawRate, partialPlay))
+	return [case for case in cases if case.players <= maxPlayers]
+
+class AllocationCounter(object):
+	'''
+	Counts the GaussianDistribution and Rating objects made while it is installed: every message, marginal and rating
+	a rating update allocates. It wraps the __init__ of both classes and numerics._newGaussianDistribution, which
+	fromPrecisionMean makes distributions with, so it only goes around calls that are not being timed
+	'''
+	def __init__(self):
+		self.count = 0
+		self._originals = None
+
+	def install(self):
+		assert self._originals is None, "installed"
+		self._originals = (GaussianDistribution.__dict__["__init__"], Rating.__dict__["__init__"], numerics._newGaussianDistribution)
+		GaussianDistribution.__init__ = self._counting(self._originals[0])
+		Rating.__init__ = self._counting(self._originals[1])
+		numerics._newGaussianDistribution = self._counting(self._originals[2])
+
+	def uninstall(self):
+		GaussianDistribution.__init__, Rating.__init__, numerics._newGaussianDistribution = self._originals
+		self._originals = None
+
+	def _counting(self, function):
+		def countingFunction(*arguments, **keywordArguments):
+			self.count += 1
+			return function(*arguments, **keywordArguments)
+		return countingFunction
+
+def createGame(generator, case):
+	'''(teams, teamRanks) of a random game of the case. Neighbouring teams in rank order draw at the case's draw rate'''
+	teams = list()
+	for teamIndex in range(case.teamCount):
+		team = Team()
+		for playerIndex in range(case.teamSize):
+			partialPlayPercentage = generator.uniform(0.5, 1.0) if case.partialPlay else 1.0
+			team.addPlayer(Player("%i-%i" % (teamIndex, playerIndex), partialPlayPercentage),
+				Rating(generator.gauss(25.0, 8.0), generator.uniform(1.0, 8.0)))
+		teams.append(team)
+	teamRanks = [1]
+	for teamIndex in range(1, case.teamCount):
+		teamRanks.append(teamRanks[-1] if generator.random() < case.drawRate else teamIndex + 1)
+	return (teams, teamRanks)
+
+def getPercentile(sortedValues, percent):
+	return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percent / 100.0))]
+
+def runCase(case, minSeconds, rounds):
+	'''
+	A dict of matchesPerSecond, p50 and p99 (in seconds), each the best of rounds rounds, allocationsPerMatch, the
+	GaussianDistribution and Rating objects a call made, and peakBytesPerMatch, the most memory a call had allocated
+	at once (None without tracemalloc), both averaged over the first 20 games
+	'''
+	generator = random.Random(case.name)
+	gameInfo = defaultGameInfo()
+	calculator = case.createCalculator()
+	games = [createGame(generator, case) for i in range(_samplesPerCase)]
+	# one call first so that caches and lazily built constants are not timed
+	calculator.calculateNewRatings(gameInfo, *games[0])
+
+	best = None
+	for roundIndex in range(rounds):
+		latencies = list()
+		totalSeconds = 0.0
+		# like timeit, the garbage collector is kept from running in the middle of a timed call
+		gc.collect()
+		gcWasEnabled = gc.isenabled()
+		gc.disable()
+		try:
+			while totalSeconds < minSeconds or len(latencies) < len(games):
+				teams, teamRanks = games[len(latencies) % len(games)]
+				start = default_timer()
+				calculator.calculateNewRatings(gameInfo, teams, teamRanks)
+				seconds = default_timer() - start
+				latencies.append(seconds)
+				totalSeconds += seconds
+		finally:
+			if gcWasEnabled:
+				gc.enable()
+		latencies.sort()
+		result = (len(latencies) / totalSeconds, getPercentile(latencies, 50), getPercentile(latencies, 99))
+		if best is None:
+			best = result
+		else:
+			best = (max(best[0], result[0]), min(best[1], result[1]), min(best[2], result[2]))
+
+	counter = AllocationCounter()
+	counter.install()
+	try:
+		for teams, teamRanks in games[:_allocationSamples]:
+			calculator.calculateNewRatings(gameInfo, teams, teamRanks)
+	finally:
+		counter.uninstall()
+	allocationsPerMatch = counter.count / float(_allocationSamples)
+
+	peakBytesPerMatch = None
+	if tracemalloc is not None:
+		peaks = list()
+		for teams, teamRanks in games[:_allocationSamples]:
+			tracemalloc.start()
+			try:
+				calculator.calculateNewRatings(gameInfo, teams, teamRanks)
+				peaks.append(tracemalloc.get_traced_memory()[1])
+			finally:
+				tracemalloc.stop()
+		peakBytesPerMatch = sum(peaks) / float(len(peaks))
+
+	return {"matchesPerSecond": best[0], "p50": best[1], "p99": best[2], "allocationsPerMatch": allocationsPerMatch,
+		"peakBytesPerMatch": peakBytesPerMatch}
+
+def findRegressions(results, baselines, threshold):
+	'''(case name, message) of every case of results that regressed past threshold against baselines'''
+	regressions = list()
+	for name in sorted(results):
+		baseline = baselines.get(name)
+		if baseline is None:
+			continue
+		result = results[name]
+		if result["matchesPerSecond"] < baseline["matchesPerSecond"] * (1.0 - threshold):
+			regressions.append((name, "%.0f matches/s, baseline %.0f" % (result["matchesPerSecond"], baseline["matchesPerSecond"])))
+		if result["p99"] > baseline["p99"] * (1.0 + threshold):
+			regressions.append((name, "p99 %.3f ms, baseline %.3f ms" % (result["p99"] * 1e3, baseline["p99"] * 1e3)))
+		# baselines saved before allocations were counted have none to compare with
+		if baseline.get("allocationsPerMatch") is not None and \
+				result["allocationsPerMatch"] > baseline["allocationsPerMatch"] * (1.0 + threshold):
+			regressions.append((name, "%.1f allocations per match, baseline %.1f" % (result["allocationsPerMatch"],
+				baseline["allocationsPerMatch"])))
+	return regressions
+
+def main(argv):
+	parser = argparse.ArgumentParser(description = "End to end calculator benchmarks")
+	parser.add_argument("--seconds", type = float, default = 0.2, help = "minimum seconds of calls per case")
+	parser.add_argument("--rounds", type = int, default = 3, help = "timed rounds per case, the best one is kept")
+	parser.add_argument("--max-players", type = int, default = 128, help = "skip cases with more players")
+	parser.add_argument("--only", help = "only run the cases whose name contains this text")
+	parser.add_argument("--save", help = "write the results to this baseline file")
+	parser.add_argument("--baseline", help = "compare the results with this baseline file")
+	parser.add_argument("--threshold", type = float, default = 0.25, help = "the fraction a case may regress by")
+	arguments = parser.parse_args(argv[1:])
+
+	results = dict()
+	for case in getCases(arguments.max_players):
+		if arguments.only is not None and arguments.only not in case.name:
+			continue
+		result = runCase(case, arguments.seconds, arguments.rounds)
+		results[case.name] = result
+		peak = "  peak %9.0f B" % result["peakBytesPerMatch"] if result["peakBytesPerMatch"] is not None else ""
+		print("%-40s %10.1f matches/s  p50 %9.3f ms  p99 %9.3f ms  %8.1f allocs%s" % (case.name, result["matchesPerSecond"],
+			result["p50"] * 1e3, result["p99"] * 1e3, result["allocationsPerMatch"], peak))
+		sys.stdout.flush()
+
+	if arguments.save is not None:
+		with open(arguments.save, "w") as baselineFile:
+			json.dump({"python": platform.python_version(), "machine": platform.machine(), "cases": results},
+				baselineFile, indent = 1, sort_keys = True)
+	if arguments.baseline is not None:
+		with open(arguments.baseline, "r") as baselineFile:
+			baselines = json.load(baselineFile)["cases"]
+		regressions = findRegressions(results, baselines, arguments.threshold)
+		for name, message in regressions:
+			print("REGRESSION %s: %s" % (name, message))
+		if len(regressions) > 0:
+			return 1
+		print("no regressions past %.0f%% against %s" % (arguments.threshold * 100, arguments.baseline))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
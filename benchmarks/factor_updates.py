@@ -0,0 +1,50 @@
+'''
+Microbenchmark of one schedule step (Factor.updateMessage) for each Gaussian factor type
+
+Builds and runs a factor graph for a multi team game, then times updateMessage on every message of every factor,
+grouped by factor class. Usage: python benchmarks/factor_updates.py [repetitions]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objects import defaultGameInfo, Player, Team
+from trueskill_factorgraph.layers import TrueSkillFactorGraph
+
+def _createTeams(gameInfo, teamSizes):
+	teams = list()
+	for teamIndex in range(len(teamSizes)):
+		team = Team()
+		for playerIndex in range(teamSizes[teamIndex]):
+			team.addPlayer(Player("%i-%i" % (teamIndex, playerIndex)), gameInfo.defaultRating)
+		teams.append(team)
+	return teams
+
+def measureFactorUpdates(teamSizes, teamRanks, repetitions):
+	'''Returns a dict of factor class name to (steps timed, seconds per step)'''
+	gameInfo = defaultGameInfo()
+	factorGraph = TrueSkillFactorGraph(gameInfo, _createTeams(gameInfo, teamSizes), teamRanks)
+	factorGraph.buildGraph()
+	factorGraph.runSchedule()
+	results = dict()
+	for factor in factorGraph.factors:
+		name = factor.__class__.__name__
+		for messageIndex in range(factor.numberOfMessages):
+			seconds = min(timeit.repeat(lambda: factor.updateMessage(messageIndex), repeat=3, number=repetitions)) / repetitions
+			steps, totalSeconds = results.get(name, (0, 0.0))
+			results[name] = (steps + 1, totalSeconds + seconds)
+	return dict((name, (steps, totalSeconds / steps)) for name, (steps, totalSeconds) in results.items())
+
+def main(argv):
+	repetitions = int(argv[1]) if len(argv) > 1 else 2000
+	for teamSizes, teamRanks in (([1, 1, 1, 1], [1, 2, 3, 4]), ([2, 2, 2], [1, 2, 2])):
+		print("teams %s, ranks %s" % (teamSizes, teamRanks))
+		results = measureFactorUpdates(teamSizes, teamRanks, repetitions)
+		for name in sorted(results):
+			steps, seconds = results[name]
+			print("  %-28s %3i messages %8.2f us/step" % (name, steps, seconds * 1e6))
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,75 @@
+'''
+Cold import time of the rating modules, checked against a budget
+
+Every module is imported in a fresh interpreter, --repeat times, and the best time of the import statement itself is
+reported (interpreter startup is left out) with the repository modules it loaded. The modules are byte compiled
+first, as they would be once installed, so the times do not include compiling source. Usage:
+
+	python benchmarks/import_time.py [--repeat 20] [--budget-ms 5]
+
+Exits with status 1 if importing trueskill_simple takes more than --budget-ms or loads the factor graph engine, which
+a worker that only rates two team games should never import
+'''
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_modules = ("numerics", "objects", "fastnumerics", "trueskill_simple", "service", "trueskill_factorgraph",
+	"trueskill_factorgraph.ts_factorgraph")
+_budgetedModule = "trueskill_simple"
+
+# run in the fresh interpreter: prints the seconds of the import, then the modules it loaded
+_childCode = '''
+import sys
+from time import time
+before = set(sys.modules)
+start = time()
+__import__(%r)
+seconds = time() - start
+print(repr(seconds))
+print(" ".join(sorted(name for name in set(sys.modules) - before if sys.modules[name] is not None)))
+'''
+
+def timeImport(moduleName):
+	'''(seconds, names of the modules loaded) of importing moduleName in a new interpreter'''
+	output = subprocess.check_output([sys.executable, "-c", _childCode % moduleName], cwd = _root)
+	lines = output.decode("ascii").splitlines()
+	return (float(lines[0]), lines[1].split() if len(lines) > 1 else [])
+
+def isRepositoryModule(name):
+	topLevel = name.split(".")[0]
+	return os.path.exists(os.path.join(_root, topLevel + ".py")) or os.path.isdir(os.path.join(_root, topLevel))
+
+def main(argv):
+	parser = argparse.ArgumentParser(description = "Cold import time of the rating modules")
+	parser.add_argument("--repeat", type = int, default = 20, help = "fresh interpreters per module, the best is kept")
+	parser.add_argument("--budget-ms", type = float, default = 5.0, help = "the most importing %s may take" % _budgetedModule)
+	arguments = parser.parse_args(argv[1:])
+
+	compileall.compile_dir(_root, maxlevels = 1, quiet = 1)
+	compileall.compile_dir(os.path.join(_root, "trueskill_factorgraph"), maxlevels = 0, quiet = 1)
+
+	failures = list()
+	for moduleName in _modules:
+		best = None
+		for i in range(arguments.repeat):
+			seconds, loaded = timeImport(moduleName)
+			best = seconds if best is None else min(best, seconds)
+		repositoryModules = sorted(name for name in loaded if isRepositoryModule(name))
+		print("%-38s %8.2f ms  %2i modules: %s" % (moduleName, best * 1e3, len(loaded), " ".join(repositoryModules)))
+		if moduleName == _budgetedModule:
+			if best * 1e3 > arguments.budget_ms:
+				failures.append("%s took %.2f ms, budget %.2f ms" % (moduleName, best * 1e3, arguments.budget_ms))
+			for name in repositoryModules:
+				if name.startswith("trueskill_factorgraph") or name == "factorgraphs":
+					failures.append("%s loaded %s" % (moduleName, name))
+	for failure in failures:
+		print("OVER BUDGET %s" % failure)
+	return 1 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
@@ -0,0 +1,252 @@
+'''
+Speed and accuracy of the Gaussian functions of numerics, and of their fastnumerics alternatives
+
+Every function is timed over a realistic range of inputs and compared with a reference computed with the decimal
+module at 45 significant digits, so the error reported is that of the float implementation. Functions that fall
+back to an approximation once the normal cumulative drops below 2.222758749e-162 (x below about -27) are run twice:
+over the body of the range, and over the far tail where only that fallback is used. Usage:
+
+	python benchmarks/numerics_accuracy.py [repetitions]
+
+reports, for each function and backend, the nanoseconds per call, the largest absolute and relative error and the
+number of results that were nan or infinite. Relative errors are taken where the reference is not 0. Results below
+about 1e-308 are subnormal floats with fewer significant bits, which is what the relative errors of cumulativeTo,
+errorFunctionCumulativeTo and at come down to at the far ends of their ranges
+'''
+import decimal
+import math
+import os
+import random
+import sys
+from decimal import Decimal
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastnumerics
+import numerics
+from numerics import GaussianDistribution
+
+_context = decimal.Context(prec = 45, Emin = -999999, Emax = 999999)
+_pi = Decimal("3.14159265358979323846264338327950288419716939937510582097494459230781640628620899863")
+_sqrtPi = _context.sqrt(_pi)
+_sqrt2 = _context.sqrt(Decimal(2))
+_sqrt2Pi = _context.sqrt(2 * _pi)
+
+def _toDecimal(value):
+	return Decimal(value) if isinstance(value, float) else Decimal(str(value))
+
+def referenceErfc(z):
+	'''erfc of a Decimal, to about 45 digits'''
+	with decimal.localcontext(_context) as context:
+		context.prec = 60
+		if z < 0:
+			return +(2 - referenceErfc(-z))
+		if z < 2:
+			# erf from its Taylor series, whose terms stay below e^(z^2), so the extra digits cover the cancellation
+			zSquared = z * z
+			term = z
+			total = z
+			n = 0
+			while True:
+				n += 1
+				term = -term * zSquared / n
+				contribution = term / (2 * n + 1)
+				total += contribution
+				if abs(contribution) <= Decimal(10)**-55 * abs(total):
+					break
+			return +(1 - 2 / _sqrtPi * total)
+		# the continued fraction of erfc, evaluated from the back with enough terms for 45 digits
+		terms = 200 if z < 3 else 100 if z < 4 else 60
+		fraction = z
+		for k in range(terms, 0, -1):
+			fraction = z + Decimal(k) / 2 / fraction
+		return +((-z * z).exp() / _sqrtPi / fraction)
+
+# the v and w cases evaluate the same cumulatives again and again
+_cumulatives = dict()
+
+def referenceCumulativeTo(x):
+	cumulative = _cumulatives.get(x)
+	if cumulative is None:
+		with decimal.localcontext(_context):
+			cumulative = referenceErfc(-x / _sqrt2) / 2
+		_cumulatives[x] = cumulative
+	return cumulative
+
+def referenceAt(x):
+	with decimal.localcontext(_context):
+		return (-x * x / 2).exp() / _sqrt2Pi
+
+def referenceInverseErfc(p, start):
+	'''The x with erfc(x) = p, by Newton steps from the float estimate start'''
+	with decimal.localcontext(_context):
+		x = _toDecimal(start)
+		for i in range(8):
+			step = (referenceErfc(x) - p) / (2 / _sqrtPi * (-x * x).exp())
+			x += step
+			if step == 0 or abs(step) < Decimal(10)**-42 * abs(x):
+				break
+		return x
+
+def referenceVwExceedsMargin(difference, drawMargin):
+	with decimal.localcontext(_context):
+		x = difference - drawMargin
+		v = referenceAt(x) / referenceCumulativeTo(x)
+		return (v, v * (v + x))
+
+def referenceVwWithinMargin(difference, drawMargin):
+	with decimal.localcontext(_context):
+		absoluteDifference = abs(difference)
+		upper = drawMargin - absoluteDifference
+		lower = -drawMargin - absoluteDifference
+		denominator = referenceCumulativeTo(upper) - referenceCumulativeTo(lower)
+		atUpper = referenceAt(upper)
+		atLower = referenceAt(lower)
+		v = (atLower - atUpper) / denominator
+		w = v * v + (upper * atUpper - lower * atLower) / denominator
+		return (-v if difference < 0 else v, w)
+
+def referenceLogProductNormalization(leftMean, leftVariance, rightMean, rightVariance):
+	with decimal.localcontext(_context):
+		varianceSum = leftVariance + rightVariance
+		return -_sqrt2Pi.ln() - varianceSum.ln() / 2 - (leftMean - rightMean)**2 / (varianceSum * 2)
+
+def referenceLogRatioNormalization(numeratorMean, numeratorVariance, denominatorMean, denominatorVariance):
+	with decimal.localcontext(_context):
+		varianceDifference = denominatorVariance - numeratorVariance
+		return (denominatorVariance.ln() + _sqrt2Pi.ln() - varianceDifference.ln() / 2
+			+ (numeratorMean - denominatorMean)**2 / (varianceDifference * 2))
+
+class FunctionCase(object):
+	'''
+	A function over a range of inputs: implementations maps a backend name to a callable, reference maps the same
+	arguments, as Decimals, to a Decimal or a tuple of Decimals matching what the implementations return
+	'''
+	def __init__(self, name, rangeName, arguments, reference, implementations):
+		self.name = name
+		self.rangeName = rangeName
+		self.arguments = arguments
+		self.reference = reference
+		self.implementations = implementations
+
+def _linearRange(low, high, count):
+	return [low + (high - low) * i / float(count - 1) for i in range(count)]
+
+def getCases():
+	generator = random.Random(23)
+	exactAndFast = lambda exact, fast: [("numerics", exact), ("fastnumerics", fast)]
+	cases = list()
+
+	body = [(x,) for x in _linearRange(-27.0, 10.0, 149)]
+	tail = [(x,) for x in _linearRange(-38.0, -27.5, 43)]
+	for rangeName, arguments in (("body", body), ("tail", tail)):
+		cases.append(FunctionCase("cumulativeTo", rangeName, arguments, referenceCumulativeTo,
+			exactAndFast(numerics.cumulativeTo, fastnumerics.cumulativeTo)))
+	cases.append(FunctionCase("errorFunctionCumulativeTo", "body", [(z,) for z in _linearRange(-6.0, 27.0, 133)],
+		referenceErfc, exactAndFast(numerics.errorFunctionCumulativeTo, math.erfc)))
+	# erfc(x) = p means x = -inverseCumulativeTo(p / 2) / sqrt(2)
+	probabilities = [(10.0**-k,) for k in range(1, 300, 3)] + [(p,) for p in _linearRange(0.01, 1.99, 100)] + \
+		[(2.0 - 10.0**-k,) for k in range(1, 16)]
+	cases.append(FunctionCase("inverseErrorFunctionCumulativeTo", "body", probabilities,
+		lambda p: referenceInverseErfc(p, numerics.inverseErrorFunctionCumulativeTo(float(p))),
+		exactAndFast(numerics.inverseErrorFunctionCumulativeTo, lambda p: -fastnumerics.inverseCumulativeTo(p / 2.0) / math.sqrt(2))))
+	cases.append(FunctionCase("at", "body", [(x,) for x in _linearRange(-38.0, 38.0, 153)], referenceAt,
+		exactAndFast(numerics.at, fastnumerics.at)))
+
+	drawMargins = (0.0, 0.74, 3.0)
+	body = [(difference, drawMargin) for difference in _linearRange(-20.0, 10.0, 61) for drawMargin in drawMargins]
+	tail = [(difference, drawMargin) for difference in _linearRange(-38.0, -28.0, 21) for drawMargin in drawMargins]
+	for rangeName, arguments in (("body", body), ("tail", tail)):
+		cases.append(FunctionCase("vExceedsMargin", rangeName, arguments,
+			lambda difference, drawMargin: referenceVwExceedsMargin(difference, drawMargin)[0],
+			[("numerics", numerics.vExceedsMargin)]))
+		cases.append(FunctionCase("wExceedsMargin", rangeName, arguments,
+			lambda difference, drawMargin: referenceVwExceedsMargin(difference, drawMargin)[1],
+			[("numerics", numerics.wExceedsMargin)]))
+		cases.append(FunctionCase("vwExceedsMargin", rangeName, arguments, referenceVwExceedsMargin,
+			exactAndFast(numerics.vwExceedsMargin, fastnumerics.vwExceedsMargin)))
+
+	drawMargins = (0.1, 0.74, 3.0)
+	body = [(difference, drawMargin) for difference in _linearRange(-25.0, 25.0, 101) for drawMargin in drawMargins]
+	tail = [(difference, drawMargin) for difference in _linearRange(31.0, 40.0, 19) for drawMargin in drawMargins]
+	for rangeName, arguments in (("body", body), ("tail", tail)):
+		cases.append(FunctionCase("vWithinMargin", rangeName, arguments,
+			lambda difference, drawMargin: referenceVwWithinMargin(difference, drawMargin)[0],
+			[("numerics", numerics.vWithinMargin)]))
+		cases.append(FunctionCase("wWithinMargin", rangeName, arguments,
+			lambda difference, drawMargin: referenceVwWithinMargin(difference, drawMargin)[1],
+			[("numerics", numerics.wWithinMargin)]))
+		cases.append(FunctionCase("vwWithinMargin", rangeName, arguments, referenceVwWithinMargin,
+			exactAndFast(numerics.vwWithinMargin, fastnumerics.vwWithinMargin)))
+
+	gaussians = list()
+	for i in range(200):
+		left = GaussianDistribution(generator.gauss(25.0, 10.0), generator.uniform(0.5, 10.0))
+		right = GaussianDistribution(generator.gauss(25.0, 10.0), generator.uniform(0.5, 10.0))
+		gaussians.append((left, right))
+	cases.append(FunctionCase("logProductNormalization", "body", gaussians,
+		lambda left, right: referenceLogProductNormalization(_toDecimal(left.mean), _toDecimal(left.variance),
+			_toDecimal(right.mean), _toDecimal(right.variance)),
+		[("numerics", numerics.logProductNormalization)]))
+	ratios = list()
+	for i in range(200):
+		denominatorStandardDeviation = generator.uniform(1.0, 10.0)
+		numerator = GaussianDistribution(generator.gauss(25.0, 10.0), denominatorStandardDeviation * generator.uniform(0.1, 0.95))
+		denominator = GaussianDistribution(generator.gauss(25.0, 10.0), denominatorStandardDeviation)
+		ratios.append((numerator, denominator))
+	cases.append(FunctionCase("logRatioNormalization", "body", ratios,
+		lambda numerator, denominator: referenceLogRatioNormalization(_toDecimal(numerator.mean), _toDecimal(numerator.variance),
+			_toDecimal(denominator.mean), _toDecimal(denominator.variance)),
+		[("numerics", numerics.logRatioNormalization)]))
+	return cases
+
+def _asTuple(value):
+	return value if isinstance(value, tuple) else (value,)
+
+def measureErrors(case, implementation, references):
+	'''(max absolute error, max relative error, number of nan or infinite results) of implementation over case'''
+	maxAbsoluteError = 0.0
+	maxRelativeError = 0.0
+	notFinite = 0
+	for arguments, reference in zip(case.arguments, references):
+		for value, referenceValue in zip(_asTuple(implementation(*arguments)), _asTuple(reference)):
+			if math.isnan(value) or math.isinf(value):
+				notFinite += 1
+				continue
+			with decimal.localcontext(_context):
+				absoluteError = abs(_toDecimal(value) - referenceValue)
+				maxAbsoluteError = max(maxAbsoluteError, float(absoluteError))
+				if referenceValue != 0:
+					maxRelativeError = max(maxRelativeError, float(absoluteError / abs(referenceValue)))
+	return (maxAbsoluteError, maxRelativeError, notFinite)
+
+def measureNanoseconds(case, implementation, repetitions):
+	'''The best of 3 runs of the mean time per call over the case's inputs, in nanoseconds'''
+	arguments = case.arguments
+	best = None
+	for run in range(3):
+		start = default_timer()
+		for repetition in range(repetitions):
+			for callArguments in arguments:
+				implementation(*callArguments)
+		seconds = (default_timer() - start) / (repetitions * len(arguments))
+		best = seconds if best is None else min(best, seconds)
+	return best * 1e9
+
+def main(argv):
+	repetitions = int(argv[1]) if len(argv) > 1 else 20
+	print("%-34s %-5s %-13s %6s %10s %11s %11s %5s" % ("function", "range", "backend", "inputs", "ns/call",
+		"max abs err", "max rel err", "nan"))
+	for case in getCases():
+		references = [case.reference(*[_toDecimal(argument) if isinstance(argument, float) else argument
+			for argument in arguments]) for arguments in case.arguments]
+		for backend, implementation in case.implementations:
+			maxAbsoluteError, maxRelativeError, notFinite = measureErrors(case, implementation, references)
+			nanoseconds = measureNanoseconds(case, implementation, repetitions)
+			print("%-34s %-5s %-13s %6i %10.0f %11.2e %11.2e %5i" % (case.name, case.rangeName, backend,
+				len(case.arguments), nanoseconds, maxAbsoluteError, maxRelativeError, notFinite))
+			sys.stdout.flush()
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,34 @@
+'''
+Memory per player of ArrayRatingStore against a dict of Rating objects (replay.RatingStore)
+
+Usage: python benchmarks/rating_store_memory.py [players]
+'''
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objects import Rating
+from ratingstore import ArrayRatingStore, getObjectModelBytesPerPlayer
+
+def measureBytesPerPlayer(players):
+	'''Returns (ArrayRatingStore bytes per player, Rating object model bytes per player), player ids not counted'''
+	random.seed(players)
+	store = ArrayRatingStore()
+	ratings = dict()
+	for playerId in range(players):
+		rating = Rating(random.gauss(25.0, 5.0), random.uniform(1.0, 8.0))
+		store.put(playerId, rating, 0.0)
+		ratings[playerId] = rating
+	return (store.bytesPerPlayer, getObjectModelBytesPerPlayer(ratings))
+
+def main(argv):
+	players = int(argv[1]) if len(argv) > 1 else 1000000
+	arrayBytes, objectBytes = measureBytesPerPlayer(players)
+	print("%i players" % players)
+	print("%-20s %8.1f bytes/player" % ("ArrayRatingStore", arrayBytes))
+	print("%-20s %8.1f bytes/player" % ("Rating objects", objectBytes))
+
+if __name__ == "__main__":
+	main(sys.argv)
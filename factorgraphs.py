@@ -1,3 +1,5 @@
+from time import time
+
 class Message(object):
 	def __init__(self, value, name):
 		self._value = value
@@ -109,6 +111,8 @@ class ScheduleStep(Schedule):
 		return self._index
 	
 	def visit(self, depth = -1, maxDepth = 0):
+		if _profiler is not None:
+			return _profiler._visitStep(self)
 		return self._factor.updateMessage(self._index)
 		
 class ScheduleSequence(Schedule):
@@ -116,7 +120,16 @@ class ScheduleSequence(Schedule):
 		super(ScheduleSequence, self).__init__(name)
 		self._schedules = schedules
 		
+	@property
+	def schedules(self):
+		return self._schedules
+		
 	def visit(self, depth = -1, maxDepth = 0):
+		if _profiler is not None:
+			return _profiler._visitSchedule(self, self._visitSchedules, depth, maxDepth)
+		return self._visitSchedules(depth, maxDepth)
+		
+	def _visitSchedules(self, depth, maxDepth):
 		maxDelta = 0
 		for currentSchedule in self._schedules:
 			delta = currentSchedule.visit(depth + 1, maxDepth)
@@ -129,12 +142,483 @@ class ScheduleLoop(Schedule):
 		self._scheduleToLoop = scheduleToLoop
 		self._maxDelta = maxDelta
 		
+	@property
+	def scheduleToLoop(self):
+		return self._scheduleToLoop
+		
+	@property
+	def maxDelta(self):
+		return self._maxDelta
+		
 	def visit(self, depth = -1, maxDepth = 0):
+		if _profiler is not None:
+			return _profiler._visitSchedule(self, self._visitUntilConverged, depth, maxDepth)
+		return self._visitUntilConverged(depth, maxDepth)
+		
+	def _visitUntilConverged(self, depth, maxDepth):
 		delta = self._scheduleToLoop.visit(depth+1, maxDepth)
 		while delta > self._maxDelta:
 			delta = self._scheduleToLoop.visit(depth+1, maxDepth)
 		return delta
 		
+class ConvergenceBudget(object):
+	'''
+	Limits on the loops of a CompiledSchedule run. tolerance, if given, replaces the max delta every loop was built
+	with, maxIterations caps the passes through any one loop and deadlineSeconds is the wall clock time after which no
+	loop starts another pass. A limit of None does not apply
+	'''
+	def __init__(self, tolerance = None, maxIterations = None, deadlineSeconds = None):
+		assert tolerance is None or tolerance >= 0, "tolerance"
+		assert maxIterations is None or maxIterations >= 1, "maxIterations"
+		assert deadlineSeconds is None or deadlineSeconds >= 0, "deadlineSeconds"
+		self._tolerance = tolerance
+		self._maxIterations = maxIterations
+		self._deadlineSeconds = deadlineSeconds
+		
+	@property
+	def tolerance(self):
+		return self._tolerance
+		
+	@property
+	def maxIterations(self):
+		return self._maxIterations
+		
+	@property
+	def deadlineSeconds(self):
+		return self._deadlineSeconds
+		
+class LoopStop(object):
+	'''Enum like class for why a loop stopped'''
+	CONVERGED = 0
+	NOT_A_NUMBER = 1
+	MAX_ITERATIONS = 2
+	DEADLINE = 3
+	
+class LoopRunStatistics(object):
+	'''
+	What one ScheduleLoop did during a run: the largest marginal change of every pass through its body, how long each
+	pass took and the LoopStop value saying why it stopped. Only a loop whose last pass changed nothing by more than
+	its max delta has converged
+	'''
+	def __init__(self, name, maxDelta):
+		self._name = name
+		self._maxDelta = maxDelta
+		self._deltas = list()
+		self._passSeconds = list()
+		self._stoppedBy = None
+		
+	@property
+	def name(self):
+		return self._name
+		
+	@property
+	def maxDelta(self):
+		return self._maxDelta
+		
+	@property
+	def iterations(self):
+		return len(self._deltas)
+		
+	@property
+	def deltas(self):
+		return self._deltas
+		
+	@property
+	def passSeconds(self):
+		return self._passSeconds
+		
+	@property
+	def seconds(self):
+		return sum(self._passSeconds)
+		
+	@property
+	def stoppedBy(self):
+		return self._stoppedBy
+		
+	@property
+	def converged(self):
+		return self._stoppedBy == LoopStop.CONVERGED
+		
+	def _addPass(self, delta, seconds):
+		self._deltas.append(delta)
+		self._passSeconds.append(seconds)
+		
+	def __str__(self):
+		return "%s: %i iterations, last delta %s, %s" % (self._name, self.iterations, self._deltas[-1] if self._deltas else None,
+			"converged" if self.converged else "not converged")
+		
+class ScheduleRunReport(object):
+	'''Filled in by CompiledSchedule.run: the delta and time of one run and the LoopRunStatistics of its loops'''
+	def __init__(self):
+		self._delta = None
+		self._seconds = None
+		self._loops = list()
+		
+	@property
+	def delta(self):
+		return self._delta
+		
+	@property
+	def seconds(self):
+		return self._seconds
+		
+	@property
+	def loops(self):
+		return self._loops
+		
+	@property
+	def iterations(self):
+		return sum(loop.iterations for loop in self._loops)
+		
+	@property
+	def converged(self):
+		for loop in self._loops:
+			if loop.converged == False:
+				return False
+		return True
+		
+	def _addLoop(self, loopStatistics):
+		self._loops.append(loopStatistics)
+		
+	def _finish(self, delta, seconds):
+		self._delta = delta
+		self._seconds = seconds
+		
+# the FactorGraphProfiler that schedules report to while it is started, see FactorGraphProfiler.start
+_profiler = None
+
+class FactorGraphProfiler(object):
+	'''
+	Call counts and cumulative time of factor updates, per factor class, and of schedule visits, per schedule name,
+	collected from every Schedule.visit and CompiledSchedule.run, on either FactorGraphBackend, between start and
+	stop. While no profiler is started a schedule only checks a module global once per step or visit
+
+	Only the factor updates themselves are timed. The time of a schedule is the time of the updates under it, so the
+	cost of walking the schedule is left out, and a schedule is counted once per visit, so a loop counts once per
+	run and its body once per pass. Results are exported with table and, for flamegraph.pl and similar tools, with
+	collapsedStacks. A started profiler sees the schedules run by every thread, each with its own stack of schedules
+	'''
+	def __init__(self):
+		# imported here, so that loading the factor graph does not load threading for a profiler it may never make
+		import threading
+		self._previous = None
+		self._started = False
+		# collapsed stack, the names of the schedules from the top down and the factor class last, to [calls, seconds]
+		self._stacks = dict()
+		self._scheduleCalls = dict()
+		self._lock = threading.Lock()
+		# the names of the schedules each thread is visiting through Schedule.visit, in its path attribute
+		self._local = threading.local()
+		
+	@property
+	def started(self):
+		return self._started
+		
+	@property
+	def factorStatistics(self):
+		'''A dict of factor class name to (calls, seconds)'''
+		result = dict()
+		for stack, (calls, seconds) in self._getStacks():
+			totalCalls, totalSeconds = result.get(stack[-1], (0, 0.0))
+			result[stack[-1]] = (totalCalls + calls, totalSeconds + seconds)
+		return result
+		
+	@property
+	def scheduleStatistics(self):
+		'''A dict of schedule name to (visits, seconds)'''
+		with self._lock:
+			scheduleCalls = dict(self._scheduleCalls)
+		seconds = dict((name, 0.0) for name in scheduleCalls)
+		for stack, (stackCalls, stackSeconds) in self._getStacks():
+			# a name repeated along one stack still only holds that time once
+			for name in set(stack[:-1]):
+				seconds[name] = seconds.get(name, 0.0) + stackSeconds
+		return dict((name, (scheduleCalls.get(name, 0), seconds[name])) for name in seconds)
+		
+	@property
+	def seconds(self):
+		'''The time of every factor update profiled'''
+		return sum(seconds for stack, (calls, seconds) in self._getStacks())
+		
+	def start(self):
+		'''Starts profiling every schedule run, returning this profiler. A profiler started inside another pauses it'''
+		global _profiler
+		assert self._started == False, "started"
+		self._previous = _profiler
+		self._started = True
+		_profiler = self
+		return self
+		
+	def stop(self):
+		global _profiler
+		assert _profiler is self, "started"
+		_profiler = self._previous
+		self._previous = None
+		self._started = False
+		
+	def reset(self):
+		with self._lock:
+			self._stacks.clear()
+			self._scheduleCalls.clear()
+		
+	def __enter__(self):
+		return self.start()
+		
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		self.stop()
+		
+	def table(self):
+		'''A text table of the factor classes, then the schedules, each slowest first'''
+		totalSeconds = self.seconds
+		lines = ["%-8s %-50s %10s %12s %10s %6s" % ("kind", "name", "calls", "total ms", "us/call", "%")]
+		for kind, statistics in (("factor", self.factorStatistics), ("schedule", self.scheduleStatistics)):
+			for name, (calls, seconds) in sorted(statistics.items(), key = lambda item: (-item[1][1], item[0])):
+				lines.append("%-8s %-50s %10i %12.3f %10.2f %6.1f" % (kind, name, calls, seconds * 1e3,
+					seconds * 1e6 / calls if calls > 0 else 0.0, 100.0 * seconds / totalSeconds if totalSeconds > 0 else 0.0))
+		return "\n".join(lines)
+		
+	def collapsedStacks(self):
+		'''
+		The profile in the collapsed stack format of flamegraph.pl: a line per stack, the frames separated by ';' and
+		followed by the stack's time in whole microseconds
+		'''
+		lines = list()
+		for stack, (calls, seconds) in sorted(self._getStacks()):
+			lines.append("%s %i" % (";".join(name.replace(";", ",") for name in stack), int(round(seconds * 1e6))))
+		return "\n".join(lines)
+		
+	def _getStacks(self):
+		'''(stack, (calls, seconds)) of every collapsed stack so far, copied while no thread is adding to them'''
+		with self._lock:
+			return [(stack, tuple(entry)) for stack, entry in self._stacks.items()]
+		
+	def _getPath(self):
+		path = getattr(self._local, "path", None)
+		if path is None:
+			path = self._local.path = list()
+		return path
+		
+	def _enter(self, scheduleNames):
+		if len(scheduleNames) == 0:
+			return
+		scheduleCalls = self._scheduleCalls
+		with self._lock:
+			for name in scheduleNames:
+				scheduleCalls[name] = scheduleCalls.get(name, 0) + 1
+			
+	def _runStep(self, stack, updateMessage, target, messageIndex):
+		start = time()
+		if updateMessage is None:
+			delta = target.updateMessage(messageIndex)
+		else:
+			delta = updateMessage(target, messageIndex)
+		seconds = time() - start
+		with self._lock:
+			entry = self._stacks.get(stack)
+			if entry is None:
+				self._stacks[stack] = [1, seconds]
+			else:
+				entry[0] += 1
+				entry[1] += seconds
+		return delta
+		
+	def _visitStep(self, step):
+		stack = tuple(self._getPath()) + (type(step.factor).__name__,)
+		return self._runStep(stack, None, step.factor, step.index)
+		
+	def _visitSchedule(self, schedule, visitBody, depth, maxDepth):
+		self._enter((schedule.name,))
+		path = self._getPath()
+		path.append(schedule.name)
+		try:
+			return visitBody(depth, maxDepth)
+		finally:
+			path.pop()
+			
+	def _visitCompiled(self, path, schedule):
+		'''Visits a schedule kept whole by a CompiledSchedule under the schedules it was compiled inside'''
+		outerPath = self._getPath()
+		self._local.path = list(path)
+		try:
+			return schedule.visit()
+		finally:
+			self._local.path = outerPath
+		
+_STEP = 0
+_LOOP_START = 1
+_LOOP_END = 2
+_VISIT = 3
+
+class CompiledSchedule(object):
+	'''
+	A Schedule tree flattened into a list of ops, so running it is a single loop instead of a recursive visit
+	Steps become (factor, message index) ops, sequences disappear, and each loop becomes a start marker, its body and
+	an end marker holding the loop's max delta and the position of the first op of its body. Any other kind of
+	Schedule is kept as one op that visits it. Running gives the same updates, in the same order, and the same
+	delta as Schedule.visit
+
+	A compiled schedule only refers to the factors it was compiled from, so it can be kept and rerun for as long as
+	the graph is. It also keeps, for a FactorGraphProfiler, the names of the schedules each op was inside of and the
+	names of the schedules whose visit starts at each op
+	'''
+	def __init__(self, schedule):
+		self._opCodes = list()
+		self._targets = list()
+		self._arguments = list()
+		self._stacks = list()
+		self._entered = list()
+		self._pendingEntries = list()
+		self._compile(schedule, ())
+		del self._pendingEntries
+		
+	@property
+	def numberOfOps(self):
+		return len(self._opCodes)
+		
+	@property
+	def steps(self):
+		'''The (factor, message index) of every step, in the order they are listed'''
+		return [(self._targets[i], self._arguments[i]) for i in range(len(self._opCodes)) if self._opCodes[i] == _STEP]
+		
+	def retarget(self, targetForFactor):
+		'''
+		A copy of this schedule whose steps refer to targetForFactor(factor) instead of each factor, for running with
+		a custom updateMessage
+		'''
+		result = CompiledSchedule.__new__(CompiledSchedule)
+		result._opCodes = list(self._opCodes)
+		result._arguments = list(self._arguments)
+		result._targets = [targetForFactor(self._targets[i]) if self._opCodes[i] == _STEP else self._targets[i] for i in range(len(self._opCodes))]
+		result._stacks = list(self._stacks)
+		result._entered = list(self._entered)
+		return result
+		
+	def run(self, updateMessage = None, report = None, budget = None):
+		'''
+		Runs every op, returning the delta the schedule tree would have returned
+		updateMessage(target, messageIndex) runs a step when given, otherwise each step calls target.updateMessage
+		report, if given, is a ScheduleRunReport that gets the time of the run and a LoopRunStatistics for every loop
+		budget, if given, is a ConvergenceBudget limiting every loop. A loop stopped by it leaves the marginals from
+		its last pass
+		While a FactorGraphProfiler is started every step is timed for it, under the factor class it was compiled from
+		'''
+		opCodes = self._opCodes
+		targets = self._targets
+		arguments = self._arguments
+		opCount = len(opCodes)
+		profiler = _profiler
+		if profiler is not None:
+			stacks = self._stacks
+			entered = self._entered
+		runStart = time()
+		tolerance = None
+		maxIterations = None
+		deadline = None
+		if budget is not None:
+			tolerance = budget.tolerance
+			maxIterations = budget.maxIterations
+			if budget.deadlineSeconds is not None:
+				deadline = runStart + budget.deadlineSeconds
+		if report is not None:
+			# the statistics and the start time of the current pass of every loop being run
+			loopStatistics = list()
+			passStarts = list()
+		# the largest delta so far of the schedule at the top and of every loop body being run, and how many passes
+		# every loop being run has made
+		maxDeltas = [0]
+		iterations = list()
+		position = 0
+		while position < opCount:
+			opCode = opCodes[position]
+			if opCode == _STEP:
+				if profiler is not None:
+					profiler._enter(entered[position])
+					delta = profiler._runStep(stacks[position], updateMessage, targets[position], arguments[position])
+				elif updateMessage is None:
+					delta = targets[position].updateMessage(arguments[position])
+				else:
+					delta = updateMessage(targets[position], arguments[position])
+				if delta > maxDeltas[-1]:
+					maxDeltas[-1] = delta
+			elif opCode == _LOOP_START:
+				if profiler is not None:
+					profiler._enter(entered[position])
+				maxDeltas.append(0)
+				iterations.append(0)
+				if report is not None:
+					loopTolerance = targets[position].maxDelta if tolerance is None else tolerance
+					loopStatistics.append(LoopRunStatistics(targets[position].name, loopTolerance))
+					passStarts.append(time())
+			elif opCode == _LOOP_END:
+				delta = maxDeltas[-1]
+				iterations[-1] += 1
+				if report is not None:
+					passEnd = time()
+					loopStatistics[-1]._addPass(delta, passEnd - passStarts[-1])
+					passStarts[-1] = passEnd
+				loopTolerance = arguments[position] if tolerance is None else tolerance
+				if delta > loopTolerance:
+					if maxIterations is not None and iterations[-1] >= maxIterations:
+						stoppedBy = LoopStop.MAX_ITERATIONS
+					elif deadline is not None and time() >= deadline:
+						stoppedBy = LoopStop.DEADLINE
+					else:
+						maxDeltas[-1] = 0
+						position = targets[position]
+						continue
+				elif delta <= loopTolerance:
+					stoppedBy = LoopStop.CONVERGED
+				else:
+					stoppedBy = LoopStop.NOT_A_NUMBER
+				maxDeltas.pop()
+				iterations.pop()
+				if delta > maxDeltas[-1]:
+					maxDeltas[-1] = delta
+				if report is not None:
+					passStarts.pop()
+					finishedLoop = loopStatistics.pop()
+					finishedLoop._stoppedBy = stoppedBy
+					report._addLoop(finishedLoop)
+			else:
+				if profiler is not None:
+					profiler._enter(entered[position])
+					delta = profiler._visitCompiled(stacks[position], targets[position])
+				else:
+					delta = targets[position].visit()
+				if delta > maxDeltas[-1]:
+					maxDeltas[-1] = delta
+			position += 1
+		if report is not None:
+			report._finish(maxDeltas[0], time() - runStart)
+		return maxDeltas[0]
+		
+	def _compile(self, schedule, path):
+		if isinstance(schedule, ScheduleStep):
+			self._addOp(_STEP, schedule.factor, schedule.index, path + (type(schedule.factor).__name__,))
+		elif isinstance(schedule, ScheduleSequence):
+			# the visit of a sequence starts at its first op, whatever schedule that op came from
+			self._pendingEntries.append(schedule.name)
+			innerPath = path + (schedule.name,)
+			for currentSchedule in schedule.schedules:
+				self._compile(currentSchedule, innerPath)
+		elif isinstance(schedule, ScheduleLoop):
+			self._pendingEntries.append(schedule.name)
+			innerPath = path + (schedule.name,)
+			self._addOp(_LOOP_START, schedule, None, innerPath)
+			bodyStart = len(self._opCodes)
+			self._compile(schedule.scheduleToLoop, innerPath)
+			self._addOp(_LOOP_END, bodyStart, schedule.maxDelta, innerPath)
+		else:
+			self._addOp(_VISIT, schedule, None, path)
+			
+	def _addOp(self, opCode, target, argument, stack):
+		self._opCodes.append(opCode)
+		self._targets.append(target)
+		self._arguments.append(argument)
+		self._stacks.append(stack)
+		self._entered.append(tuple(self._pendingEntries))
+		del self._pendingEntries[:]
+		
 class Factor(object):
 	def __init__(self, name):
 		self._name = "Factor[%s]" % name
@@ -173,6 +657,13 @@ class Factor(object):
 		for currentVariable in self._variables:
 			currentVariable.resetToPrior()
 			
+	def resetMessages(self):
+		raise NotImplementedError()
+		
+	def emitInto(self, flatGraph):
+		'''Adds this factor to a FlatFactorGraph, returning its factor index there'''
+		raise NotImplementedError()
+			
 	def sendMessage(self, messageIndex):
 		message = self._messages[messageIndex]
 		variable = self._messageToVariable[message]
@@ -233,12 +724,21 @@ class FactorGraphLayer(object):
 	def localFactors(self):
 		return self._localFactors
 		
+	@property
+	def factors(self):
+		'''Every factor this layer owns, including the ones in any nested layers'''
+		return self._localFactors
+		
 	def scheduleSequence(self, itemsToSequence, name):
 		return ScheduleSequence(name, itemsToSequence)
 		
 	def addLayerFactor(self, factor):
 		self._localFactors.append(factor)
 		
+	def emitInto(self, flatGraph):
+		for currentFactor in self.factors:
+			flatGraph.addFactor(currentFactor)
+		
 	def createPriorSchedule(self):
 		return None
 	
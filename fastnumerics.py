@@ -0,0 +1,121 @@
+'''
+Faster versions of the Gaussian functions of numerics that the rating updates spend their time in
+
+cumulativeTo and at go through math.erfc and math.exp instead of the 28 term Chebyshev series and the e ** power of
+numerics, inverseCumulativeTo starts from Acklam's rational approximation and takes one Halley step, and
+vwExceedsMargin and vwWithinMargin return v and w together from a single evaluation of the cumulative and the density
+instead of recomputing v inside w
+
+The results are not bit identical to numerics. Checked against it for x in [-38, 38], draw margins up to 10 and
+probabilities from 1e-300 to 1 - 1e-15, the difference (absolute below 1, relative above) stays under:
+
+	cumulativeTo and at: 1e-15
+	inverseCumulativeTo: 1e-13
+	v and w: 1e-10, the largest differences being in w far below the margin, where both paths lose digits to the
+	cancellation of v + x
+'''
+from math import erfc, exp, log, pi, sqrt
+import numerics
+
+# the largest differences from numerics, see the module docstring
+maxCumulativeToError = 1e-15
+maxAtError = 1e-15
+maxInverseCumulativeToError = 1e-13
+maxTruncatedGaussianError = 1e-10
+
+_invSqrt2 = 0.707106781186547524400844362104
+_invSqrt2Pi = 1.0 / sqrt(2 * pi)
+_sqrt2Pi = sqrt(2 * pi)
+_tinyDenominator = 2.222758749e-162
+
+# Acklam's rational approximation of the inverse of the normal cumulative, relative error below 1.2e-9
+_centralNumerator = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_centralDenominator = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01)
+_tailNumerator = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549671348298298e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_tailDenominator = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+_lowTail = 0.02425
+
+class NumericsMode(object):
+	'''Enum like class for the Gaussian functions a calculator computes v and w with'''
+	EXACT = 0
+	'''The functions of numerics, the reference'''
+	FAST = 1
+	'''The functions of this module, within the documented error of numerics'''
+
+def getTruncatedGaussianCorrections(mode):
+	'''The (vwExceedsMargin, vwWithinMargin) functions of a NumericsMode'''
+	if mode == NumericsMode.EXACT:
+		return (numerics.vwExceedsMargin, numerics.vwWithinMargin)
+	elif mode == NumericsMode.FAST:
+		return (vwExceedsMargin, vwWithinMargin)
+	raise ValueError("Unknown numerics mode %s" % mode)
+
+def cumulativeTo(x):
+	return 0.5 * erfc(-x * _invSqrt2)
+
+def at(x):
+	'''The value at x of the standard normal density'''
+	return _invSqrt2Pi * exp(-0.5 * x * x)
+
+def inverseCumulativeTo(x, mean=0, standardDeviation=1):
+	if x <= 0.0:
+		# the same clamp as numerics.inverseErrorFunctionCumulativeTo
+		return mean - 100 * sqrt(2) * standardDeviation
+	elif x >= 1.0:
+		return mean + 100 * sqrt(2) * standardDeviation
+	elif x > 0.5:
+		# 1 - x is exact here, and solving for the lower tail keeps the digits that x itself has lost
+		return mean - standardDeviation * _inverseLowerHalf(1.0 - x)
+	return mean + standardDeviation * _inverseLowerHalf(x)
+
+def _inverseLowerHalf(p):
+	'''The standard normal quantile of p, for 0 < p <= 0.5'''
+	if p < _lowTail:
+		q = sqrt(-2 * log(p))
+		c = _tailNumerator
+		d = _tailDenominator
+		z = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+	else:
+		q = p - 0.5
+		r = q * q
+		a = _centralNumerator
+		b = _centralDenominator
+		z = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q / (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+	# one Halley step on cumulativeTo(z) - p brings the 1e-9 of the approximation down to rounding
+	error = 0.5 * erfc(-z * _invSqrt2) - p
+	u = error * _sqrt2Pi * exp(0.5 * z * z)
+	return z - u / (1 + 0.5 * z * u)
+
+def vwExceedsMargin(teamPerformanceDifference, drawMargin, c=None):
+	'''(v, w) of numerics.vExceedsMargin and numerics.wExceedsMargin, sharing one cumulative and one density'''
+	if c is not None:
+		teamPerformanceDifference = teamPerformanceDifference / c
+		drawMargin = drawMargin / c
+	x = teamPerformanceDifference - drawMargin
+	denominator = 0.5 * erfc(-x * _invSqrt2)
+	if denominator < _tinyDenominator:
+		return (-x, 1.0 if teamPerformanceDifference < 0.0 else 0.0)
+	v = _invSqrt2Pi * exp(-0.5 * x * x) / denominator
+	return (v, v * (v + x))
+
+def vwWithinMargin(teamPerformanceDifference, drawMargin, c=None):
+	'''(v, w) of numerics.vWithinMargin and numerics.wWithinMargin, sharing two cumulatives and two densities'''
+	if c is not None:
+		teamPerformanceDifference = teamPerformanceDifference / c
+		drawMargin = drawMargin / c
+	teamPerformanceDifferenceAbsoluteValue = abs(teamPerformanceDifference)
+	upper = drawMargin - teamPerformanceDifferenceAbsoluteValue
+	lower = -drawMargin - teamPerformanceDifferenceAbsoluteValue
+	denominator = 0.5 * (erfc(-upper * _invSqrt2) - erfc(-lower * _invSqrt2))
+	if denominator < _tinyDenominator:
+		if teamPerformanceDifference < 0.0:
+			return (-teamPerformanceDifference - drawMargin, 1.0)
+		return (-teamPerformanceDifference + drawMargin, 1.0)
+	atUpper = _invSqrt2Pi * exp(-0.5 * upper * upper)
+	atLower = _invSqrt2Pi * exp(-0.5 * lower * lower)
+	# v of the absolute difference, w is even in the difference and v is odd
+	vAbsolute = (atLower - atUpper) / denominator
+	w = vAbsolute * vAbsolute + (upper * atUpper - lower * atLower) / denominator
+	if teamPerformanceDifference < 0.0:
+		return (-vAbsolute, w)
+	return (vAbsolute, w)
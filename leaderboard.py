@@ -0,0 +1,151 @@
+'''
+A leaderboard ordered by conservative rating and kept current as ratings change
+
+The players are held in an indexable skip list: every forward link also stores how many players it skips, so finding
+a player's rank or the player at a rank walks O(log n) links, like an update does. The best conservative rating is
+rank 1, players with the same conservative rating are ordered by id, and players whose conservative rating is nan
+come last
+'''
+from objects import argumentNotNone
+from random import Random
+
+_maxLevels = 32
+
+class _Node(object):
+	__slots__ = ("key", "playerId", "conservativeRating", "next", "width")
+
+	def __init__(self, key, playerId, conservativeRating, levels):
+		self.key = key
+		self.playerId = playerId
+		self.conservativeRating = conservativeRating
+		self.next = [None] * levels
+		# width[level] is how many positions next[level] is ahead of this node
+		self.width = [1] * levels
+
+class Leaderboard(object):
+	'''
+	Players ranked by conservative rating, highest first. update, remove, getRank and getPage all take O(log n)
+	expected time, getPage plus the size of the page. recordRatings takes the output of any calculateNewRatings
+	'''
+	def __init__(self, seed = None):
+		self._random = Random(seed)
+		self._head = _Node(None, None, None, _maxLevels)
+		# player id to its key in the skip list
+		self._keys = dict()
+
+	def __len__(self):
+		return len(self._keys)
+
+	def __contains__(self, playerId):
+		return playerId in self._keys
+
+	def recordRatings(self, newRatings):
+		'''Updates every player of newRatings, a list of (player, rating) as returned by calculateNewRatings'''
+		for player, rating in newRatings:
+			self.update(player.id, rating)
+
+	def update(self, playerId, rating):
+		'''Adds a player with its rating, or moves it to its new rating'''
+		argumentNotNone(rating, "rating")
+		conservativeRating = rating.conservativeRating
+		if conservativeRating == conservativeRating:
+			key = (0, -conservativeRating, playerId)
+		else:
+			# nan compares false to everything, so it gets its own place after every number
+			key = (1, 0.0, playerId)
+		oldKey = self._keys.get(playerId)
+		if oldKey is not None:
+			if oldKey == key:
+				return
+			self._removeKey(oldKey)
+		self._insert(key, playerId, conservativeRating)
+		self._keys[playerId] = key
+
+	def remove(self, playerId):
+		'''Removes a player, returning whether it was on the leaderboard'''
+		key = self._keys.pop(playerId, None)
+		if key is None:
+			return False
+		self._removeKey(key)
+		return True
+
+	def getRank(self, playerId):
+		'''The rank of a player, 1 for the best, or None if it is not on the leaderboard'''
+		key = self._keys.get(playerId)
+		if key is None:
+			return None
+		rank = 0
+		node = self._head
+		for level in reversed(range(_maxLevels)):
+			while node.next[level] is not None and node.next[level].key <= key:
+				rank += node.width[level]
+				node = node.next[level]
+		return rank
+
+	def getPage(self, firstRank, count):
+		'''A list of up to count (rank, player id, conservative rating), starting at rank firstRank'''
+		assert firstRank >= 1, "firstRank"
+		assert count >= 0, "count"
+		page = list()
+		if firstRank > len(self._keys) or count == 0:
+			return page
+		node = self._head
+		remaining = firstRank
+		for level in reversed(range(_maxLevels)):
+			while node.next[level] is not None and node.width[level] <= remaining:
+				remaining -= node.width[level]
+				node = node.next[level]
+		rank = firstRank
+		while node is not None and len(page) < count:
+			page.append((rank, node.playerId, node.conservativeRating))
+			node = node.next[0]
+			rank += 1
+		return page
+
+	def getTop(self, count):
+		return self.getPage(1, count)
+
+	def _randomLevels(self):
+		levels = 1
+		while levels < _maxLevels and self._random.random() < 0.5:
+			levels += 1
+		return levels
+
+	def _insert(self, key, playerId, conservativeRating):
+		# the last node before key at every level, and how many positions it is from the node found at the level above
+		chain = [None] * _maxLevels
+		stepsAtLevel = [0] * _maxLevels
+		node = self._head
+		for level in reversed(range(_maxLevels)):
+			while node.next[level] is not None and node.next[level].key < key:
+				stepsAtLevel[level] += node.width[level]
+				node = node.next[level]
+			chain[level] = node
+		levels = self._randomLevels()
+		newNode = _Node(key, playerId, conservativeRating, levels)
+		steps = 0
+		for level in range(levels):
+			previous = chain[level]
+			newNode.next[level] = previous.next[level]
+			previous.next[level] = newNode
+			newNode.width[level] = previous.width[level] - steps
+			previous.width[level] = steps + 1
+			steps += stepsAtLevel[level]
+		for level in range(levels, _maxLevels):
+			chain[level].width[level] += 1
+
+	def _removeKey(self, key):
+		chain = [None] * _maxLevels
+		node = self._head
+		for level in reversed(range(_maxLevels)):
+			while node.next[level] is not None and node.next[level].key < key:
+				node = node.next[level]
+			chain[level] = node
+		removedNode = chain[0].next[0]
+		levels = len(removedNode.next)
+		for level in range(levels):
+			previous = chain[level]
+			previous.width[level] += removedNode.width[level] - 1
+			previous.next[level] = removedNode.next[level]
+		for level in range(levels, _maxLevels):
+			chain[level].width[level] -= 1
@@ -0,0 +1,169 @@
+'''
+Matchmaking: turns a queue of waiting players into matches of good quality
+
+Every tick the queue is sorted by mean, and candidate matches are only formed between players close to each other in
+that order, so a tick costs O(n log n) and about n * window quality evaluations instead of n squared. Quality falls
+off with the difference of the means, so the best partners of a player are almost always among its neighbours. The
+candidates are scored with the calculateMatchQualityBatch methods of the two player and two team calculators and
+taken greedily, best first, while neither side is already taken
+
+A candidate is only accepted if its quality is at least the required quality, which starts at minQuality and drops by
+qualityDecayPerSecond for every second the longest waiting of its players has been queued, down to minQualityFloor
+'''
+from objects import argumentNotNone
+from trueskill_simple import TwoPlayerTrueSkillCalculator, TwoTeamTrueSkillCalculator
+
+class ProposedMatch(object):
+	'''Two teams, each a list of player ids, and the quality of the match between them'''
+	__slots__ = ("_teams", "_quality")
+
+	def __init__(self, teams, quality):
+		self._teams = teams
+		self._quality = quality
+
+	@property
+	def teams(self):
+		return self._teams
+
+	@property
+	def quality(self):
+		return self._quality
+
+	def __str__(self):
+		return "%s (quality %.3f)" % (" vs ".join(", ".join("%s" % playerId for playerId in team) for team in self._teams), self._quality)
+
+class Matchmaker(object):
+	'''
+	A queue of players waiting for a match of two teams of playersPerTeam players each. Players are enqueued with
+	their rating and the time they joined, and tick takes the matches it can make out of the queue
+	'''
+	def __init__(self, gameInfo, playersPerTeam = 1, window = 4, minQuality = 0.5, minQualityFloor = 0.1, qualityDecayPerSecond = 0.005):
+		'''
+		window is how many following players in mean order each player is paired with as a candidate, when
+		playersPerTeam is 1. With bigger teams every run of 2 * playersPerTeam neighbours is a candidate
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		assert playersPerTeam >= 1, "playersPerTeam"
+		assert window >= 1, "window"
+		assert 0 <= minQualityFloor <= minQuality <= 1, "minQuality"
+		assert qualityDecayPerSecond >= 0, "qualityDecayPerSecond"
+		self._gameInfo = gameInfo
+		self._playersPerTeam = playersPerTeam
+		self._window = window
+		self._minQuality = minQuality
+		self._minQualityFloor = minQualityFloor
+		self._qualityDecayPerSecond = qualityDecayPerSecond
+		self._twoPlayerCalculator = TwoPlayerTrueSkillCalculator()
+		self._twoTeamCalculator = TwoTeamTrueSkillCalculator()
+		# player id to (mean, standard deviation, enqueued at)
+		self._queue = dict()
+
+	@property
+	def playersPerTeam(self):
+		return self._playersPerTeam
+
+	def __len__(self):
+		return len(self._queue)
+
+	def __contains__(self, playerId):
+		return playerId in self._queue
+
+	def enqueue(self, playerId, rating, enqueuedAt):
+		'''Adds a player to the queue, or updates its rating and time if it is already queued'''
+		self._queue[playerId] = (rating.mean, rating.standardDeviation, enqueuedAt)
+
+	def dequeue(self, playerId):
+		'''Removes a player from the queue, returning whether it was queued'''
+		return self._queue.pop(playerId, None) is not None
+
+	def getRequiredQuality(self, waitSeconds):
+		'''The quality a match must reach when the longest waiting of its players has waited waitSeconds'''
+		return max(self._minQualityFloor, self._minQuality - self._qualityDecayPerSecond * waitSeconds)
+
+	def tick(self, now):
+		'''Returns the list of ProposedMatch made from the queue at time now, best first, and removes their players'''
+		entries = sorted((mean, standardDeviation, enqueuedAt, playerId)
+			for playerId, (mean, standardDeviation, enqueuedAt) in self._queue.iteritems())
+		# greedy maximum weight matching: best candidate first, skipping any that uses a player already taken
+		taken = [False] * len(entries)
+		matches = list()
+		if self._playersPerTeam == 1:
+			candidates = self._getPairCandidates(entries, now)
+			candidates.sort(reverse = True)
+			for quality, first, second in candidates:
+				if taken[first] or taken[second]:
+					continue
+				taken[first] = True
+				taken[second] = True
+				matches.append(ProposedMatch([[entries[first][3]], [entries[second][3]]], quality))
+		else:
+			groupSize = 2 * self._playersPerTeam
+			candidates = self._getTeamCandidates(entries, now)
+			candidates.sort(reverse = True)
+			for quality, start, teams in candidates:
+				if any(taken[start:start + groupSize]):
+					continue
+				taken[start:start + groupSize] = [True] * groupSize
+				matches.append(ProposedMatch([[entries[start + offset][3] for offset in team] for team in teams], quality))
+		for match in matches:
+			for team in match.teams:
+				for playerId in team:
+					del self._queue[playerId]
+		return matches
+
+	def _getRequiredQualities(self, entries, now):
+		'''
+		The required quality of each player on its own. The required quality of a match is that of its longest waiting
+		player, which is the smallest of them
+		'''
+		return [self.getRequiredQuality(now - entry[2]) for entry in entries]
+
+	def _getPairCandidates(self, entries, now):
+		'''(quality, first, second) of every acceptable pairing of a player with one of its next window players'''
+		means = [entry[0] for entry in entries]
+		standardDeviations = [entry[1] for entry in entries]
+		requiredQualities = self._getRequiredQualities(entries, now)
+		candidates = list()
+		for offset in range(1, min(self._window, len(entries) - 1) + 1):
+			qualities = self._twoPlayerCalculator.calculateMatchQualityBatch(self._gameInfo,
+				means[:-offset], standardDeviations[:-offset], means[offset:], standardDeviations[offset:])
+			candidates.extend([(quality, first, first + offset) for first, quality in enumerate(qualities)
+				if quality >= requiredQualities[first] or quality >= requiredQualities[first + offset]])
+		return candidates
+
+	def _getTeamCandidates(self, entries, now):
+		'''
+		(quality, start, teams) of every acceptable match of the run of 2 * playersPerTeam neighbours from start, split
+		into two teams by a snake draft from the highest mean down (A B B A A B ...). teams holds the offsets from start
+		of the players of each team
+		'''
+		groupSize = 2 * self._playersPerTeam
+		groupCount = len(entries) - groupSize + 1
+		if groupCount <= 0:
+			return list()
+		# snake draft positions, relative to the start of a group sorted by increasing mean
+		team1Offsets = list()
+		team2Offsets = list()
+		for rank in range(groupSize):
+			offset = groupSize - 1 - rank
+			if rank % 4 in (0, 3):
+				team1Offsets.append(offset)
+			else:
+				team2Offsets.append(offset)
+		means = [entry[0] for entry in entries]
+		variances = [entry[1]**2.0 for entry in entries]
+		team1MeanSums = [0.0] * groupCount
+		team1VarianceSums = [0.0] * groupCount
+		team2MeanSums = [0.0] * groupCount
+		team2VarianceSums = [0.0] * groupCount
+		for start in range(groupCount):
+			team1MeanSums[start] = sum(means[start + offset] for offset in team1Offsets)
+			team1VarianceSums[start] = sum(variances[start + offset] for offset in team1Offsets)
+			team2MeanSums[start] = sum(means[start + offset] for offset in team2Offsets)
+			team2VarianceSums[start] = sum(variances[start + offset] for offset in team2Offsets)
+		qualities = self._twoTeamCalculator.calculateMatchQualityBatch(self._gameInfo, team1MeanSums, team1VarianceSums,
+			team2MeanSums, team2VarianceSums, [groupSize] * groupCount)
+		requiredQualities = self._getRequiredQualities(entries, now)
+		teams = (team1Offsets, team2Offsets)
+		return [(quality, start, teams) for start, quality in enumerate(qualities)
+			if quality >= min(requiredQualities[start:start + groupSize])]
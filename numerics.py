@@ -1,7 +1,10 @@
-from math import sqrt, pi, log, e
+from math import sqrt, pi, log, e, copysign
 import sys
 
 _intMinValue = -sys.maxint - 1
+_inf = float('inf')
+_nan = float('nan')
+_logSqrt2Pi = log(sqrt(2 * pi))
 
 def getDrawMarginFromDrawProbability(drawProbability, beta):
 	return inverseCumulativeTo(0.5 * (drawProbability + 1), 0, 1) * sqrt(1 + 1.0) * beta
@@ -54,6 +57,14 @@ def wWithinMargin(teamPerformanceDifference, drawMargin, c=None):
 	vt = vWithinMargin(teamPerformanceDifferenceAbsoluteValue, drawMargin)
 	return vt ** 2.0 + ((drawMargin - teamPerformanceDifferenceAbsoluteValue)	 * at(drawMargin - teamPerformanceDifferenceAbsoluteValue) - (-1 * drawMargin - teamPerformanceDifferenceAbsoluteValue) * at(-1 * drawMargin - teamPerformanceDifferenceAbsoluteValue)) / denominator
 
+def vwExceedsMargin(teamPerformanceDifference, drawMargin, c=None):
+	'''(vExceedsMargin, wExceedsMargin) as a tuple, the form the calculators take their corrections in'''
+	return (vExceedsMargin(teamPerformanceDifference, drawMargin, c), wExceedsMargin(teamPerformanceDifference, drawMargin, c))
+
+def vwWithinMargin(teamPerformanceDifference, drawMargin, c=None):
+	'''(vWithinMargin, wWithinMargin) as a tuple, the form the calculators take their corrections in'''
+	return (vWithinMargin(teamPerformanceDifference, drawMargin, c), wWithinMargin(teamPerformanceDifference, drawMargin, c))
+
 def mean(items):
 	return sum(items) / len(items)
 
@@ -61,21 +72,22 @@ def fromRating(rating):
 	return GaussianDistribution(rating.mean, rating.standardDeviation)
 
 def fromGaussianDistribution(distribution):
-	return GaussianDistribution(distribution.mean, distribution.standardDeviation, distribution.precision, distribution.precisionMean)
+	return fromPrecisionMean(distribution.precisionMean, distribution.precision)
 
 def fromPrecisionMean(precisionMean, precision):
-	variance = None
-	standardDeviation = None
-	mean = None
-	if precision == 0:
-		variance = float('inf')
-		standardDeviation = float('inf')
-		mean = float('nan')
-	else:
-		variance = Decimal(1.0) / precision
-		standardDeviation = variance.sqrt()
-		mean = precisionMean / precision
-	return GaussianDistribution(mean, standardDeviation, variance, precision, precisionMean)
+	'''Creates a Gaussian straight from its natural parameters, without computing any of the derived values'''
+	distribution = _newGaussianDistribution(GaussianDistribution)
+	distribution._precisionMean = precisionMean
+	distribution._precision = precision
+	return distribution
+
+def ieeeDivide(numerator, denominator):
+	'''Divides like IEEE 754 floats do: dividing by zero gives a signed infinity (nan for 0/0) instead of raising'''
+	if denominator == 0:
+		if numerator == 0 or numerator != numerator:
+			return _nan
+		return copysign(_inf, numerator) * copysign(1.0, denominator)
+	return numerator / denominator
 
 def mult(left, right):
 	return left.mult(right)
@@ -83,7 +95,7 @@ def mult(left, right):
 def absoluteDifference(left, right):
 	"""Computes the absolute difference between two Gaussians"""
 	precisionMean = abs(left.precisionMean - right.precisionMean)
-	precision = abs(left.precision - right.precision).sqrt()
+	precision = sqrt(abs(left.precision - right.precision))
 	return max(precisionMean, precision)
 
 def divide(numerator, denominator):
@@ -94,16 +106,14 @@ def logRatioNormalization(numerator, denominator):
 		return 0
 	varianceDifference = denominator.variance - numerator.variance
 	meanDifference = numerator.mean - denominator.mean
-	logSqrt2Pi = log(sqrt(2 * pi))
-	return denominator.variance.log() + logSqrt2Pi - varianceDifference.log() / 2.0 + (meanDifference ** 2) / (varianceDifference * 2.0)
+	return log(denominator.variance) + _logSqrt2Pi - log(varianceDifference) / 2.0 + (meanDifference ** 2) / (varianceDifference * 2.0)
 
 def logProductNormalization(left, right):
 	if (left.precision == 0) or (right.precision == 0):
 		return 0
 	varianceSum = left.variance + right.variance
 	meanDifference = left.mean - right.mean
-	logSqrt2Pi = log(sqrt(2 * pi))
-	return Decimal(-1 * logSqrt2Pi) - (varianceSum.log() / 2.0) - ((meanDifference ** 2) / (varianceSum * 2.0))
+	return -1 * _logSqrt2Pi - (log(varianceSum) / 2.0) - ((meanDifference ** 2) / (varianceSum * 2.0))
 
 def at(x, mean=0, standardDeviation=1):
 	"""calculates the value at x of a normalized Gaussian"""
@@ -235,21 +245,28 @@ class GaussianDistribution(object):
 		   1	 -(x-mu)^2 / (2*sigma^2)
 	p(x) =  -------*e
 		sqrt(2*pi)
+
+	Only the natural parameters (precision and precisionMean) are stored, as plain floats, since they are all that
+	multiplying and dividing Gaussians needs. The mean, variance and standard deviation are derived on access, and
+	follow IEEE 754 rules for a precision of 0 (an infinite variance and a nan mean)
 	'''
+	__slots__ = ('_precision', '_precisionMean')
+
 	@property
 	def mean(self):
 		"""The peak of the Gaussian, mu"""
-		return self._mean
+		return ieeeDivide(self._precisionMean, self._precision)
 
 	@property
 	def standardDeviation(self):
 		""" The width of the Gaussian, sigma, where the height drops to max/e"""
-		return self._standardDeviation
+		variance = self.variance
+		return sqrt(variance) if variance >= 0 else _nan
 
 	@property
 	def variance(self):
 		""" The square root of the standard devaition, sigma^2 """
-		return self._variance
+		return ieeeDivide(1.0, self._precision)
 
 	@property
 	def precision(self):
@@ -263,26 +280,27 @@ class GaussianDistribution(object):
 
 	def getNormalizationContant(self):
 		"""The normalization contant multiplies the exponential and causes the integral over (-Inf, Inf) to equal 1"""
-		return 1.0 / (sqrt(2 * pi) * self._standardDeviation)
+		return 1.0 / (sqrt(2 * pi) * self.standardDeviation)
 
 	def __init__(self, mean, standardDeviation, variance=None, precision=None, precisionMean=None):
-		self._mean = Decimal(mean)
-		self._standardDeviation = Decimal(standardDeviation)
-		self._variance = Decimal((variance if variance is not None else standardDeviation ** 2.0))
-		self._precision = Decimal((precision if precision is not None else 1.0 / (standardDeviation ** 2.0)))
-		self._precisionMean = Decimal((precisionMean if precisionMean is not None else mean / (standardDeviation ** 2.0)))
+		self._precision = precision if precision is not None else 1.0 / (standardDeviation ** 2.0)
+		self._precisionMean = precisionMean if precisionMean is not None else mean / (standardDeviation ** 2.0)
 
 	def __mul__(self, gaussian):
-		return fromPrecisionMean(self._precisionMean + gaussian.precisionMean, self._precision + gaussian.precision)
+		return fromPrecisionMean(self._precisionMean + gaussian._precisionMean, self._precision + gaussian._precision)
 
 	def __div__(self, gaussian):
-		return fromPrecisionMean(self._precisionMean - gaussian.precisionMean, self._precision - gaussian.precision)
+		return fromPrecisionMean(self._precisionMean - gaussian._precisionMean, self._precision - gaussian._precision)
+
+	__truediv__ = __div__
 	
 	def __sub__(self, other):
 		return absoluteDifference(self, other)
 	
 	def __repr__(self):
-		return "mu={0}, sigma={1}".format(self._mean, self._standardDeviation)
+		return "mu={0}, sigma={1}".format(self.mean, self.standardDeviation)
+
+_newGaussianDistribution = object.__new__
 
 class Matrix(object):
 	__errorTolerance = 0.0000000001
@@ -340,13 +358,16 @@ class Matrix(object):
 			c = self._values[1][0]
 			d = self._values[1][1]
 			return a * d - b * c
+		elif self._isIntegral:
+			return self._getBareissDeterminant()
 		else:
-			result = 0.0
-			for i in range(len(self._values[0])):
-				firstRowColValue = self._values[0][i]
-				cofactor = self._getCofactor(0, i)
-				itemToAdd = firstRowColValue * cofactor
-				result = result + itemToAdd
+			decomposition = self._getLUDecomposition()
+			if decomposition is None:
+				return 0.0
+			lu, permutation, sign = decomposition
+			result = float(sign)
+			for i in range(self._rows):
+				result = result * lu[i][i]
 			return result
 
 	@property
@@ -359,18 +380,81 @@ class Matrix(object):
 			c = self._values[1][0]
 			d = self._values[1][1]
 			return _SquareMatrix([d, -b, -c, a])
-		else:
-			result = [[0] * len(self._values) for i in range(len(self._values[0]))]
-			for currentRow in range(len(self._values)):
-				for currentCol in range(len(self._values[0])):
-					result[currentCol][currentRow] = self._getCofactor(currentRow, currentCol)
-			return Matrix(result)
+		determinant = self.determinant
+		if determinant != 0:
+			# adj(A) = det(A) * A^-1
+			return self.inverse * determinant
+		# a singular matrix has no inverse to go through, so fall back to the cofactors
+		result = [[0] * len(self._values) for i in range(len(self._values[0]))]
+		for currentRow in range(len(self._values)):
+			for currentCol in range(len(self._values[0])):
+				result[currentCol][currentRow] = self._getCofactor(currentRow, currentCol)
+		return Matrix(result)
 
 	@property
 	def inverse(self):
 		if self._rows == 1 and self._cols == 1:
 			return _SquareMatrix([1.0 / self._values[0][0]])
-		return self.adjugate * (1.0 / self.determinant)
+		return self.solve(_IdentityMatrix(self._rows))
+
+	@property
+	def cholesky(self):
+		'''
+		The lower triangular matrix L such that L * L.transpose equals this matrix, which must be symmetric and
+		positive definite. Raises a ValueError if it is not positive definite
+		'''
+		if self.isSquare == False:
+			raise AttributeError('The matrix is not square')
+		size = self._rows
+		lower = [[0.0] * size for i in range(size)]
+		for row in range(size):
+			lowerRow = lower[row]
+			for col in range(row + 1):
+				lowerCol = lower[col]
+				total = self._values[row][col]
+				for k in range(col):
+					total = total - lowerRow[k] * lowerCol[k]
+				if row == col:
+					if total <= 0:
+						raise ValueError('The matrix is not positive definite')
+					lowerRow[col] = sqrt(total)
+				else:
+					lowerRow[col] = total / lowerCol[col]
+		return _LowerTriangularMatrix(lower)
+
+	def solve(self, rightHandSide):
+		'''
+		Solves self * X = rightHandSide for X through an LU decomposition with partial pivoting
+		rightHandSide must be a matrix with as many rows as this one, and X has as many columns as rightHandSide
+		'''
+		if self.isSquare == False:
+			raise AttributeError('The matrix is not square')
+		if rightHandSide.rows != self._rows:
+			raise AttributeError('The height of the right hand side must match the height of the matrix')
+		decomposition = self._getLUDecomposition()
+		if decomposition is None:
+			raise ZeroDivisionError('The matrix is singular')
+		lu, permutation, sign = decomposition
+		size = self._rows
+		resultValues = [[0.0] * rightHandSide.cols for i in range(size)]
+		for currentColumn in range(rightHandSide.cols):
+			# forward substitution with the unit lower triangle, then back substitution with the upper triangle
+			x = [rightHandSide.get(permutation[i], currentColumn) for i in range(size)]
+			for i in range(size):
+				luRow = lu[i]
+				total = x[i]
+				for k in range(i):
+					total = total - luRow[k] * x[k]
+				x[i] = total
+			for i in range(size - 1, -1, -1):
+				luRow = lu[i]
+				total = x[i]
+				for k in range(i + 1, size):
+					total = total - luRow[k] * x[k]
+				x[i] = total / luRow[i]
+			for i in range(size):
+				resultValues[i][currentColumn] = x[i]
+		return Matrix(resultValues)
 
 	def __mul__(self, other):
 		if isinstance(other, Matrix):
@@ -395,6 +479,10 @@ class Matrix(object):
 					newValues[i][j] = other * self._values[i][j]
 			return Matrix(newValues)
 
+	def __rmul__(self, other):
+		# only reached for scalar * matrix, a matrix on the left goes through its own __mul__
+		return self * other
+
 	def __add__(self, other):
 		if other.rows != self._rows or other.cols != self._cols:
 			raise ValueError('Matricies must be of same size')
@@ -441,6 +529,76 @@ class Matrix(object):
 			det = det * -1.0
 		return det
 
+	@property
+	def _isIntegral(self):
+		# numbers is imported here, as importing it (and the abc machinery behind it) is a large part of the time it
+		# takes to import this module
+		from numbers import Integral
+		for row in self._values:
+			for value in row:
+				if isinstance(value, Integral) == False:
+					return False
+		return True
+
+	def _getLUDecomposition(self):
+		'''
+		Doolittle LU decomposition with partial pivoting, in O(n^3)
+		Returns a tuple of (lu, permutation, sign) where lu holds both triangles in one list of rows (the unit
+		diagonal of L is implied), row i of lu comes from row permutation[i] of this matrix, and sign is the sign of
+		that permutation. Returns None if the matrix is singular
+		'''
+		size = self._rows
+		lu = [[float(value) for value in row] for row in self._values]
+		permutation = list(range(size))
+		sign = 1
+		for col in range(size):
+			pivotRow = col
+			pivotValue = abs(lu[col][col])
+			for row in range(col + 1, size):
+				if abs(lu[row][col]) > pivotValue:
+					pivotRow = row
+					pivotValue = abs(lu[row][col])
+			if pivotValue == 0:
+				return None
+			if pivotRow != col:
+				lu[col], lu[pivotRow] = lu[pivotRow], lu[col]
+				permutation[col], permutation[pivotRow] = permutation[pivotRow], permutation[col]
+				sign = -sign
+			pivotLuRow = lu[col]
+			pivot = pivotLuRow[col]
+			for row in range(col + 1, size):
+				luRow = lu[row]
+				factor = luRow[col] / pivot
+				luRow[col] = factor
+				if factor != 0:
+					for k in range(col + 1, size):
+						luRow[k] = luRow[k] - factor * pivotLuRow[k]
+		return (lu, permutation, sign)
+
+	def _getBareissDeterminant(self):
+		'''Fraction free elimination (Bareiss), which keeps the determinant of an integer matrix exact in O(n^3)'''
+		size = self._rows
+		values = [list(row) for row in self._values]
+		sign = 1
+		previousPivot = 1
+		for col in range(size - 1):
+			if values[col][col] == 0:
+				swapRow = None
+				for row in range(col + 1, size):
+					if values[row][col] != 0:
+						swapRow = row
+						break
+				if swapRow is None:
+					return 0
+				values[col], values[swapRow] = values[swapRow], values[col]
+				sign = -sign
+			pivot = values[col][col]
+			for row in range(col + 1, size):
+				for k in range(col + 1, size):
+					values[row][k] = (values[row][k] * pivot - values[row][col] * values[col][k]) // previousPivot
+			previousPivot = pivot
+		return sign * values[size - 1][size - 1]
+
 class _DiagonalMatrix(Matrix):
 	'''A matrix with values on the diagonal, and 0 everywhere else'''
 	def __init__(self, diagonalValues):
@@ -459,10 +617,32 @@ class _IdentityMatrix(_DiagonalMatrix):
 		super(_IdentityMatrix, self).__init__(values)
 
 class _Vector(Matrix):
-	'''A matrix with only 1 row'''
+	'''A matrix with only 1 column'''
 	def __init__(self, values):
-		'''Creates a matrix with the values in the list values in one row'''
-		super(_Vector, self).__init__(values)
+		'''Creates a matrix with the values in the list values in one column'''
+		super(_Vector, self).__init__([[value] for value in values])
+
+class _LowerTriangularMatrix(Matrix):
+	'''A square matrix with 0 everywhere above the diagonal, such as a Cholesky factor'''
+	@property
+	def determinant(self):
+		result = 1.0
+		for i in range(self._rows):
+			result = result * self._values[i][i]
+		return result
+
+	def forwardSubstitute(self, rightHandSide):
+		'''Solves self * X = rightHandSide for X in O(n^2) per column of rightHandSide'''
+		size = self._rows
+		resultValues = [[0.0] * rightHandSide.cols for i in range(size)]
+		for currentColumn in range(rightHandSide.cols):
+			for i in range(size):
+				row = self._values[i]
+				total = rightHandSide.get(i, currentColumn)
+				for k in range(i):
+					total = total - row[k] * resultValues[k][currentColumn]
+				resultValues[i][currentColumn] = total / row[i]
+		return Matrix(resultValues)
 
 class _SquareMatrix(Matrix):
 	'''A matrix where the number of rows equals the number of columns'''
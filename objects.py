@@ -1,4 +1,4 @@
-from numerics import fromPrecisionMean
+from numerics import fromPrecisionMean, getDrawMarginFromDrawProbability
 from numerics import fromRating
 
 _defaultPartialPlayPercentage = 1.0
@@ -86,6 +86,7 @@ class GameInfo(object):
 	@initialMean.setter
 	def initialMean(self, value):
 		self._initialMean = value
+		self._profile = None
 
 	@property
 	def initialStandardDeviation(self):
@@ -95,6 +96,7 @@ class GameInfo(object):
 	@initialStandardDeviation.setter
 	def initialStandardDeviation(self, value):
 		self._initialStandardDeviation = value
+		self._profile = None
 
 	@property
 	def beta(self):
@@ -105,6 +107,7 @@ class GameInfo(object):
 	@beta.setter
 	def beta(self, value):
 		self._beta = value
+		self._profile = None
 
 	@property
 	def dynamicsFactor(self):
@@ -115,6 +118,7 @@ class GameInfo(object):
 	@dynamicsFactor.setter
 	def dynamicsFactor(self, value):
 		self._dynamicsFactor = value
+		self._profile = None
 
 	@property
 	def drawProbability(self):
@@ -124,17 +128,77 @@ class GameInfo(object):
 	@drawProbability.setter
 	def drawProbability(self, value):
 		self._drawProbability = value
+		self._profile = None
 
 	@property
 	def defaultRating(self):
 		return Rating(self._initialMean, self._initialStandardDeviation)
 
+	@property
+	def profile(self):
+		'''
+		The GameInfoProfile of the current parameters. It is built on first use and kept until a setter changes a
+		parameter, so calculators can read the draw margin and squared parameters without computing them per game
+		'''
+		if self._profile is None:
+			self._profile = GameInfoProfile(self)
+		return self._profile
+
 	def __init__(self, initialMean, initialStandardDeviation, beta, dynamicFactor, drawProbability):
 		self._initialMean = initialMean
 		self._initialStandardDeviation = initialStandardDeviation
 		self._beta = beta
 		self._dynamicsFactor = dynamicFactor
 		self._drawProbability = drawProbability
+		self._profile = None
+
+	def __getstate__(self):
+		# the profile is left out, to be rebuilt on first use, so pickles stay small and do not depend on its class
+		state = self.__dict__.copy()
+		state["_profile"] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._profile = None
+
+class GameInfoProfile(object):
+	'''The constants the calculators derive from a GameInfo, computed once. Read only'''
+	__slots__ = ("_beta", "_betaSquared", "_twoBetaSquared", "_tauSquared", "_drawProbability", "_drawMargin")
+
+	@property
+	def beta(self):
+		return self._beta
+
+	@property
+	def betaSquared(self):
+		return self._betaSquared
+
+	@property
+	def twoBetaSquared(self):
+		return self._twoBetaSquared
+
+	@property
+	def tauSquared(self):
+		'''The dynamics factor squared'''
+		return self._tauSquared
+
+	@property
+	def drawProbability(self):
+		return self._drawProbability
+
+	@property
+	def drawMargin(self):
+		'''The draw margin of the draw probability and beta, from getDrawMarginFromDrawProbability'''
+		return self._drawMargin
+
+	def __init__(self, gameInfo):
+		self._beta = gameInfo.beta
+		self._betaSquared = gameInfo.beta**2.0
+		self._twoBetaSquared = 2.0*self._betaSquared
+		self._tauSquared = gameInfo.dynamicsFactor**2.0
+		self._drawProbability = gameInfo.drawProbability
+		self._drawMargin = getDrawMarginFromDrawProbability(gameInfo.drawProbability, gameInfo.beta)
 
 class SupportPartialPlay(object):
 	'''Class to be extended and implemented for denoting that a class supports partial play'''
@@ -0,0 +1,194 @@
+'''
+An index of ratings for finding good opponents without computing the match quality against every player
+
+The quality of a two player match is sqrt(2 beta^2 / d) * exp(-(mean difference)^2 / (2 d)), where
+d = 2 beta^2 + sigma^2 + sigma'^2. Players are put in buckets by standard deviation and kept sorted by mean in each
+bucket. Within a bucket the sigma' of every player lies between the bucket's low and high bounds, so the quality of
+any player of the bucket at a given mean difference is at most
+
+	sqrt(2 beta^2 / (2 beta^2 + sigma^2 + low^2)) * exp(-(mean difference)^2 / (2 (2 beta^2 + sigma^2 + high^2)))
+
+That bound shrinks as the mean difference grows, so it turns "quality at least q" into a range of means to bisect in
+each bucket, and lets a top k search stop walking away from the player's mean once the bound falls below the k-th best
+quality found. Only the players left are scored, with TwoPlayerTrueSkillCalculator.calculateMatchQualityBatch. The
+bound is raised by a relative _boundSlack so rounding never prunes a player it should not
+'''
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush, heapreplace
+from math import exp, log, sqrt
+from objects import argumentNotNone
+from trueskill_simple import TwoPlayerTrueSkillCalculator
+
+_defaultSigmaBucketWidth = 0.5
+_boundSlack = 1.0 + 1e-9
+
+class _SigmaBucket(object):
+	'''
+	The players of one range of standard deviations, as parallel lists sorted by mean. low and high are the smallest
+	and largest standard deviation ever put in the bucket, so they bound every standard deviation in it
+	'''
+	def __init__(self, standardDeviation):
+		self.low = standardDeviation
+		self.high = standardDeviation
+		self.means = list()
+		self.standardDeviations = list()
+		self.playerIds = list()
+
+	def insert(self, playerId, mean, standardDeviation):
+		self.low = min(self.low, standardDeviation)
+		self.high = max(self.high, standardDeviation)
+		position = bisect_right(self.means, mean)
+		self.means.insert(position, mean)
+		self.standardDeviations.insert(position, standardDeviation)
+		self.playerIds.insert(position, playerId)
+
+	def remove(self, playerId, mean):
+		position = bisect_left(self.means, mean)
+		while self.playerIds[position] != playerId:
+			position += 1
+		del self.means[position]
+		del self.standardDeviations[position]
+		del self.playerIds[position]
+
+class RatingIndex(object):
+	'''
+	Two player opponents by match quality, for a fixed GameInfo. Players are added, moved and removed by id, and a
+	player being searched for is never returned as its own opponent
+	'''
+	def __init__(self, gameInfo, sigmaBucketWidth = _defaultSigmaBucketWidth):
+		argumentNotNone(gameInfo, "gameInfo")
+		assert sigmaBucketWidth > 0, "sigmaBucketWidth"
+		self._gameInfo = gameInfo
+		self._twoBetaSquared = gameInfo.profile.twoBetaSquared
+		self._sigmaBucketWidth = sigmaBucketWidth
+		self._calculator = TwoPlayerTrueSkillCalculator()
+		self._buckets = dict()
+		# player id to (bucket, mean, standard deviation)
+		self._players = dict()
+
+	@staticmethod
+	def fromStore(gameInfo, store, sigmaBucketWidth = _defaultSigmaBucketWidth):
+		'''An index of every player of store, a replay.RatingStore or ratingstore.ArrayRatingStore'''
+		index = RatingIndex(gameInfo, sigmaBucketWidth)
+		bucketEntries = dict()
+		for playerId, rating in store.iterRatings():
+			mean = rating.mean
+			standardDeviation = rating.standardDeviation
+			if playerId in index._players:
+				continue
+			bucketNumber = int(standardDeviation // sigmaBucketWidth)
+			bucketEntries.setdefault(bucketNumber, list()).append((mean, standardDeviation, playerId))
+			index._players[playerId] = (bucketNumber, mean, standardDeviation)
+		for bucketNumber, entries in bucketEntries.iteritems():
+			entries.sort(key = lambda entry: entry[0])
+			bucket = _SigmaBucket(entries[0][1])
+			bucket.means = [entry[0] for entry in entries]
+			bucket.standardDeviations = [entry[1] for entry in entries]
+			bucket.playerIds = [entry[2] for entry in entries]
+			bucket.low = min(bucket.standardDeviations)
+			bucket.high = max(bucket.standardDeviations)
+			index._buckets[bucketNumber] = bucket
+		return index
+
+	def __len__(self):
+		return len(self._players)
+
+	def __contains__(self, playerId):
+		return playerId in self._players
+
+	def put(self, playerId, rating):
+		'''Adds a player, or moves it to its new rating'''
+		self.remove(playerId)
+		mean = rating.mean
+		standardDeviation = rating.standardDeviation
+		bucketNumber = int(standardDeviation // self._sigmaBucketWidth)
+		bucket = self._buckets.get(bucketNumber)
+		if bucket is None:
+			bucket = _SigmaBucket(standardDeviation)
+			self._buckets[bucketNumber] = bucket
+		bucket.insert(playerId, mean, standardDeviation)
+		self._players[playerId] = (bucketNumber, mean, standardDeviation)
+
+	def remove(self, playerId):
+		'''Removes a player, returning whether it was in the index'''
+		entry = self._players.pop(playerId, None)
+		if entry is None:
+			return False
+		bucketNumber, mean, standardDeviation = entry
+		bucket = self._buckets[bucketNumber]
+		bucket.remove(playerId, mean)
+		if len(bucket.means) == 0:
+			del self._buckets[bucketNumber]
+		return True
+
+	def findOpponents(self, rating, minQuality, excludePlayerId = None):
+		'''
+		Every player whose match quality with a player of the given rating is at least minQuality, as a list of
+		(quality, player id), best first
+		'''
+		assert 0 < minQuality <= 1, "minQuality"
+		mean = rating.mean
+		variance = rating.standardDeviation**2.0
+		twoBetaSquared = self._twoBetaSquared
+		survivorMeans = list()
+		survivorStandardDeviations = list()
+		survivorIds = list()
+		for bucket in self._buckets.itervalues():
+			sqrtPartBound = _boundSlack * sqrt(twoBetaSquared / (twoBetaSquared + variance + bucket.low**2.0))
+			if sqrtPartBound < minQuality:
+				continue
+			# exp(-x^2 / (2 d)) >= minQuality / sqrtPartBound
+			radius = sqrt(2.0 * (twoBetaSquared + variance + bucket.high**2.0) * log(sqrtPartBound / minQuality))
+			start = bisect_left(bucket.means, mean - radius)
+			end = bisect_right(bucket.means, mean + radius)
+			survivorMeans.extend(bucket.means[start:end])
+			survivorStandardDeviations.extend(bucket.standardDeviations[start:end])
+			survivorIds.extend(bucket.playerIds[start:end])
+		survivorCount = len(survivorIds)
+		qualities = self._calculator.calculateMatchQualityBatch(self._gameInfo, [mean] * survivorCount,
+			[rating.standardDeviation] * survivorCount, survivorMeans, survivorStandardDeviations)
+		opponents = [(qualities[i], survivorIds[i]) for i in range(survivorCount)
+			if qualities[i] >= minQuality and survivorIds[i] != excludePlayerId]
+		opponents.sort(reverse = True)
+		return opponents
+
+	def findBestOpponents(self, rating, count, excludePlayerId = None):
+		'''The count players with the best match quality with a player of the given rating, as (quality, player id), best first'''
+		assert count > 0, "count"
+		mean = rating.mean
+		standardDeviation = rating.standardDeviation
+		variance = standardDeviation**2.0
+		twoBetaSquared = self._twoBetaSquared
+
+		# a cursor walks one bucket away from mean in one direction (step), from position. The heap is ordered by the
+		# negated bound of the player at position, so the cursor whose next player could have the best quality comes first
+		cursors = list()
+		for bucket in self._buckets.itervalues():
+			sqrtPartBound = _boundSlack * sqrt(twoBetaSquared / (twoBetaSquared + variance + bucket.low**2.0))
+			boundDenominator = 2.0 * (twoBetaSquared + variance + bucket.high**2.0)
+			middle = bisect_left(bucket.means, mean)
+			for position, step in ((middle - 1, -1), (middle, 1)):
+				if 0 <= position < len(bucket.means):
+					bound = sqrtPartBound * exp(-((bucket.means[position] - mean)**2.0) / boundDenominator)
+					heappush(cursors, (-bound, step, position, bucket, sqrtPartBound, boundDenominator))
+
+		# min heap of the best (quality, player id) found so far
+		best = list()
+		while len(cursors) > 0:
+			negativeBound, step, position, bucket, sqrtPartBound, boundDenominator = heappop(cursors)
+			if len(best) == count and -negativeBound <= best[0][0]:
+				break
+			playerId = bucket.playerIds[position]
+			if playerId != excludePlayerId:
+				quality = self._calculator.calculateMatchQualityBatch(self._gameInfo, [mean], [standardDeviation],
+					[bucket.means[position]], [bucket.standardDeviations[position]])[0]
+				if len(best) < count:
+					heappush(best, (quality, playerId))
+				elif quality > best[0][0]:
+					heapreplace(best, (quality, playerId))
+			position += step
+			if 0 <= position < len(bucket.means):
+				bound = sqrtPartBound * exp(-((bucket.means[position] - mean)**2.0) / boundDenominator)
+				heappush(cursors, (-bound, step, position, bucket, sqrtPartBound, boundDenominator))
+		best.sort(reverse = True)
+		return best
@@ -0,0 +1,175 @@
+'''
+A rating store for very many players that keeps ratings in flat float arrays instead of Rating objects
+'''
+from array import array
+from objects import Rating, _defaultConservativeStandardDeviationMultiplier
+import sys
+
+_nan = float("nan")
+
+class ArrayRatingStore(object):
+	'''
+	Ratings by player id, kept as mean, standard deviation and last played time in typed arrays. Every player id is
+	interned to an integer slot the first time it is put, and the arrays are indexed by slot, so a player costs three
+	doubles plus an entry in the id index instead of a Rating object with its instance dict
+
+	get and put work like replay.RatingStore, so either can back a ReplayEngine. get hands out RatingView objects that
+	read and write the arrays and can be passed to any calculator. getMany and putMany move whole batches of means and
+	standard deviations, in the form the calculateNewRatingsBatch methods take and return
+	'''
+	def __init__(self):
+		self._slots = dict()
+		self._playerIds = list()
+		self._means = array('d')
+		self._standardDeviations = array('d')
+		self._lastPlayed = array('d')
+
+	@property
+	def playerIds(self):
+		'''Every player id in the store, in slot order'''
+		return self._playerIds
+
+	def __len__(self):
+		return len(self._playerIds)
+
+	def __contains__(self, playerId):
+		return playerId in self._slots
+
+	def getSlot(self, playerId):
+		'''The slot of playerId, or None if it is not in the store'''
+		return self._slots.get(playerId)
+
+	def intern(self, playerId, defaultRating):
+		'''The slot of playerId, adding the player with defaultRating first if it is not in the store'''
+		slot = self._slots.get(playerId)
+		if slot is None:
+			slot = self._addSlot(playerId, defaultRating.mean, defaultRating.standardDeviation)
+		return slot
+
+	def get(self, playerId, defaultRating):
+		'''A RatingView of playerId, or defaultRating if the player is not in the store'''
+		slot = self._slots.get(playerId)
+		if slot is None:
+			return defaultRating
+		return RatingView(self, slot)
+
+	def put(self, playerId, rating, lastPlayed = None):
+		'''Stores the mean and standard deviation of rating for playerId, and lastPlayed if it is given'''
+		slot = self.intern(playerId, rating)
+		self._means[slot] = rating.mean
+		self._standardDeviations[slot] = rating.standardDeviation
+		if lastPlayed is not None:
+			self._lastPlayed[slot] = lastPlayed
+
+	def getMany(self, playerIds, defaultRating):
+		'''A tuple of the list of means and the list of standard deviations of playerIds'''
+		slots = self._slots
+		means = self._means
+		standardDeviations = self._standardDeviations
+		resultMeans = list()
+		resultStandardDeviations = list()
+		for playerId in playerIds:
+			slot = slots.get(playerId)
+			if slot is None:
+				resultMeans.append(defaultRating.mean)
+				resultStandardDeviations.append(defaultRating.standardDeviation)
+			else:
+				resultMeans.append(means[slot])
+				resultStandardDeviations.append(standardDeviations[slot])
+		return (resultMeans, resultStandardDeviations)
+
+	def putMany(self, playerIds, means, standardDeviations, lastPlayed = None):
+		'''Stores a mean and standard deviation for each of playerIds, and the same lastPlayed for all if it is given'''
+		assert len(playerIds) == len(means) == len(standardDeviations), "length of args"
+		slots = self._slots
+		for playerId, mean, standardDeviation in zip(playerIds, means, standardDeviations):
+			slot = slots.get(playerId)
+			if slot is None:
+				slot = self._addSlot(playerId, mean, standardDeviation)
+			self._means[slot] = mean
+			self._standardDeviations[slot] = standardDeviation
+			if lastPlayed is not None:
+				self._lastPlayed[slot] = lastPlayed
+
+	def iterRatings(self):
+		'''Generates (player id, RatingView) for every player in the store, in slot order'''
+		for slot in range(len(self._playerIds)):
+			yield (self._playerIds[slot], RatingView(self, slot))
+
+	def getLastPlayed(self, playerId):
+		'''The last played time stored for playerId, or None if there is none'''
+		slot = self._slots.get(playerId)
+		if slot is None or self._lastPlayed[slot] != self._lastPlayed[slot]:
+			return None
+		return self._lastPlayed[slot]
+
+	@property
+	def sizeInBytes(self):
+		'''Bytes used by the arrays and the id index, not counting the player id objects themselves'''
+		return (sys.getsizeof(self._slots) + sys.getsizeof(self._playerIds) + sys.getsizeof(self._means) +
+			sys.getsizeof(self._standardDeviations) + sys.getsizeof(self._lastPlayed))
+
+	@property
+	def bytesPerPlayer(self):
+		return float(self.sizeInBytes) / len(self._playerIds) if len(self._playerIds) > 0 else 0.0
+
+	def _addSlot(self, playerId, mean, standardDeviation):
+		slot = len(self._playerIds)
+		self._slots[playerId] = slot
+		self._playerIds.append(playerId)
+		self._means.append(mean)
+		self._standardDeviations.append(standardDeviation)
+		self._lastPlayed.append(_nan)
+		return slot
+
+def getObjectModelBytesPerPlayer(ratings):
+	'''
+	Bytes per player of keeping a dict of player id to Rating, as replay.RatingStore does, for comparing with
+	ArrayRatingStore.bytesPerPlayer. ratings is such a dict; the player id objects are not counted
+	'''
+	if len(ratings) == 0:
+		return 0.0
+	total = sys.getsizeof(ratings)
+	for rating in ratings.values():
+		total += sys.getsizeof(rating) + sys.getsizeof(rating.__dict__)
+		for value in rating.__dict__.values():
+			total += sys.getsizeof(value)
+	return float(total) / len(ratings)
+
+class RatingView(Rating):
+	'''
+	A Rating whose mean and standard deviation live in a slot of an ArrayRatingStore. Setting either writes through to
+	the store. The conservative rating uses the default multiplier
+	'''
+	__slots__ = ("_store", "_slot")
+
+	def __init__(self, store, slot):
+		self._store = store
+		self._slot = slot
+
+	@property
+	def mean(self):
+		return self._store._means[self._slot]
+
+	@mean.setter
+	def mean(self, value):
+		self._store._means[self._slot] = value
+
+	@property
+	def standardDeviation(self):
+		return self._store._standardDeviations[self._slot]
+
+	@standardDeviation.setter
+	def standardDeviation(self, value):
+		self._store._standardDeviations[self._slot] = value
+
+	@property
+	def conservativeStandardDeviationMultiplier(self):
+		return _defaultConservativeStandardDeviationMultiplier
+
+	@property
+	def conservativeRating(self):
+		return self.mean - self.standardDeviation * _defaultConservativeStandardDeviationMultiplier
+
+	def getVariance(self):
+		return self.standardDeviation**2
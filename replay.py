@@ -0,0 +1,336 @@
+'''
+Rebuilds ratings by replaying a match log in order
+
+A log is read lazily, one match at a time, so memory grows with the number of players and not the length of the log.
+Two formats are read:
+
+JSON lines, one match per line: {"teams": [["alice", "bob"], ["carol"]], "ranks": [1, 2]}
+
+CSV with a header of match,team,player,rank and a row per player. The rows of a match must be next to each other,
+teams are numbered by the team column and the rank of a team is taken from its first row
+'''
+import csv
+import json
+from itertools import groupby
+from multiprocessing import Pool, cpu_count
+from objects import Player, Rating, Team, argumentNotNone
+from snapshot import writeSnapshot
+from time import time
+from trueskill_factorgraph.graphcache import FactorGraphCache
+from trueskill_factorgraph.ts_factorgraph import FactorGraphTrueSkillCalculator
+from trueskill_simple import TwoPlayerTrueSkillCalculator, TwoTeamTrueSkillCalculator
+
+class ReplayMatch(object):
+	'''One match of a log: a list of teams, each a list of player ids, and the rank of each team'''
+	__slots__ = ("_teams", "_ranks")
+
+	def __init__(self, teams, ranks):
+		assert len(teams) == len(ranks), "ranks"
+		self._teams = teams
+		self._ranks = ranks
+
+	@property
+	def teams(self):
+		return self._teams
+
+	@property
+	def ranks(self):
+		return self._ranks
+
+def readJsonLines(lines):
+	'''Generates a ReplayMatch for every non blank line of lines, an iterable of JSON strings such as an open file'''
+	for line in lines:
+		if line.strip() == "":
+			continue
+		match = json.loads(line)
+		yield ReplayMatch(match["teams"], match["ranks"])
+
+def readCsv(lines):
+	'''Generates a ReplayMatch for every match in lines, an iterable of CSV rows such as an open file'''
+	rows = csv.DictReader(lines)
+	for matchId, matchRows in groupby(rows, lambda row: row["match"]):
+		teamIds = list()
+		teams = dict()
+		ranks = dict()
+		for row in matchRows:
+			teamId = row["team"]
+			if teamId not in teams:
+				teamIds.append(teamId)
+				teams[teamId] = list()
+				ranks[teamId] = int(row["rank"])
+			teams[teamId].append(row["player"])
+		yield ReplayMatch([teams[teamId] for teamId in teamIds], [ranks[teamId] for teamId in teamIds])
+
+def readMatchLog(path):
+	'''Generates the matches of the log file at path, read as CSV if its name ends in .csv and JSON lines otherwise'''
+	if path.endswith(".csv"):
+		with open(path, "rb") as logFile:
+			for match in readCsv(logFile):
+				yield match
+	else:
+		with open(path, "r") as logFile:
+			for match in readJsonLines(logFile):
+				yield match
+
+def groupIntoConflictFreeBatches(matches, maxBatchSize):
+	'''
+	Generates lists of consecutive matches of matches in which no player plays twice. A batch ends at the first match
+	sharing a player with it, or at maxBatchSize matches. The matches of a batch can be rated in any order, or all at
+	once, with the same result as rating them in log order
+	'''
+	assert maxBatchSize > 0, "maxBatchSize"
+	batch = list()
+	batchPlayerIds = set()
+	for match in matches:
+		matchPlayerIds = [playerId for playerIds in match.teams for playerId in playerIds]
+		if len(batch) == maxBatchSize or batchPlayerIds.isdisjoint(matchPlayerIds) == False:
+			yield batch
+			batch = list()
+			batchPlayerIds = set()
+		batch.append(match)
+		batchPlayerIds.update(matchPlayerIds)
+	if len(batch) > 0:
+		yield batch
+
+class RatingStore(object):
+	'''The current Rating of every player seen so far, by player id'''
+	def __init__(self):
+		self._ratings = dict()
+
+	def get(self, playerId, defaultRating):
+		return self._ratings.get(playerId, defaultRating)
+
+	def put(self, playerId, rating):
+		self._ratings[playerId] = rating
+
+	def iterRatings(self):
+		'''Generates (player id, rating) for every player in the store'''
+		return self._ratings.iteritems()
+
+	def clear(self):
+		self._ratings.clear()
+
+	def __len__(self):
+		return len(self._ratings)
+
+	def __contains__(self, playerId):
+		return playerId in self._ratings
+
+class ReplayStatistics(object):
+	'''How many matches a replay went through, how many of them each calculator rated and how long it took'''
+	def __init__(self):
+		self._matches = 0
+		self._seconds = 0.0
+		self._checkpoints = 0
+		self._matchesByCalculator = dict()
+
+	@property
+	def matches(self):
+		return self._matches
+
+	@property
+	def seconds(self):
+		return self._seconds
+
+	@property
+	def matchesPerSecond(self):
+		return self._matches / self._seconds if self._seconds > 0 else 0.0
+
+	@property
+	def checkpoints(self):
+		return self._checkpoints
+
+	@property
+	def matchesByCalculator(self):
+		'''The number of matches rated by each calculator, by calculator class name'''
+		return self._matchesByCalculator
+
+	def _addMatch(self, calculatorName):
+		self._matches += 1
+		self._matchesByCalculator[calculatorName] = self._matchesByCalculator.get(calculatorName, 0) + 1
+
+	def __str__(self):
+		return "%i matches in %.3f s (%.0f matches/s)" % (self._matches, self._seconds, self.matchesPerSecond)
+
+class ReplayEngine(object):
+	'''
+	Rates every match of a log in order, keeping the running ratings in a store. Players not yet in the store start
+	from gameInfo.defaultRating. One on one matches go to the TwoPlayerTrueSkillCalculator, other two team matches to
+	the TwoTeamTrueSkillCalculator and everything else to a FactorGraphTrueSkillCalculator
+	'''
+	def __init__(self, gameInfo, store = None, factorGraphCalculator = None, matchCount = 0, leaderboard = None):
+		'''
+		store is the RatingStore or ratingstore.ArrayRatingStore to read and update, a new RatingStore if not given
+		factorGraphCalculator rates games of more than two teams, by default one with its own FactorGraphCache
+		matchCount is the number of matches already replayed into store, such as the matchCount of the snapshot it
+		was loaded from
+		leaderboard, if given, is a leaderboard.Leaderboard given every new rating
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		self._gameInfo = gameInfo
+		self._store = store if store is not None else RatingStore()
+		self._twoPlayerCalculator = TwoPlayerTrueSkillCalculator()
+		self._twoTeamCalculator = TwoTeamTrueSkillCalculator()
+		self._hasDefaultCalculators = factorGraphCalculator is None
+		if factorGraphCalculator is None:
+			factorGraphCalculator = FactorGraphTrueSkillCalculator(FactorGraphCache())
+		self._factorGraphCalculator = factorGraphCalculator
+		self._statistics = ReplayStatistics()
+		self._matchCount = matchCount
+		self._leaderboard = leaderboard
+
+	@property
+	def gameInfo(self):
+		return self._gameInfo
+
+	@property
+	def store(self):
+		return self._store
+
+	@property
+	def leaderboard(self):
+		return self._leaderboard
+
+	@property
+	def matchCount(self):
+		'''The number of matches replayed into the store, counting those replayed before this engine was made'''
+		return self._matchCount
+
+	@property
+	def statistics(self):
+		'''The totals of every replay and replayMatch call so far'''
+		return self._statistics
+
+	def replay(self, matches, checkpointPath = None, checkpointEvery = None):
+		'''
+		Rates every ReplayMatch of matches, any iterable such as readMatchLog, and returns the statistics
+		With a checkpointPath, a snapshot of the store is written there every checkpointEvery matches and at the end,
+		recording the total number of matches replayed so far (see the snapshot module for restarting from one)
+		'''
+		assert checkpointPath is None or checkpointEvery > 0, "checkpointEvery"
+		start = time()
+		try:
+			sinceCheckpoint = 0
+			for match in matches:
+				self._replayMatch(match)
+				if checkpointPath is not None:
+					sinceCheckpoint += 1
+					if sinceCheckpoint == checkpointEvery:
+						self._writeCheckpoint(checkpointPath)
+						sinceCheckpoint = 0
+			if checkpointPath is not None and sinceCheckpoint > 0:
+				self._writeCheckpoint(checkpointPath)
+		finally:
+			self._statistics._seconds += time() - start
+		return self._statistics
+
+	def replayParallel(self, matches, processes = None, maxBatchSize = 4096, checkpointPath = None, checkpointEvery = None):
+		'''
+		Rates every ReplayMatch of matches like replay, spreading each batch of groupIntoConflictFreeBatches over a
+		pool of processes. The store ends up with exactly the ratings replay would give, and checkpoints are written
+		after the first batch that reaches every checkpointEvery matches
+
+		Each process rates with its own default calculators, so this engine must have been made without a
+		factorGraphCalculator. processes defaults to the number of CPUs
+		'''
+		assert self._hasDefaultCalculators, "factorGraphCalculator"
+		assert checkpointPath is None or checkpointEvery > 0, "checkpointEvery"
+		start = time()
+		if processes is None:
+			processes = cpu_count()
+		pool = Pool(processes, _initializeReplayWorker, (self._gameInfo,))
+		try:
+			sinceCheckpoint = 0
+			for batch in groupIntoConflictFreeBatches(matches, maxBatchSize):
+				work = [(match.teams, match.ranks, self._getStoredRatings(match)) for match in batch]
+				chunkSize = max(1, len(work) // (4 * processes))
+				for calculatorName, newRatings in pool.map(_replayMatchInWorker, work, chunkSize):
+					for playerId, mean, standardDeviation in newRatings:
+						rating = Rating(mean, standardDeviation)
+						self._store.put(playerId, rating)
+						if self._leaderboard is not None:
+							self._leaderboard.update(playerId, rating)
+					self._statistics._addMatch(calculatorName)
+					self._matchCount += 1
+				if checkpointPath is not None:
+					sinceCheckpoint += len(batch)
+					if sinceCheckpoint >= checkpointEvery:
+						self._writeCheckpoint(checkpointPath)
+						sinceCheckpoint = 0
+			if checkpointPath is not None and sinceCheckpoint > 0:
+				self._writeCheckpoint(checkpointPath)
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+			self._statistics._seconds += time() - start
+		return self._statistics
+
+	def replayMatch(self, match):
+		'''Rates one ReplayMatch, updates the store and returns the list of (player, rating) from the calculator'''
+		start = time()
+		try:
+			return self._replayMatch(match)
+		finally:
+			self._statistics._seconds += time() - start
+
+	def _writeCheckpoint(self, path):
+		writeSnapshot(path, self._gameInfo, self._store, self._matchCount)
+		self._statistics._checkpoints += 1
+
+	def _getStoredRatings(self, match):
+		'''(player id, mean, standard deviation) of every player of match that is in the store'''
+		storedRatings = list()
+		for playerIds in match.teams:
+			for playerId in playerIds:
+				rating = self._store.get(playerId, None)
+				if rating is not None:
+					storedRatings.append((playerId, rating.mean, rating.standardDeviation))
+		return storedRatings
+
+	def getCalculator(self, match):
+		if len(match.teams) == 2:
+			if len(match.teams[0]) == 1 and len(match.teams[1]) == 1:
+				return self._twoPlayerCalculator
+			return self._twoTeamCalculator
+		return self._factorGraphCalculator
+
+	def _replayMatch(self, match):
+		store = self._store
+		defaultRating = self._gameInfo.defaultRating
+		teams = list()
+		for playerIds in match.teams:
+			team = Team()
+			for playerId in playerIds:
+				team.addPlayer(Player(playerId), store.get(playerId, defaultRating))
+			teams.append(team)
+		calculator = self.getCalculator(match)
+		newRatings = calculator.calculateNewRatings(self._gameInfo, teams, match.ranks)
+		for player, rating in newRatings:
+			store.put(player.id, rating)
+		if self._leaderboard is not None:
+			self._leaderboard.recordRatings(newRatings)
+		self._statistics._addMatch(calculator.__class__.__name__)
+		self._matchCount += 1
+		return newRatings
+
+# the ReplayEngine of a replayParallel worker process, rating one match at a time into a store holding only the
+# ratings sent with that match
+_workerEngine = None
+
+def _initializeReplayWorker(gameInfo):
+	global _workerEngine
+	_workerEngine = ReplayEngine(gameInfo)
+
+def _replayMatchInWorker(work):
+	teams, ranks, storedRatings = work
+	match = ReplayMatch(teams, ranks)
+	store = _workerEngine.store
+	store.clear()
+	for playerId, mean, standardDeviation in storedRatings:
+		store.put(playerId, Rating(mean, standardDeviation))
+	calculator = _workerEngine.getCalculator(match)
+	newRatings = _workerEngine._replayMatch(match)
+	return (calculator.__class__.__name__, [(player.id, rating.mean, rating.standardDeviation) for player, rating in newRatings])
@@ -0,0 +1,519 @@
+'''
+A rating service that batches the match results submitted from many threads
+
+There is no asyncio in Python 2, so the service is built on threads. submit returns a RatingFuture at once and a
+dispatcher thread collects the requests that arrive within batchWindowSeconds of the first one waiting (or until
+maxBatchSize of them are waiting), groups them by calculator and team shape and rates each group in one call:
+
+	one on one games go to TwoPlayerTrueSkillCalculator.calculateNewRatingsBatch
+	other two team games go to TwoTeamTrueSkillCalculator.calculateNewRatingsBatch
+	games of more than two teams go to a FactorGraphTrueSkillCalculator one at a time, sharing its FactorGraphCache
+
+Each future then resolves to what calculateNewRatings would have returned, a list of (player, rating). At most
+maxPending requests are in the service at once: past that submit waits for room, or raises RatingServiceBusy if it was
+told not to block. The time from submit to the start of the batch and to the resolved future are kept in
+LatencyHistograms
+
+RatingServiceServer serves a RatingService on a unix socket, one JSON line per request and per reply, and
+RatingServiceClient talks to it
+'''
+from collections import deque
+from fastnumerics import NumericsMode
+from math import log
+from objects import Player, Rating, Team, argumentNotNone, sortByRank
+from time import time
+from trueskill_simple import TwoPlayerTrueSkillCalculator, TwoTeamTrueSkillCalculator
+import json
+import logging
+import socket
+import SocketServer
+import threading
+
+_TWO_PLAYER = 0
+_TWO_TEAM = 1
+_FACTOR_GRAPH = 2
+
+_logger = logging.getLogger(__name__)
+
+class RatingServiceBusy(Exception):
+	'''Raised by a non blocking submit when the service already holds maxPending requests'''
+	pass
+
+class RatingFuture(object):
+	'''The result of a submitted match, set once by the service'''
+	def __init__(self):
+		self._event = threading.Event()
+		self._lock = threading.Lock()
+		self._result = None
+		self._exception = None
+		self._callbacks = list()
+
+	def done(self):
+		return self._event.is_set()
+
+	def result(self, timeout = None):
+		'''
+		Waits for the new ratings, a list of (player, rating), and returns them. Raises the error the match was rated
+		with, or RuntimeError if timeout seconds pass first
+		'''
+		if self._event.wait(timeout) == False:
+			raise RuntimeError("The match was not rated within %s seconds" % timeout)
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	def exception(self, timeout = None):
+		'''Waits like result, and returns the error the match was rated with, or None'''
+		if self._event.wait(timeout) == False:
+			raise RuntimeError("The match was not rated within %s seconds" % timeout)
+		return self._exception
+
+	def addDoneCallback(self, callback):
+		'''
+		Calls callback with this future once it is done, straight away if it already is. An exception raised by the
+		callback is logged and otherwise ignored
+		'''
+		with self._lock:
+			if self._event.is_set() == False:
+				self._callbacks.append(callback)
+				return
+		self._runCallback(callback)
+
+	def _setResult(self, result):
+		self._finish(result, None)
+
+	def _setException(self, exception):
+		self._finish(None, exception)
+
+	def _finish(self, result, exception):
+		with self._lock:
+			self._result = result
+			self._exception = exception
+			self._event.set()
+			callbacks = self._callbacks
+			self._callbacks = list()
+		for callback in callbacks:
+			self._runCallback(callback)
+
+	def _runCallback(self, callback):
+		# callbacks run on the dispatcher thread, which must carry on rating whatever they do
+		try:
+			callback(self)
+		except Exception:
+			_logger.exception("A RatingFuture done callback raised")
+
+class LatencyHistogram(object):
+	'''
+	Counts of latencies in buckets growing by a factor of 2^(1/4), from 1 microsecond up, so a percentile is read
+	back to within 19% however long the latencies are
+	'''
+	_smallest = 1e-6
+	_bucketsPerDoubling = 4
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._counts = list()
+		self._count = 0
+		self._total = 0.0
+		self._max = 0.0
+
+	def record(self, seconds):
+		if seconds <= self._smallest:
+			bucket = 0
+		else:
+			bucket = int(log(seconds / self._smallest, 2) * self._bucketsPerDoubling) + 1
+		with self._lock:
+			if bucket >= len(self._counts):
+				self._counts.extend([0] * (bucket + 1 - len(self._counts)))
+			self._counts[bucket] += 1
+			self._count += 1
+			self._total += seconds
+			self._max = max(self._max, seconds)
+
+	@property
+	def count(self):
+		return self._count
+
+	@property
+	def mean(self):
+		return self._total / self._count if self._count > 0 else 0.0
+
+	@property
+	def max(self):
+		return self._max
+
+	@property
+	def buckets(self):
+		'''(upper bound in seconds, count) of every bucket holding a latency, shortest first'''
+		return [(self._getUpperBound(bucket), count) for bucket, count in enumerate(self._counts) if count > 0]
+
+	def percentile(self, percent):
+		'''The upper bound of the bucket holding the given percentile, 0 if nothing was recorded'''
+		assert 0 <= percent <= 100, "percent"
+		with self._lock:
+			if self._count == 0:
+				return 0.0
+			rank = max(1, int(round(self._count * percent / 100.0)))
+			seen = 0
+			for bucket, count in enumerate(self._counts):
+				seen += count
+				if seen >= rank:
+					return min(self._getUpperBound(bucket), self._max)
+
+	def _getUpperBound(self, bucket):
+		return self._smallest * 2.0**(bucket / float(self._bucketsPerDoubling))
+
+	def __str__(self):
+		return "%i requests, mean %.3f ms, p50 %.3f ms, p99 %.3f ms, max %.3f ms" % (self._count, self.mean * 1e3,
+			self.percentile(50) * 1e3, self.percentile(99) * 1e3, self._max * 1e3)
+
+class RatingServiceStatistics(object):
+	'''How many requests and batches a RatingService went through, and how long its requests took'''
+	def __init__(self):
+		self._requests = 0
+		self._batches = 0
+		self._queueLatency = LatencyHistogram()
+		self._latency = LatencyHistogram()
+
+	@property
+	def requests(self):
+		'''The number of requests rated so far, including those that failed'''
+		return self._requests
+
+	@property
+	def batches(self):
+		'''The number of calculator calls the requests were rated in'''
+		return self._batches
+
+	@property
+	def meanBatchSize(self):
+		return self._requests / float(self._batches) if self._batches > 0 else 0.0
+
+	@property
+	def queueLatency(self):
+		'''A LatencyHistogram of the time from submit to the start of the batch rating the request'''
+		return self._queueLatency
+
+	@property
+	def latency(self):
+		'''A LatencyHistogram of the time from submit to the resolved future'''
+		return self._latency
+
+class _Request(object):
+	__slots__ = ("teams", "teamRanks", "future", "submittedAt")
+
+	def __init__(self, teams, teamRanks, future, submittedAt):
+		self.teams = teams
+		self.teamRanks = teamRanks
+		self.future = future
+		self.submittedAt = submittedAt
+
+class RatingService(object):
+	'''
+	Rates matches submitted from any thread in batches, on a dispatcher thread of its own. Start it before
+	submitting, or use it in a with statement, which starts it and stops it once every request is rated
+	'''
+	def __init__(self, gameInfo, batchWindowSeconds = 0.002, maxBatchSize = 1024, maxPending = 10000,
+			numerics = NumericsMode.EXACT, factorGraphCalculator = None):
+		'''
+		batchWindowSeconds is how long the first request of a batch waits for more to join it
+		maxBatchSize is the most requests taken into one batch, maxPending the most requests held at once
+		numerics is the NumericsMode of the two player and two team calculators
+		factorGraphCalculator rates games of more than two teams, by default one with its own FactorGraphCache, made
+		(and the factor graph engine imported) when the first such game is submitted
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		assert batchWindowSeconds >= 0, "batchWindowSeconds"
+		assert maxBatchSize > 0, "maxBatchSize"
+		assert maxPending > 0, "maxPending"
+		self._gameInfo = gameInfo
+		self._batchWindowSeconds = batchWindowSeconds
+		self._maxBatchSize = maxBatchSize
+		self._maxPending = maxPending
+		self._twoPlayerCalculator = TwoPlayerTrueSkillCalculator(numerics)
+		self._twoTeamCalculator = TwoTeamTrueSkillCalculator(numerics)
+		self._factorGraphCalculator = factorGraphCalculator
+		self._factorGraphCalculatorLock = threading.Lock()
+		self._statistics = RatingServiceStatistics()
+		self._condition = threading.Condition()
+		self._queue = deque()
+		# requests submitted and not yet resolved, the queued ones and those of the batch being rated
+		self._pending = 0
+		self._running = False
+		self._dispatcher = None
+
+	@property
+	def gameInfo(self):
+		return self._gameInfo
+
+	@property
+	def statistics(self):
+		return self._statistics
+
+	@property
+	def pending(self):
+		'''The number of requests submitted and not yet rated'''
+		return self._pending
+
+	@property
+	def running(self):
+		return self._running
+
+	def start(self):
+		with self._condition:
+			assert self._running == False, "running"
+			self._running = True
+			self._dispatcher = threading.Thread(target = self._dispatch, name = "RatingService dispatcher")
+			self._dispatcher.daemon = True
+			self._dispatcher.start()
+
+	def stop(self):
+		'''Stops taking requests, and returns once every request already submitted is rated'''
+		with self._condition:
+			if self._running == False:
+				return
+			self._running = False
+			self._condition.notify_all()
+		self._dispatcher.join()
+		self._dispatcher = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		self.stop()
+
+	def submit(self, teams, teamRanks, block = True, timeout = None):
+		'''
+		Queues a match, given like to calculateNewRatings, and returns the RatingFuture of its new ratings
+		When maxPending requests are already held, waits up to timeout seconds (forever if None) for room, or raises
+		RatingServiceBusy straight away if block is False or once the timeout passes
+		'''
+		argumentNotNone(teams, "teams")
+		argumentNotNone(teamRanks, "teamRanks")
+		future = RatingFuture()
+		with self._condition:
+			if self._running == False:
+				raise RuntimeError("The rating service is not running")
+			if self._pending >= self._maxPending:
+				if block == False:
+					raise RatingServiceBusy("%i requests are already pending" % self._pending)
+				deadline = None if timeout is None else time() + timeout
+				while self._pending >= self._maxPending and self._running:
+					remaining = None if deadline is None else deadline - time()
+					if remaining is not None and remaining <= 0:
+						raise RatingServiceBusy("%i requests are still pending after %s seconds" % (self._pending, timeout))
+					self._condition.wait(remaining)
+				if self._running == False:
+					raise RuntimeError("The rating service was stopped")
+			self._pending += 1
+			self._queue.append(_Request(teams, teamRanks, future, time()))
+			self._condition.notify_all()
+		return future
+
+	def rate(self, teams, teamRanks, timeout = None):
+		'''Submits a match and waits for its new ratings, a list of (player, rating)'''
+		return self.submit(teams, teamRanks).result(timeout)
+
+	def _dispatch(self):
+		while True:
+			with self._condition:
+				while len(self._queue) == 0 and self._running:
+					self._condition.wait()
+				if len(self._queue) == 0:
+					return
+				# the first request waits out the window, unless a full batch is ready sooner or the service stops
+				deadline = self._queue[0].submittedAt + self._batchWindowSeconds
+				while len(self._queue) < self._maxBatchSize and self._running:
+					remaining = deadline - time()
+					if remaining <= 0:
+						break
+					self._condition.wait(remaining)
+				batch = [self._queue.popleft() for i in range(min(self._maxBatchSize, len(self._queue)))]
+			try:
+				self._rateBatch(batch)
+			finally:
+				with self._condition:
+					self._pending -= len(batch)
+					self._condition.notify_all()
+
+	def _rateBatch(self, batch):
+		start = time()
+		groups = dict()
+		# (request, new ratings, exception) of every request of the batch, only resolved once all of it is rated, so
+		# that no done callback runs, or fails, in the middle of rating a group
+		outcomes = list()
+		for request in batch:
+			self._statistics._queueLatency.record(start - request.submittedAt)
+			try:
+				key = self._getGroupKey(request)
+			except Exception as exception:
+				outcomes.append((request, None, exception))
+				continue
+			groups.setdefault(key, list()).append(request)
+		for key, requests in groups.iteritems():
+			try:
+				if key[0] == _TWO_PLAYER:
+					outcomes.extend(self._rateTwoPlayerGroup(requests))
+				elif key[0] == _TWO_TEAM:
+					outcomes.extend(self._rateTwoTeamGroup(requests))
+				else:
+					outcomes.extend(self._rateFactorGraphGroup(requests))
+			except Exception as exception:
+				outcomes.extend((request, None, exception) for request in requests)
+		for request, newRatings, exception in outcomes:
+			self._resolve(request, newRatings, exception)
+
+	def _getGroupKey(self, request):
+		'''Validates the teams of a request and returns its (calculator, team sizes in rank order)'''
+		teams = request.teams
+		if len(request.teamRanks) != len(teams):
+			raise ValueError("There must be a rank for every team")
+		if len(teams) == 2:
+			if teams[0].size == 1 and teams[1].size == 1:
+				self._twoPlayerCalculator._validateTeamCountAndPlayersCountPerTeam(teams)
+				return (_TWO_PLAYER,)
+			self._twoTeamCalculator._validateTeamCountAndPlayersCountPerTeam(teams)
+			sortedTeams, sortedRanks = sortByRank(teams, request.teamRanks)
+			return (_TWO_TEAM, sortedTeams[0].size, sortedTeams[1].size)
+		self._getFactorGraphCalculator()._validateTeamCountAndPlayersCountPerTeam(teams)
+		return (_FACTOR_GRAPH, tuple(team.size for team in teams))
+
+	def _rateTwoPlayerGroup(self, requests):
+		winners = list()
+		losers = list()
+		wasDraw = list()
+		for request in requests:
+			teams, teamRanks = sortByRank(request.teams, request.teamRanks)
+			winners.append(teams[0].asListOfTuples[0])
+			losers.append(teams[1].asListOfTuples[0])
+			wasDraw.append(teamRanks[0] == teamRanks[1])
+		newWinnerMeans, newWinnerStandardDeviations, newLoserMeans, newLoserStandardDeviations = \
+			self._twoPlayerCalculator.calculateNewRatingsBatch(self._gameInfo,
+				[rating.mean for player, rating in winners], [rating.standardDeviation for player, rating in winners],
+				[rating.mean for player, rating in losers], [rating.standardDeviation for player, rating in losers], wasDraw)
+		self._statistics._batches += 1
+		return [(requests[i], [(winners[i][0], Rating(newWinnerMeans[i], newWinnerStandardDeviations[i])),
+			(losers[i][0], Rating(newLoserMeans[i], newLoserStandardDeviations[i]))], None) for i in range(len(requests))]
+
+	def _rateTwoTeamGroup(self, requests):
+		players = list()
+		means = list()
+		standardDeviations = list()
+		teamOffsets = [0]
+		wasDraw = list()
+		for request in requests:
+			teams, teamRanks = sortByRank(request.teams, request.teamRanks)
+			for team in teams:
+				for player, rating in team.asListOfTuples:
+					players.append(player)
+					means.append(rating.mean)
+					standardDeviations.append(rating.standardDeviation)
+				teamOffsets.append(len(players))
+			wasDraw.append(teamRanks[0] == teamRanks[1])
+		newMeans, newStandardDeviations = self._twoTeamCalculator.calculateNewRatingsBatch(self._gameInfo, means,
+			standardDeviations, teamOffsets, wasDraw)
+		self._statistics._batches += 1
+		outcomes = list()
+		for i in range(len(requests)):
+			start = teamOffsets[2 * i]
+			end = teamOffsets[2 * i + 2]
+			outcomes.append((requests[i], [(players[k], Rating(newMeans[k], newStandardDeviations[k])) for k in range(start, end)], None))
+		return outcomes
+
+	def _getFactorGraphCalculator(self):
+		with self._factorGraphCalculatorLock:
+			if self._factorGraphCalculator is None:
+				from trueskill_factorgraph.graphcache import FactorGraphCache
+				from trueskill_factorgraph.ts_factorgraph import FactorGraphTrueSkillCalculator
+				self._factorGraphCalculator = FactorGraphTrueSkillCalculator(FactorGraphCache())
+			return self._factorGraphCalculator
+
+	def _rateFactorGraphGroup(self, requests):
+		outcomes = list()
+		for request in requests:
+			self._statistics._batches += 1
+			try:
+				newRatings = self._getFactorGraphCalculator().calculateNewRatings(self._gameInfo, request.teams, request.teamRanks)
+			except Exception as exception:
+				outcomes.append((request, None, exception))
+				continue
+			outcomes.append((request, newRatings, None))
+		return outcomes
+
+	def _resolve(self, request, newRatings, exception):
+		self._statistics._requests += 1
+		self._statistics._latency.record(time() - request.submittedAt)
+		if exception is not None:
+			request.future._setException(exception)
+		else:
+			request.future._setResult(newRatings)
+
+class _RatingRequestHandler(SocketServer.StreamRequestHandler):
+	'''
+	Reads requests, one JSON object per line:
+
+		{"teams": [[[player id, mean, standard deviation], ...], ...], "ranks": [1, 2, ...]}
+
+	and writes a line back for each, {"ratings": [[player id, mean, standard deviation], ...]} or {"error": message}
+	'''
+	def handle(self):
+		for line in iter(self.rfile.readline, b""):
+			if line.strip() == "":
+				continue
+			try:
+				request = json.loads(line)
+				teams = list()
+				for players in request["teams"]:
+					team = Team()
+					for playerId, mean, standardDeviation in players:
+						team.addPlayer(Player(playerId), Rating(mean, standardDeviation))
+					teams.append(team)
+				newRatings = self.server.service.rate(teams, request["ranks"])
+				reply = {"ratings": [[player.id, rating.mean, rating.standardDeviation] for player, rating in newRatings]}
+			except Exception as exception:
+				reply = {"error": "%s: %s" % (exception.__class__.__name__, exception)}
+			self.wfile.write(json.dumps(reply) + "\n")
+			self.wfile.flush()
+
+class RatingServiceServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	'''
+	Serves a running RatingService on the unix socket at path, a thread per connection, so the requests of
+	concurrent clients are batched together. Run it with serve_forever and end it with shutdown and server_close
+	'''
+	daemon_threads = True
+
+	def __init__(self, service, path):
+		argumentNotNone(service, "service")
+		self.service = service
+		SocketServer.UnixStreamServer.__init__(self, path, _RatingRequestHandler)
+
+class RatingServiceClient(object):
+	'''A connection to a RatingServiceServer. Not thread safe: give each thread its own'''
+	def __init__(self, path, timeout = None):
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._socket.settimeout(timeout)
+		self._socket.connect(path)
+		self._file = self._socket.makefile("rwb")
+
+	def rate(self, teams, teamRanks):
+		'''Rates a match, given like to calculateNewRatings, and returns its list of (player, rating)'''
+		request = {"teams": [[[player.id, rating.mean, rating.standardDeviation] for player, rating in team.asListOfTuples] for team in teams],
+			"ranks": teamRanks}
+		self._file.write(json.dumps(request) + "\n")
+		self._file.flush()
+		reply = json.loads(self._file.readline())
+		if "error" in reply:
+			raise RuntimeError(reply["error"])
+		return [(Player(playerId), Rating(mean, standardDeviation)) for playerId, mean, standardDeviation in reply["ratings"]]
+
+	def close(self):
+		self._file.close()
+		self._socket.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		self.close()
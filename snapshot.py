@@ -0,0 +1,218 @@
+'''
+Binary snapshots of a whole rating table, written atomically and read through mmap
+
+A snapshot file is, all little endian:
+
+a header: the magic string PSKSNAP1, the format version, the GameInfo parameters (initial mean, initial standard
+deviation, beta, dynamics factor and draw probability), the number of players and the number of matches replayed
+when it was written
+
+a record of two doubles, mean and standard deviation, for every player, in slot order
+
+an id index: for every player, in order of the bytes of its id and then of their kind, the offset and length of the
+id in the id table, the player's slot and the kind of id it is (str, unicode or integer)
+
+the id table: the bytes of every id, the UTF-8 of a unicode id and the decimal digits of an integer one
+
+RatingSnapshot reads ratings straight from the mapped pages, so opening one costs nothing however many players it
+holds, a lookup by id is a binary search of the index, and every process opening the same file shares its pages. Ids
+must be strings or integers and are read back as the same kind of value, except that an ASCII unicode id comes back as
+the str it is equal to
+
+To restart a replay from a checkpoint:
+
+	snapshot = RatingSnapshot(path)
+	engine = ReplayEngine(snapshot.gameInfo, snapshot.toArrayRatingStore(), matchCount = snapshot.matchCount)
+	engine.replay(islice(readMatchLog(logPath), snapshot.matchCount, None), path, checkpointEvery)
+'''
+from array import array
+from objects import GameInfo, Rating
+from ratingstore import ArrayRatingStore
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+_magic = b"PSKSNAP1"
+_version = 2
+_header = struct.Struct("<8sI4xdddddQQ")
+_record = struct.Struct("<dd")
+_indexEntry = struct.Struct("<QIIB3x")
+
+# the kinds of id in the index
+_STR_ID = 0
+_UNICODE_ID = 1
+_INTEGER_ID = 2
+
+def _encodeId(playerId):
+	'''The (bytes, kind) a player id is indexed by'''
+	if isinstance(playerId, unicode):
+		try:
+			# an ASCII unicode id is equal to, and hashes like, the str of the same characters
+			return (playerId.encode("ascii"), _STR_ID)
+		except UnicodeEncodeError:
+			return (playerId.encode("utf-8"), _UNICODE_ID)
+	if isinstance(playerId, str):
+		return (playerId, _STR_ID)
+	if isinstance(playerId, (int, long)):
+		return ("%d" % playerId, _INTEGER_ID)
+	raise TypeError("A player id in a snapshot must be a string or an integer, not %r" % (playerId,))
+
+def _decodeId(encodedId, kind):
+	if kind == _UNICODE_ID:
+		return encodedId.decode("utf-8")
+	if kind == _INTEGER_ID:
+		return int(encodedId)
+	return encodedId
+
+def _getRatings(store):
+	'''(ids, means, standardDeviations) of an ArrayRatingStore, or of any store with an iterRatings method'''
+	if isinstance(store, ArrayRatingStore):
+		return (store.playerIds, store._means, store._standardDeviations)
+	playerIds = list()
+	means = array('d')
+	standardDeviations = array('d')
+	for playerId, rating in store.iterRatings():
+		playerIds.append(playerId)
+		means.append(rating.mean)
+		standardDeviations.append(rating.standardDeviation)
+	return (playerIds, means, standardDeviations)
+
+def writeSnapshot(path, gameInfo, store, matchCount = 0):
+	'''
+	Writes every rating of store, an ArrayRatingStore or a replay.RatingStore, to a snapshot at path. Raises a
+	TypeError, before anything is written, if a player id is neither a string nor an integer
+	The snapshot is written to a temporary file in the same directory, flushed to disk and renamed over path, so a
+	reader or a crash only ever sees the old snapshot or the whole new one
+	'''
+	playerIds, means, standardDeviations = _getRatings(store)
+	encodedIds = [_encodeId(playerId) for playerId in playerIds]
+	playerCount = len(encodedIds)
+
+	records = array('d', [0.0]) * (2 * playerCount)
+	records[0::2] = means
+	records[1::2] = standardDeviations
+	if sys.byteorder != "little":
+		records.byteswap()
+
+	index = list()
+	idTable = list()
+	idOffset = 0
+	for slot in sorted(range(playerCount), key = lambda slot: encodedIds[slot]):
+		encodedId, kind = encodedIds[slot]
+		index.append(_indexEntry.pack(idOffset, len(encodedId), slot, kind))
+		idTable.append(encodedId)
+		idOffset += len(encodedId)
+
+	directory = os.path.dirname(os.path.abspath(path))
+	handle, temporaryPath = tempfile.mkstemp(prefix = os.path.basename(path) + ".", suffix = ".tmp", dir = directory)
+	try:
+		with os.fdopen(handle, "wb") as snapshotFile:
+			snapshotFile.write(_header.pack(_magic, _version, gameInfo.initialMean, gameInfo.initialStandardDeviation,
+				gameInfo.beta, gameInfo.dynamicsFactor, gameInfo.drawProbability, playerCount, matchCount))
+			records.tofile(snapshotFile)
+			snapshotFile.write(b"".join(index))
+			snapshotFile.write(b"".join(idTable))
+			snapshotFile.flush()
+			os.fsync(snapshotFile.fileno())
+		os.rename(temporaryPath, path)
+	except:
+		if os.path.exists(temporaryPath):
+			os.remove(temporaryPath)
+		raise
+	if hasattr(os, "O_DIRECTORY"):
+		directoryHandle = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+		try:
+			os.fsync(directoryHandle)
+		finally:
+			os.close(directoryHandle)
+
+class RatingSnapshot(object):
+	'''A read only view of a snapshot file, mapped into memory. Close it, or use it in a with statement, when done'''
+	def __init__(self, path):
+		with open(path, "rb") as snapshotFile:
+			self._map = mmap.mmap(snapshotFile.fileno(), 0, access = mmap.ACCESS_READ)
+		if len(self._map) < _header.size:
+			self.close()
+			raise ValueError("%s is not a rating snapshot" % path)
+		magic, version, initialMean, initialStandardDeviation, beta, dynamicsFactor, drawProbability, \
+			self._playerCount, self._matchCount = _header.unpack_from(self._map, 0)
+		if magic != _magic or version != _version:
+			self.close()
+			raise ValueError("%s is not a version %i rating snapshot" % (path, _version))
+		self._gameInfo = GameInfo(initialMean, initialStandardDeviation, beta, dynamicsFactor, drawProbability)
+		self._recordsOffset = _header.size
+		self._indexOffset = self._recordsOffset + self._playerCount * _record.size
+		self._idTableOffset = self._indexOffset + self._playerCount * _indexEntry.size
+
+	@property
+	def gameInfo(self):
+		return self._gameInfo
+
+	@property
+	def matchCount(self):
+		'''The number of matches replayed into the ratings when the snapshot was written'''
+		return self._matchCount
+
+	def __len__(self):
+		return self._playerCount
+
+	def __contains__(self, playerId):
+		return self.getSlot(playerId) is not None
+
+	def getSlot(self, playerId):
+		'''The slot of playerId, or None if it is not in the snapshot'''
+		try:
+			key = _encodeId(playerId)
+		except TypeError:
+			return None
+		low = 0
+		high = self._playerCount
+		while low < high:
+			middle = (low + high) // 2
+			idOffset, idLength, slot, kind = _indexEntry.unpack_from(self._map, self._indexOffset + middle * _indexEntry.size)
+			start = self._idTableOffset + idOffset
+			currentKey = (self._map[start:start + idLength], kind)
+			if currentKey < key:
+				low = middle + 1
+			elif currentKey > key:
+				high = middle
+			else:
+				return slot
+		return None
+
+	def getRatingAt(self, slot):
+		mean, standardDeviation = _record.unpack_from(self._map, self._recordsOffset + slot * _record.size)
+		return Rating(mean, standardDeviation)
+
+	def get(self, playerId, defaultRating):
+		'''The Rating of playerId, or defaultRating if the player is not in the snapshot'''
+		slot = self.getSlot(playerId)
+		if slot is None:
+			return defaultRating
+		return self.getRatingAt(slot)
+
+	def toArrayRatingStore(self):
+		'''An ArrayRatingStore holding every rating of the snapshot, with the same slots, to carry on replaying into'''
+		records = array('d')
+		records.fromstring(self._map[self._recordsOffset:self._indexOffset])
+		if sys.byteorder != "little":
+			records.byteswap()
+		playerIds = [None] * self._playerCount
+		for position in range(self._playerCount):
+			idOffset, idLength, slot, kind = _indexEntry.unpack_from(self._map, self._indexOffset + position * _indexEntry.size)
+			start = self._idTableOffset + idOffset
+			playerIds[slot] = _decodeId(self._map[start:start + idLength], kind)
+		store = ArrayRatingStore()
+		store.putMany(playerIds, records[0::2], records[1::2])
+		return store
+
+	def close(self):
+		self._map.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		self.close()
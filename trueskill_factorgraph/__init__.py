@@ -1,13 +1,31 @@
-import os
+'''
+The factor graph TrueSkill calculator, for any number of teams of any size, and the graph machinery behind it
+
+Importing the package loads none of its modules, so code that only uses trueskill_simple never pays for this one.
+A module is loaded when it is imported, such as trueskill_factorgraph.ts_factorgraph for
+FactorGraphTrueSkillCalculator, or the first time it is read as an attribute of the package
+'''
+from __future__ import absolute_import
 import sys
+import types
+
+class _LazyPackage(types.ModuleType):
+	'''The package module, importing a module of the package the first time it is read as an attribute'''
+	_submodules = frozenset(("convergence", "factors", "flatgraph", "graphcache", "layers", "matchquality",
+		"ts_factorgraph"))
 
-PATH = os.path.realpath(__file__)
-INCLUDE_PATH = os.path.dirname(PATH) + "/../"
-INCLUDE_PATH = os.path.abspath(INCLUDE_PATH)
+	def __getattr__(self, name):
+		# only called for attributes not set yet; importing a module sets it on the package
+		if name not in self._submodules:
+			raise AttributeError("'module' object has no attribute '%s'" % name)
+		__import__(self.__name__ + "." + name)
+		return sys.modules[self.__name__ + "." + name]
 
-sys.path.append(PATH)
-sys.path.append(INCLUDE_PATH)
+	def __dir__(self):
+		return sorted(set(self.__dict__) | self._submodules)
 
-import factors
-import layers
-import ts_factorgraph
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# Python 2 clears the globals of a module once it is freed, so the module this file ran in is kept alive
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
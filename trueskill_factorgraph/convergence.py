@@ -0,0 +1,103 @@
+class ShapeConvergenceStatistics(object):
+	'''Running totals of the ScheduleRunReports of every game of one shape'''
+	def __init__(self, shape):
+		self._shape = shape
+		self._calls = 0
+		self._iterations = 0
+		self._maxIterations = 0
+		self._nonConverged = 0
+		self._seconds = 0.0
+		self._maxSeconds = 0.0
+		
+	@property
+	def shape(self):
+		return self._shape
+		
+	@property
+	def calls(self):
+		return self._calls
+		
+	@property
+	def iterations(self):
+		return self._iterations
+		
+	@property
+	def maxIterations(self):
+		return self._maxIterations
+		
+	@property
+	def meanIterations(self):
+		return float(self._iterations) / self._calls if self._calls > 0 else 0.0
+		
+	@property
+	def nonConverged(self):
+		return self._nonConverged
+		
+	@property
+	def seconds(self):
+		return self._seconds
+		
+	@property
+	def maxSeconds(self):
+		return self._maxSeconds
+		
+	@property
+	def meanSeconds(self):
+		return self._seconds / self._calls if self._calls > 0 else 0.0
+		
+	def addReport(self, report):
+		iterations = report.iterations
+		self._calls += 1
+		self._iterations += iterations
+		self._maxIterations = max(self._maxIterations, iterations)
+		if report.converged == False:
+			self._nonConverged += 1
+		self._seconds += report.seconds
+		self._maxSeconds = max(self._maxSeconds, report.seconds)
+		
+	def __str__(self):
+		return "%s: %i calls, %.2f mean / %i max iterations, %i not converged, %.1f mean / %.1f max us" % (
+			self._shape, self._calls, self.meanIterations, self._maxIterations, self._nonConverged,
+			self.meanSeconds * 1e6, self._maxSeconds * 1e6)
+		
+class ConvergenceStatistics(object):
+	'''
+	Aggregates ScheduleRunReports by the shape of the game they came from: the team sizes and which neighbouring
+	teams drew. Given to a FactorGraphTrueSkillCalculator, it shows which shapes take the most iterations and time
+	'''
+	def __init__(self):
+		self._shapes = dict()
+		
+	@property
+	def calls(self):
+		return sum(statistics.calls for statistics in self._shapes.values())
+		
+	@property
+	def nonConverged(self):
+		return sum(statistics.nonConverged for statistics in self._shapes.values())
+		
+	@property
+	def shapes(self):
+		'''The ShapeConvergenceStatistics of every shape seen, slowest in total first'''
+		return sorted(self._shapes.values(), key = lambda statistics: statistics.seconds, reverse = True)
+		
+	def getShapeStatistics(self, teams, teamRanks):
+		'''The ShapeConvergenceStatistics for the shape of teams, which must already be sorted by rank, or None'''
+		return self._shapes.get(getShape(teams, teamRanks))
+		
+	def addReport(self, teams, teamRanks, report):
+		shape = getShape(teams, teamRanks)
+		statistics = self._shapes.get(shape)
+		if statistics is None:
+			statistics = ShapeConvergenceStatistics(shape)
+			self._shapes[shape] = statistics
+		statistics.addReport(report)
+		
+	def clear(self):
+		self._shapes.clear()
+		
+def getShape(teams, teamRanks):
+	'''The team sizes and, for each pair of neighbouring teams, whether they drew'''
+	teamSizes = tuple(team.size for team in teams)
+	draws = tuple(teamRanks[i] == teamRanks[i + 1] for i in range(len(teamRanks) - 1))
+	return (teamSizes, draws)
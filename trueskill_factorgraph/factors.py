@@ -1,11 +1,15 @@
-from copy import deepcopy
+from __future__ import absolute_import
 from factorgraphs import Factor, Message
 from math import log, sqrt
 from numerics import logProductNormalization, fromPrecisionMean, cumulativeTo, \
 	logRatioNormalization, GaussianDistribution, wExceedsMargin, vExceedsMargin, \
-	wWithinMargin, vWithinMargin, Decimal
+	wWithinMargin, vWithinMargin, ieeeDivide
 
 class GaussianFactor(Factor):
+	'''
+	Base for factors whose messages and marginals are GaussianDistributions. Those are immutable, so an update
+	keeps the old values by reference and replaces them with new instances, without copying
+	'''
 	def sendMessage(self, message, variable):
 		marginal = variable.value
 		messageValue = message.value
@@ -17,6 +21,10 @@ class GaussianFactor(Factor):
 		message = Message(fromPrecisionMean(0, 0), "message from %s to %s" % (self, variable))
 		return self._createVariableToMessageBindingInternal(variable, message)
 		
+	def resetMessages(self):
+		for message in self._messages:
+			message.value = fromPrecisionMean(0, 0)
+		
 class GaussianGreaterThanFactor(GaussianFactor):
 	'''Factor representing a team difference that has exceeded the draw margin'''
 	def __init__(self, epsilon, variable):
@@ -31,21 +39,24 @@ class GaussianGreaterThanFactor(GaussianFactor):
 		messageFromVariable = marginal/message
 		return -1.0*logProductNormalization(messageFromVariable, message) + log(cumulativeTo((messageFromVariable.mean - self._epsilon) / messageFromVariable.standardDeviation))
 		
+	def emitInto(self, flatGraph):
+		return flatGraph.addGreaterThanFactor(self, self._epsilon)
+		
 	def _updateMessageInternal(self, message, variable):
-		oldMarginal = deepcopy(variable.value)
-		oldMessage = deepcopy(message.value)
+		oldMarginal = variable.value
+		oldMessage = message.value
 		messageFromVar = oldMarginal/oldMessage
 		
 		c = messageFromVar.precision
 		d = messageFromVar.precisionMean
 		sqrtC = sqrt(c)
-		dOnSqrtC = d/sqrtC
+		dOnSqrtC = ieeeDivide(d, sqrtC)
 		epsilonTimesSqrtC = self._epsilon*sqrtC
 		
 		denom = 1.0 - wExceedsMargin(dOnSqrtC, epsilonTimesSqrtC)
 		
-		newPrecision = c/denom
-		newPrecisionMean = (d + sqrtC*vExceedsMargin(dOnSqrtC, epsilonTimesSqrtC))/denom
+		newPrecision = ieeeDivide(c, denom)
+		newPrecisionMean = ieeeDivide(d + sqrtC*vExceedsMargin(dOnSqrtC, epsilonTimesSqrtC), denom)
 		
 		newMarginal = fromPrecisionMean(newPrecisionMean, newPrecision)
 		newMessage = oldMessage*newMarginal/oldMarginal
@@ -59,7 +70,7 @@ class GaussianLikelihoodFactor(GaussianFactor):
 	'''Connects two variables and adds uncertainty'''
 	def __init__(self, betaSquared, variable1, variable2):
 		super(GaussianLikelihoodFactor, self).__init__("Likelihood of %s going to %s" % (variable1, variable2))
-		self._precision = Decimal(1.0)/betaSquared
+		self._precision = 1.0/betaSquared
 		self.createVariableToMessageBinding(variable1)
 		self.createVariableToMessageBinding(variable2)
 		
@@ -67,6 +78,9 @@ class GaussianLikelihoodFactor(GaussianFactor):
 	def logNormalization(self):
 		return logRatioNormalization(self._variables[0].value, self._messages[0].value)
 		
+	def emitInto(self, flatGraph):
+		return flatGraph.addLikelihoodFactor(self, self._precision)
+		
 	def updateMessage(self, messageIndex):
 		if messageIndex == 0:
 			return self._updateHelper(self._messages[0], self._messages[1], self._variables[0], self._variables[1])
@@ -76,13 +90,13 @@ class GaussianLikelihoodFactor(GaussianFactor):
 			raise IndexError()	
 			
 	def _updateHelper(self, message1, message2, variable1, variable2):
-		message1Value = deepcopy(message1.value)
-		message2Value = deepcopy(message2.value)
+		message1Value = message1.value
+		message2Value = message2.value
 		
-		marginal1 = deepcopy(variable1.value)
-		marginal2 = deepcopy(variable2.value)
+		marginal1 = variable1.value
+		marginal2 = variable2.value
 		
-		a = self._precision/(self._precision + marginal2.precision - message2Value.precision)
+		a = ieeeDivide(self._precision, self._precision + marginal2.precision - message2Value.precision)
 		newMessage = fromPrecisionMean(a * (marginal2.precisionMean - message2Value.precisionMean), a*(marginal2.precision - message2Value.precision))
 		
 		oldMarginalWithoutMessage = marginal1/message1Value
@@ -100,8 +114,19 @@ class GaussianPriorFactor(GaussianFactor):
 		self._newMessage = GaussianDistribution(mean, sqrt(variance))
 		self.createVariableToMessageBinding(variable)
 		
+	@property
+	def prior(self):
+		return self._newMessage
+		
+	def setPrior(self, mean, variance):
+		'''Replaces the prior this factor supplies, so a built graph can be reused for a new game'''
+		self._newMessage = GaussianDistribution(mean, sqrt(variance))
+		
+	def emitInto(self, flatGraph):
+		return flatGraph.addPriorFactor(self, self._newMessage)
+		
 	def _updateMessageInternal(self, message, variable):
-		oldMarginal = deepcopy(variable.value)
+		oldMarginal = variable.value
 		oldMessage = message
 		newMarginal = fromPrecisionMean(oldMarginal.precisionMean + self._newMessage.precisionMean - oldMessage.value.precisionMean, oldMarginal.precision + self._newMessage.precision - oldMessage.value.precision)
 		variable.value = newMarginal
@@ -172,24 +197,24 @@ class GaussianWeightedSumFactor(GaussianFactor):
 			result += logRatioNormalization(self._variables[i].value, self._messages[i].value)
 		return result
 		
+	def emitInto(self, flatGraph):
+		return flatGraph.addWeightedSumFactor(self, self._weights, self._weightsSquared, self._variableIndexOrdersForWeights)
+		
 	def _updateHelper(self, weights, weightsSquared, messages, variables):
-		message0 = deepcopy(messages[0].value)
-		marginal0 = deepcopy(variables[0].value)
+		message0 = messages[0].value
+		marginal0 = variables[0].value
 		
-		inverseOfNewPrecisionSum = Decimal(0.0)
-		anotherInverseOfNewPrecisionSum = Decimal(0.0)
-		weightedMeanSum = Decimal(0.0)
-		anotherWeightedMeanSum = Decimal(0.0)
+		inverseOfNewPrecisionSum = 0.0
+		weightedMeanSum = 0.0
 		
 		for i in range(len(weightsSquared)):
-			inverseOfNewPrecisionSum += Decimal(weightsSquared[i])/(variables[i + 1].value.precision - messages[i + 1].value.precision)
-			diff = (variables[i + 1].value/messages[i + 1].value)
-			anotherInverseOfNewPrecisionSum += Decimal(weightsSquared[i])/diff.precision
+			# the natural parameters of the message coming from variable i + 1 (its marginal divided by our message)
+			precisionFromVariable = variables[i + 1].value.precision - messages[i + 1].value.precision
+			precisionMeanFromVariable = variables[i + 1].value.precisionMean - messages[i + 1].value.precisionMean
+			inverseOfNewPrecisionSum += ieeeDivide(weightsSquared[i], precisionFromVariable)
+			weightedMeanSum += ieeeDivide(weights[i] * precisionMeanFromVariable, precisionFromVariable)
 			
-			weightedMeanSum += Decimal(weights[i]) * (variables[i + 1].value.precisionMean - messages[i + 1].value.precisionMean) / (variables[i + 1].value.precision - messages[i + 1].value.precision)
-			anotherWeightedMeanSum += Decimal(weights[i]) * diff.precisionMean/diff.precision
-			
-		newPrecision = Decimal(1.0)/inverseOfNewPrecisionSum
+		newPrecision = ieeeDivide(1.0, inverseOfNewPrecisionSum)
 		
 		newPrecisionMean = newPrecision*weightedMeanSum
 		
@@ -246,22 +271,25 @@ class GaussianWithinFactor(GaussianFactor):
 		z = cumulativeTo((self._epsilon - mean) / std) - cumulativeTo((-1.0 * self._epsilon - mean) / std)
 		return -1.0 * logProductNormalization(messageFromVariable, message) + log(z)
 		
-	def updateMessage(self, message, variable):
-		oldMarginal = deepcopy(variable.value)
-		oldMessage = deepcopy(message.value)
+	def emitInto(self, flatGraph):
+		return flatGraph.addWithinFactor(self, self._epsilon)
+		
+	def _updateMessageInternal(self, message, variable):
+		oldMarginal = variable.value
+		oldMessage = message.value
 		messageFromVariable = oldMarginal/oldMessage
 		
 		c = messageFromVariable.precision
 		d = messageFromVariable.precisionMean
 		
 		sqrtC = sqrt(c)
-		dOnSqrtC = d/sqrt(c)
+		dOnSqrtC = ieeeDivide(d, sqrtC)
 		
 		epsilonTimesSqrtC = self._epsilon*sqrtC
 	
 		denominator = 1.0 - wWithinMargin(dOnSqrtC, epsilonTimesSqrtC)
-		newPrecision = c/denominator
-		newPrecisionMean = (d + sqrtC * vWithinMargin(dOnSqrtC, epsilonTimesSqrtC))/denominator
+		newPrecision = ieeeDivide(c, denominator)
+		newPrecisionMean = ieeeDivide(d + sqrtC * vWithinMargin(dOnSqrtC, epsilonTimesSqrtC), denominator)
 		
 		newMarginal = fromPrecisionMean(newPrecisionMean, newPrecision)
 		newMessage = oldMessage*newMarginal/oldMarginal
@@ -0,0 +1,253 @@
+from __future__ import absolute_import
+from array import array
+from factorgraphs import CompiledSchedule
+from math import sqrt
+from numerics import fromPrecisionMean, ieeeDivide, vExceedsMargin, wExceedsMargin, \
+	vWithinMargin, wWithinMargin
+
+class FactorGraphBackend(object):
+	'''Enum like class for the ways a TrueSkillFactorGraph can run its schedule'''
+	OBJECTS = 0
+	ARRAYS = 1
+
+_PRIOR = 0
+_LIKELIHOOD = 1
+_WEIGHTED_SUM = 2
+_GREATER_THAN = 3
+_WITHIN = 4
+
+class FlatFactorGraph(object):
+	'''
+	A struct of arrays form of a Gaussian factor graph. Every marginal and every message is a slot in flat float
+	arrays of precision and precision mean, and every factor is a record of integer slots, so running a schedule
+	never touches a Variable, Message or GaussianDistribution object or a per factor dict
+
+	A factor with n variables owns n consecutive message slots starting at its message offset, in the same order as
+	Factor.messages, and message slot m goes to the variable in slot messageVariables[m]. The updates are the same
+	arithmetic as the matching classes in factors.py, in the same order, so both backends give the same results
+
+	Factors are added through their emitInto method, which FactorGraphLayer.emitInto calls for every factor of a
+	layer. A flat graph starts from the current values of the object graph's marginals and messages, runs schedules
+	from compileSchedule and writes its marginals back with writeMarginals
+	'''
+	def __init__(self):
+		self._variables = list()
+		self._variableSlots = dict()
+		self._marginalPrecisions = array('d')
+		self._marginalPrecisionMeans = array('d')
+		self._messages = list()
+		self._messageVariables = array('i')
+		self._messagePrecisions = array('d')
+		self._messagePrecisionMeans = array('d')
+		self._factors = list()
+		self._factorSlots = dict()
+		self._factorKinds = array('i')
+		self._factorMessageOffsets = array('i')
+		self._factorParameters = list()
+
+	@property
+	def numberOfVariables(self):
+		return len(self._variables)
+
+	@property
+	def numberOfMessages(self):
+		return len(self._messages)
+
+	@property
+	def numberOfFactors(self):
+		return len(self._factors)
+
+	def addFactor(self, factor):
+		'''Adds a factor from factors.py, returning its factor index'''
+		return factor.emitInto(self)
+
+	def getFactorIndex(self, factor):
+		return self._factorSlots[id(factor)]
+
+	def getVariableSlot(self, variable):
+		return self._variableSlots[id(variable)]
+
+	def getMarginal(self, variable):
+		slot = self._variableSlots[id(variable)]
+		return fromPrecisionMean(self._marginalPrecisionMeans[slot], self._marginalPrecisions[slot])
+
+	def addPriorFactor(self, factor, prior):
+		return self._addFactor(factor, _PRIOR, [prior.precision, prior.precisionMean])
+
+	def addLikelihoodFactor(self, factor, precision):
+		return self._addFactor(factor, _LIKELIHOOD, precision)
+
+	def addWeightedSumFactor(self, factor, weights, weightsSquared, variableIndexOrdersForWeights):
+		return self._addFactor(factor, _WEIGHTED_SUM, (weights, weightsSquared, variableIndexOrdersForWeights))
+
+	def addGreaterThanFactor(self, factor, epsilon):
+		return self._addFactor(factor, _GREATER_THAN, epsilon)
+
+	def addWithinFactor(self, factor, epsilon):
+		return self._addFactor(factor, _WITHIN, epsilon)
+
+	def reset(self):
+		'''Reloads every marginal, message and prior from the object graph, after it has been reset or rebound'''
+		for slot in range(len(self._variables)):
+			value = self._variables[slot].value
+			self._marginalPrecisions[slot] = value.precision
+			self._marginalPrecisionMeans[slot] = value.precisionMean
+		for slot in range(len(self._messages)):
+			value = self._messages[slot].value
+			self._messagePrecisions[slot] = value.precision
+			self._messagePrecisionMeans[slot] = value.precisionMean
+		for factorIndex in range(len(self._factors)):
+			if self._factorKinds[factorIndex] == _PRIOR:
+				prior = self._factors[factorIndex].prior
+				self._factorParameters[factorIndex] = [prior.precision, prior.precisionMean]
+
+	def writeMarginals(self):
+		'''Copies the marginals back into the Variable objects they came from'''
+		for slot in range(len(self._variables)):
+			self._variables[slot].value = fromPrecisionMean(self._marginalPrecisionMeans[slot], self._marginalPrecisions[slot])
+
+	def updateMessage(self, factorIndex, messageIndex):
+		'''Runs one schedule step, returning the change in the marginal like Factor.updateMessage does'''
+		kind = self._factorKinds[factorIndex]
+		messageSlot = self._factorMessageOffsets[factorIndex]
+		parameters = self._factorParameters[factorIndex]
+		if kind == _WEIGHTED_SUM:
+			return self._updateWeightedSum(messageSlot, parameters, messageIndex)
+		elif kind == _LIKELIHOOD:
+			if messageIndex == 0:
+				return self._updateLikelihood(parameters, messageSlot, messageSlot + 1)
+			elif messageIndex == 1:
+				return self._updateLikelihood(parameters, messageSlot + 1, messageSlot)
+			raise IndexError()
+		elif kind == _PRIOR:
+			return self._updatePrior(messageSlot + messageIndex, parameters)
+		elif kind == _GREATER_THAN:
+			return self._updateTruncated(messageSlot + messageIndex, parameters, vExceedsMargin, wExceedsMargin)
+		else:
+			return self._updateTruncated(messageSlot + messageIndex, parameters, vWithinMargin, wWithinMargin)
+
+	def compileSchedule(self, schedule):
+		'''
+		Compiles a Schedule tree built for the object graph, or retargets a CompiledSchedule of it, so that its steps
+		refer to factor indices in this graph
+		'''
+		if isinstance(schedule, CompiledSchedule) == False:
+			schedule = CompiledSchedule(schedule)
+		return schedule.retarget(self.getFactorIndex)
+
+	def runSchedule(self, compiledSchedule, report = None, budget = None):
+		'''
+		Runs a schedule from compileSchedule, returning its delta like Schedule.visit does
+		report and budget, if given, are passed on to CompiledSchedule.run
+		'''
+		return compiledSchedule.run(self.updateMessage, report, budget)
+
+	def _addFactor(self, factor, kind, parameters):
+		factorIndex = len(self._factors)
+		self._factors.append(factor)
+		self._factorSlots[id(factor)] = factorIndex
+		self._factorKinds.append(kind)
+		self._factorMessageOffsets.append(len(self._messages))
+		self._factorParameters.append(parameters)
+		for message, variable in zip(factor.messages, factor.variables):
+			self._messages.append(message)
+			self._messageVariables.append(self._getOrAddVariableSlot(variable))
+			self._messagePrecisions.append(message.value.precision)
+			self._messagePrecisionMeans.append(message.value.precisionMean)
+		return factorIndex
+
+	def _getOrAddVariableSlot(self, variable):
+		slot = self._variableSlots.get(id(variable))
+		if slot is None:
+			slot = len(self._variables)
+			self._variables.append(variable)
+			self._variableSlots[id(variable)] = slot
+			self._marginalPrecisions.append(variable.value.precision)
+			self._marginalPrecisionMeans.append(variable.value.precisionMean)
+		return slot
+
+	def _setMarginal(self, variableSlot, newPrecision, newPrecisionMean):
+		'''Stores a new marginal and returns how far it moved, like numerics.absoluteDifference'''
+		precisionDifference = abs(newPrecision - self._marginalPrecisions[variableSlot])
+		precisionMeanDifference = abs(newPrecisionMean - self._marginalPrecisionMeans[variableSlot])
+		self._marginalPrecisions[variableSlot] = newPrecision
+		self._marginalPrecisionMeans[variableSlot] = newPrecisionMean
+		return max(precisionMeanDifference, sqrt(precisionDifference))
+
+	def _updatePrior(self, messageSlot, parameters):
+		variableSlot = self._messageVariables[messageSlot]
+		priorPrecision, priorPrecisionMean = parameters
+		newPrecisionMean = self._marginalPrecisionMeans[variableSlot] + priorPrecisionMean - self._messagePrecisionMeans[messageSlot]
+		newPrecision = self._marginalPrecisions[variableSlot] + priorPrecision - self._messagePrecisions[messageSlot]
+		self._messagePrecisions[messageSlot] = priorPrecision
+		self._messagePrecisionMeans[messageSlot] = priorPrecisionMean
+		return self._setMarginal(variableSlot, newPrecision, newPrecisionMean)
+
+	def _updateLikelihood(self, precision, messageSlot, otherMessageSlot):
+		variableSlot = self._messageVariables[messageSlot]
+		otherVariableSlot = self._messageVariables[otherMessageSlot]
+		otherPrecision = self._marginalPrecisions[otherVariableSlot] - self._messagePrecisions[otherMessageSlot]
+		otherPrecisionMean = self._marginalPrecisionMeans[otherVariableSlot] - self._messagePrecisionMeans[otherMessageSlot]
+		a = ieeeDivide(precision, precision + self._marginalPrecisions[otherVariableSlot] - self._messagePrecisions[otherMessageSlot])
+		newMessagePrecisionMean = a * otherPrecisionMean
+		newMessagePrecision = a * otherPrecision
+		newPrecisionMean = self._marginalPrecisionMeans[variableSlot] - self._messagePrecisionMeans[messageSlot] + newMessagePrecisionMean
+		newPrecision = self._marginalPrecisions[variableSlot] - self._messagePrecisions[messageSlot] + newMessagePrecision
+		self._messagePrecisions[messageSlot] = newMessagePrecision
+		self._messagePrecisionMeans[messageSlot] = newMessagePrecisionMean
+		return self._setMarginal(variableSlot, newPrecision, newPrecisionMean)
+
+	def _updateWeightedSum(self, firstMessageSlot, parameters, messageIndex):
+		weights, weightsSquared, variableIndexOrdersForWeights = parameters
+		weights = weights[messageIndex]
+		weightsSquared = weightsSquared[messageIndex]
+		indicesToUse = variableIndexOrdersForWeights[messageIndex]
+		marginalPrecisions = self._marginalPrecisions
+		marginalPrecisionMeans = self._marginalPrecisionMeans
+		messagePrecisions = self._messagePrecisions
+		messagePrecisionMeans = self._messagePrecisionMeans
+		messageVariables = self._messageVariables
+
+		inverseOfNewPrecisionSum = 0.0
+		weightedMeanSum = 0.0
+		for i in range(len(weightsSquared)):
+			messageSlot = firstMessageSlot + indicesToUse[i + 1]
+			variableSlot = messageVariables[messageSlot]
+			precisionFromVariable = marginalPrecisions[variableSlot] - messagePrecisions[messageSlot]
+			precisionMeanFromVariable = marginalPrecisionMeans[variableSlot] - messagePrecisionMeans[messageSlot]
+			inverseOfNewPrecisionSum += ieeeDivide(weightsSquared[i], precisionFromVariable)
+			weightedMeanSum += ieeeDivide(weights[i] * precisionMeanFromVariable, precisionFromVariable)
+
+		newMessagePrecision = ieeeDivide(1.0, inverseOfNewPrecisionSum)
+		newMessagePrecisionMean = newMessagePrecision*weightedMeanSum
+
+		messageSlot = firstMessageSlot + indicesToUse[0]
+		variableSlot = messageVariables[messageSlot]
+		newPrecisionMean = marginalPrecisionMeans[variableSlot] - messagePrecisionMeans[messageSlot] + newMessagePrecisionMean
+		newPrecision = marginalPrecisions[variableSlot] - messagePrecisions[messageSlot] + newMessagePrecision
+		messagePrecisions[messageSlot] = newMessagePrecision
+		messagePrecisionMeans[messageSlot] = newMessagePrecisionMean
+		return self._setMarginal(variableSlot, newPrecision, newPrecisionMean)
+
+	def _updateTruncated(self, messageSlot, epsilon, vFunction, wFunction):
+		'''The greater than and within factors, which only differ in their v and w functions'''
+		variableSlot = self._messageVariables[messageSlot]
+		oldPrecision = self._marginalPrecisions[variableSlot]
+		oldPrecisionMean = self._marginalPrecisionMeans[variableSlot]
+		oldMessagePrecision = self._messagePrecisions[messageSlot]
+		oldMessagePrecisionMean = self._messagePrecisionMeans[messageSlot]
+
+		c = oldPrecision - oldMessagePrecision
+		d = oldPrecisionMean - oldMessagePrecisionMean
+		sqrtC = sqrt(c)
+		dOnSqrtC = ieeeDivide(d, sqrtC)
+		epsilonTimesSqrtC = epsilon*sqrtC
+
+		denominator = 1.0 - wFunction(dOnSqrtC, epsilonTimesSqrtC)
+		newPrecision = ieeeDivide(c, denominator)
+		newPrecisionMean = ieeeDivide(d + sqrtC*vFunction(dOnSqrtC, epsilonTimesSqrtC), denominator)
+
+		# newMessage = oldMessage*newMarginal/oldMarginal
+		self._messagePrecisions[messageSlot] = oldMessagePrecision + newPrecision - oldPrecision
+		self._messagePrecisionMeans[messageSlot] = oldMessagePrecisionMean + newPrecisionMean - oldPrecisionMean
+		return self._setMarginal(variableSlot, newPrecision, newPrecisionMean)
@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from .layers import TrueSkillFactorGraph
+from objects import getPartialPlayPercentage
+
+_defaultMaxSize = 64
+
+class FactorGraphCache(object):
+	'''
+	A bounded, least recently used cache of built TrueSkillFactorGraphs (with their schedules), keyed by the shape
+	of the game: the team sizes, which neighbouring teams drew, every player's partial play percentage, beta and the
+	draw probability. A cached graph is rebound to the new priors and reset instead of being built again
+
+	Cached graphs are reused in place, so a cache (and the calculator using it) must not be shared between threads
+	'''
+	def __init__(self, maxSize=_defaultMaxSize):
+		assert maxSize > 0, "maxSize"
+		self._maxSize = maxSize
+		self._graphs = OrderedDict()
+		self._hits = 0
+		self._misses = 0
+
+	@property
+	def maxSize(self):
+		return self._maxSize
+
+	@property
+	def size(self):
+		return len(self._graphs)
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	def getFactorGraph(self, gameInfo, teams, teamRanks):
+		'''
+		Returns a built TrueSkillFactorGraph for teams, which must already be sorted by rank, ready for runSchedule
+		'''
+		key = self._getShapeKey(gameInfo, teams, teamRanks)
+		factorGraph = self._graphs.pop(key, None)
+		if factorGraph is None:
+			self._misses += 1
+			factorGraph = TrueSkillFactorGraph(gameInfo, teams, teamRanks)
+			factorGraph.buildGraph()
+			if len(self._graphs) >= self._maxSize:
+				self._graphs.popitem(last=False)
+		else:
+			self._hits += 1
+			factorGraph.rebind(gameInfo, teams)
+		self._graphs[key] = factorGraph
+		return factorGraph
+
+	def clear(self):
+		self._graphs.clear()
+		self._hits = 0
+		self._misses = 0
+
+	def _getShapeKey(self, gameInfo, teams, teamRanks):
+		teamShapes = list()
+		for currentTeam in teams:
+			teamShapes.append(tuple(getPartialPlayPercentage(player) for player, rating in currentTeam.asListOfTuples))
+		draws = tuple(teamRanks[i] == teamRanks[i + 1] for i in range(len(teamRanks) - 1))
+		return (tuple(teamShapes), draws, gameInfo.beta, gameInfo.drawProbability)
@@ -1,11 +1,12 @@
+from __future__ import absolute_import
 from factorgraphs import FactorGraphLayer, ScheduleSequence, ScheduleStep, \
-	ScheduleLoop, FactorGraph, FactorList, VariableFactory
-from factors import GaussianPriorFactor, GaussianLikelihoodFactor, \
-	GaussianWithinFactor, GaussianGreaterThanFactor
+	ScheduleLoop, FactorGraph, FactorList, VariableFactory, CompiledSchedule
+from .factors import GaussianPriorFactor, GaussianLikelihoodFactor, \
+	GaussianWithinFactor, GaussianGreaterThanFactor, GaussianWeightedSumFactor
+from .flatgraph import FactorGraphBackend, FlatFactorGraph
 from math import e
-from numerics import getDrawMarginFromDrawProbability, fromPrecisionMean
+from numerics import fromPrecisionMean
 from objects import Rating, getPartialPlayPercentage
-from trueskill_factorgraph.factors import GaussianWeightedSumFactor
 
 class TrueSkillFactorGraph(FactorGraph):
 	def __init__(self, gameInfo, teams, teamRanks):
@@ -21,11 +22,21 @@ class TrueSkillFactorGraph(FactorGraph):
 					TeamDifferencesComparisonLayer(self, teamRanks)
 					)
 				]
+		self._fullSchedule = None
+		self._flatGraph = None
+		self._flatSchedule = None
 	
 	@property
 	def gameInfo(self):
 		return self._gameInfo
 		
+	@property
+	def factors(self):
+		result = list()
+		for currentLayer in self._layers:
+			result.extend(currentLayer.factors)
+		return result
+		
 	def buildGraph(self):
 		lastOutput = None
 		for currentLayer in self._layers:
@@ -34,16 +45,51 @@ class TrueSkillFactorGraph(FactorGraph):
 			currentLayer.buildLayer()
 			lastOutput = currentLayer.outputVariablesGroups
 			
-	def runSchedule(self):
-		fullSchedule = self._createFullSchedule()
-		fullScheduleDelta = fullSchedule.visit()
-		fullScheduleDelta = 0
+	def runSchedule(self, backend = FactorGraphBackend.OBJECTS, report = None, budget = None):
+		'''
+		Runs the full schedule, returning its final delta. With FactorGraphBackend.ARRAYS the messages are passed in a
+		FlatFactorGraph made from this graph, and only the final marginals are written back to the variables
+		report, if given, is a ScheduleRunReport filled in with how the schedule's loops converged
+		budget, if given, is a ConvergenceBudget limiting the schedule's loops
+		'''
+		if self._fullSchedule is None:
+			self._fullSchedule = CompiledSchedule(self._createFullSchedule())
+		if backend == FactorGraphBackend.ARRAYS:
+			if self._flatGraph is None:
+				self._flatGraph = self.createFlatGraph()
+				self._flatSchedule = self._flatGraph.compileSchedule(self._fullSchedule)
+			else:
+				self._flatGraph.reset()
+			fullScheduleDelta = self._flatGraph.runSchedule(self._flatSchedule, report, budget)
+			self._flatGraph.writeMarginals()
+		else:
+			fullScheduleDelta = self._fullSchedule.run(report=report, budget=budget)
+		return fullScheduleDelta
+		
+	def createFlatGraph(self):
+		'''A FlatFactorGraph holding every factor of this graph, starting from the current marginals and messages'''
+		flatGraph = FlatFactorGraph()
+		for currentLayer in self._layers:
+			currentLayer.emitInto(flatGraph)
+		return flatGraph
+		
+	def rebind(self, gameInfo, teams):
+		'''
+		Prepares an already built and run graph for a new game of the same shape: the same team sizes, draw pattern,
+		partial play percentages, beta and draw probability. The priors and the keys of the skill variables are
+		replaced and every message and marginal goes back to where buildGraph left it. Variable and factor names keep
+		the players they were built with
+		'''
+		self._gameInfo = gameInfo
+		self._priorLayer.rebindPriors(teams)
+		for currentFactor in self.factors:
+			currentFactor.resetMessages()
+			currentFactor.resetMarginals()
 		
 	def getProbabilityOfRanking(self):
 		factorList = FactorList()
-		for currentLayer in self._layers:
-			for currentFactor in currentLayer.factors:
-				factorList.addFactor(currentFactor)
+		for currentFactor in self.factors:
+			factorList.addFactor(currentFactor)
 		logZ = factorList.logNormalization
 		return e ** logZ
 		
@@ -78,6 +124,10 @@ class IteratedTeamDifferencesInnerLayer(FactorGraphLayer):
 		self._teamDifferencesComparisonLayer.inputVariablesGroups = self._teamPerformancesToTeamPerformanceDifferencesLayer.outputVariablesGroups
 		self._teamDifferencesComparisonLayer.buildLayer()
 		
+	@property
+	def factors(self):
+		return self._teamPerformancesToTeamPerformanceDifferencesLayer.factors + self._teamDifferencesComparisonLayer.factors
+		
 	def createPriorSchedule(self):
 		loop = None
 		count = len(self._inputVariablesGroups)
@@ -160,8 +210,21 @@ class PlayerPriorValuesToSkillsLayer(FactorGraphLayer):
 			schedules.append(ScheduleStep("Prior to skill step", prior, 0))
 		return ScheduleSequence("All priors", schedules)
 		
+	def rebindPriors(self, teams):
+		'''Points the prior factors and player keyed variables at the players and ratings of teams'''
+		self._teams = teams
+		factorIndex = 0
+		for teamIndex in range(len(teams)):
+			teamSkills = self._outputVariablesGroups[teamIndex]
+			playerIndex = 0
+			for player, rating in teams[teamIndex].asListOfTuples:
+				self._localFactors[factorIndex].setPrior(rating.mean, rating.standardDeviation ** 2.0 + self._parentFactorGraph.gameInfo.profile.tauSquared)
+				teamSkills[playerIndex].key = player
+				factorIndex += 1
+				playerIndex += 1
+		
 	def _createPriorFactor(self, player, priorRating, skillsVariable):
-		return GaussianPriorFactor(priorRating.mean, priorRating.standardDeviation ** 2.0 + self._parentFactorGraph.gameInfo.dynamicsFactor ** 2.0, skillsVariable)
+		return GaussianPriorFactor(priorRating.mean, priorRating.standardDeviation ** 2.0 + self._parentFactorGraph.gameInfo.profile.tauSquared, skillsVariable)
 		
 	def _createSkillOutputVariable(self, player):
 		return self._parentFactorGraph.variableFactory.createKeyedVariable("%s's skill" % player, player)
@@ -177,7 +240,7 @@ class PlayerSkillsToPerformancesLayer(FactorGraphLayer):
 			self._outputVariablesGroups.append(currentTeamPlayerPerformances)
 	
 	def _createLikelihood(self, playerSkill, playerPerformance):
-		return GaussianLikelihoodFactor(self._parentFactorGraph.gameInfo.beta ** 2.0, playerPerformance, playerSkill)
+		return GaussianLikelihoodFactor(self._parentFactorGraph.gameInfo.profile.betaSquared, playerPerformance, playerSkill)
 		
 	def _createOutputVariable(self, key):
 		return self._parentFactorGraph.variableFactory.createKeyedVariable("%s's performance" % key, key)
@@ -228,7 +291,7 @@ class TeamDifferencesComparisonLayer(FactorGraphLayer):
 	def __init__(self, parentGraph, teamRanks):
 		super(TeamDifferencesComparisonLayer, self).__init__(parentGraph)
 		self._teamRanks = teamRanks
-		self._epsilon = getDrawMarginFromDrawProbability(parentGraph.gameInfo.drawProbability, parentGraph.gameInfo.beta)
+		self._epsilon = parentGraph.gameInfo.profile.drawMargin
 		
 	def buildLayer(self):
 		for i in range(len(self._inputVariablesGroups)):
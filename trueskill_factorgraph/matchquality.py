@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from math import e, sqrt
+from objects import getPartialPlayPercentage
+
+def calculateMatchQuality(betaSquared, teams):
+	'''
+	The match quality of any number of teams (the likelihood of all teams drawing), with partial play
+	teams should be a list of Team instances in rank order, as taken by FactorGraphTrueSkillCalculator
+	'''
+	meanSums = list()
+	varianceSums = list()
+	playTimeSquaredSums = list()
+	for currentTeam in teams:
+		meanSum = 0.0
+		varianceSum = 0.0
+		playTimeSquaredSum = 0.0
+		for player, rating in currentTeam.asListOfTuples:
+			partialPlayPercentage = getPartialPlayPercentage(player)
+			partialPlayPercentageSquared = partialPlayPercentage**2.0
+			meanSum += partialPlayPercentage*rating.mean
+			varianceSum += partialPlayPercentageSquared*(rating.standardDeviation**2.0)
+			playTimeSquaredSum += partialPlayPercentageSquared
+		meanSums.append(meanSum)
+		varianceSums.append(varianceSum)
+		playTimeSquaredSums.append(playTimeSquaredSum)
+	return calculateMatchQualityFromTeamSums(betaSquared, meanSums, varianceSums, playTimeSquaredSums)
+
+def calculateMatchQualityFromTeamSums(betaSquared, meanSums, varianceSums, playTimeSquaredSums):
+	'''
+	The match quality from per team sums, in O(teams)
+	For team k (with w the partial play percentage of each player):
+		meanSums[k] is the sum of w*mu
+		varianceSums[k] is the sum of w^2*sigma^2
+		playTimeSquaredSums[k] is the sum of w^2
+
+	This is the same quantity as the dense formula
+		exp(-0.5 * m^T A (A^T (beta^2 I + S) A)^-1 A^T m) * sqrt(det(beta^2 A^T A) / det(A^T (beta^2 I + S) A))
+	where A is the player to team difference assignment matrix. Column i of A only touches teams i and i + 1, so
+	both A^T A and A^T (beta^2 I + S) A are (teams - 1)x(teams - 1) tridiagonal matrices built from the per team
+	sums: entry (i, i) is t[i] + t[i + 1] and entries (i, i + 1) and (i + 1, i) are -t[i + 1]. Each is factored as
+	L * D * L^T in one pass, which gives the determinants as the product of D and the quadratic form through a
+	single forward substitution
+	'''
+	teamCount = len(meanSums)
+	performanceVarianceSums = [varianceSums[i] + betaSquared*playTimeSquaredSums[i] for i in range(teamCount)]
+
+	# det(beta^2 A^T A) / det(A^T (beta^2 I + S) A), multiplied pivot by pivot so that it does not under or overflow
+	determinantRatio = 1.0
+	quadraticForm = 0.0
+	pivot = None
+	betaPivot = None
+	solution = None
+	for i in range(teamCount - 1):
+		diagonal = performanceVarianceSums[i] + performanceVarianceSums[i + 1]
+		betaDiagonal = betaSquared*(playTimeSquaredSums[i] + playTimeSquaredSums[i + 1])
+		meanDifference = meanSums[i] - meanSums[i + 1]
+		if i == 0:
+			pivot = diagonal
+			betaPivot = betaDiagonal
+			solution = meanDifference
+		else:
+			# the entry above the diagonal in row i - 1 is minus the sum of team i
+			offDiagonal = performanceVarianceSums[i]
+			betaOffDiagonal = betaSquared*playTimeSquaredSums[i]
+			multiplier = -offDiagonal/pivot
+			pivot = diagonal - (offDiagonal**2.0)/pivot
+			betaPivot = betaDiagonal - (betaOffDiagonal**2.0)/betaPivot
+			solution = meanDifference - multiplier*solution
+		quadraticForm += (solution**2.0)/pivot
+		determinantRatio *= betaPivot/pivot
+	return (e**(-0.5*quadraticForm)) * sqrt(determinantRatio)
@@ -1,48 +1,112 @@
-from layers import TrueSkillFactorGraph
+from __future__ import absolute_import
+from factorgraphs import ScheduleRunReport
+from .flatgraph import FactorGraphBackend
+from .layers import TrueSkillFactorGraph
 from math import e, sqrt
+from .matchquality import calculateMatchQuality
 from numerics import atLeast, _Vector, _DiagonalMatrix, Matrix
 from objects import SkillCalculator, SupportedOptions, argumentNotNone, \
 	getPartialPlayPercentage, sortByRank
 
 class FactorGraphTrueSkillCalculator(SkillCalculator):
-	def __init__(self):
+	def __init__(self, factorGraphCache=None, backend=FactorGraphBackend.OBJECTS, convergenceStatistics=None,
+			convergenceBudget=None):
+		'''
+		factorGraphCache is an optional FactorGraphCache: when given, graphs are reused between games of the same
+		shape instead of being built for every call
+		backend is a FactorGraphBackend value choosing how the schedule is run
+		convergenceStatistics is an optional ConvergenceStatistics: when given, every call records a
+		ScheduleRunReport, kept as lastConvergenceReport and added to the statistics
+		convergenceBudget is an optional ConvergenceBudget bounding the iterations of games with more than two teams.
+		A game that runs out of budget still gets the ratings from the last pass; lastConvergenceReport.converged is
+		False for it
+		'''
 		super(FactorGraphTrueSkillCalculator, self).__init__(SupportedOptions.PARTIAL_PLAY | SupportedOptions.PARTIAL_UPDATE, atLeast(2), atLeast(1))
+		self._factorGraphCache = factorGraphCache
+		self._backend = backend
+		self._convergenceStatistics = convergenceStatistics
+		self._convergenceBudget = convergenceBudget
+		self._lastConvergenceReport = None
+		
+	@property
+	def backend(self):
+		return self._backend
+		
+	@property
+	def factorGraphCache(self):
+		return self._factorGraphCache
+		
+	@property
+	def convergenceStatistics(self):
+		return self._convergenceStatistics
+		
+	@property
+	def convergenceBudget(self):
+		return self._convergenceBudget
+		
+	@property
+	def lastConvergenceReport(self):
+		'''
+		The ScheduleRunReport of the last calculateNewRatings call, if convergenceStatistics or a convergenceBudget
+		were given
+		'''
+		return self._lastConvergenceReport
 	
 	def calculateNewRatings(self, gameInfo, teams, teamRanks):
 		argumentNotNone(gameInfo, "gameInfo")
 		self._validateTeamCountAndPlayersCountPerTeam(teams)
 		teams, teamRanks = sortByRank(teams, teamRanks)
 		
-		factorGraph = TrueSkillFactorGraph(gameInfo, teams, teamRanks)
-		factorGraph.buildGraph()
-		factorGraph.runSchedule()	
+		if self._factorGraphCache is not None:
+			factorGraph = self._factorGraphCache.getFactorGraph(gameInfo, teams, teamRanks)
+		else:
+			factorGraph = TrueSkillFactorGraph(gameInfo, teams, teamRanks)
+			factorGraph.buildGraph()
+		if self._convergenceStatistics is not None or self._convergenceBudget is not None:
+			report = ScheduleRunReport()
+			factorGraph.runSchedule(self._backend, report, self._convergenceBudget)
+			if self._convergenceStatistics is not None:
+				self._convergenceStatistics.addReport(teams, teamRanks, report)
+			self._lastConvergenceReport = report
+		else:
+			factorGraph.runSchedule(self._backend)
 		
 		return factorGraph.getUpdatedRatings()
 		
 	def calculateMatchQuality(self, gameInfo, teams):
+		argumentNotNone(gameInfo, "gameInfo")
+		self._validateTeamCountAndPlayersCountPerTeam(teams)
+		return calculateMatchQuality(gameInfo.profile.betaSquared, teams)
+		
+	def _calculateMatchQualityFromMatrices(self, gameInfo, teams):
+		'''The dense matrix form of calculateMatchQuality, kept as the reference the closed form is checked against'''
 		skillsMatrix = self._getPlayerCovarianceMatrix(teams)
 		meanVector = self._getPlayerMeansVector(teams)
-		meanVectorTranspose = meanVector.transpose
 		
 		playerTeamAssignmentsMatrix = self._createPlayerTeamAssignmentMatrix(teams, meanVector.rows)
 		playerTeamAssignmentsMatrixTranspose = playerTeamAssignmentsMatrix.transpose
 		
-		betaSquared = gameInfo.beta**2.0
+		betaSquared = gameInfo.profile.betaSquared
 		
-		start = meanVectorTranspose * playerTeamAssignmentsMatrix
 		aTa = (betaSquared * playerTeamAssignmentsMatrixTranspose) * playerTeamAssignmentsMatrix
 		aTSA = playerTeamAssignmentsMatrixTranspose * skillsMatrix * playerTeamAssignmentsMatrix
 		middle = aTa + aTSA
 		
-		middleInverse = middle.inverse
+		# middle is symmetric positive definite, so rather than inverting it we factor it as L * L^T. Then
+		# start * middle^-1 * end is the squared length of L^-1 * end (start is the transpose of end), and
+		# det(middle) is the squared product of the diagonal of L
+		middleCholesky = middle.cholesky
 		
 		end = playerTeamAssignmentsMatrixTranspose * meanVector
 		
-		expPartMatrix = (start * middleInverse * end) * -0.5
-		expPart = expPartMatrix.determinant
+		choleskySolution = middleCholesky.forwardSubstitute(end)
+		expPart = 0.0
+		for i in range(choleskySolution.rows):
+			expPart = expPart + choleskySolution.get(i, 0)**2.0
+		expPart = -0.5 * expPart
 		
-		sqrtPartNumerator = aTa.determinant
-		sqrtPartDenominator = middle.determinant
+		sqrtPartNumerator = aTa.cholesky.determinant**2.0
+		sqrtPartDenominator = middleCholesky.determinant**2.0
 		sqrtPart = sqrtPartNumerator / sqrtPartDenominator
 		
 		result = (e**expPart) * sqrt(sqrtPart)
@@ -58,25 +122,28 @@ class FactorGraphTrueSkillCalculator(SkillCalculator):
 	def _getPlayerRatingValues(self, teamAssigmentsList, playerRatingFunction):
 		playerRatingValues = list()
 		for currentTeam in teamAssigmentsList:
-			for currentRating in currentTeam.values:
+			for currentPlayer, currentRating in currentTeam.asListOfTuples:
 				playerRatingValues.append(playerRatingFunction(currentRating))
 		return playerRatingValues
 	
 	def _createPlayerTeamAssignmentMatrix(self, teamAssignmentsList, totalPlayers):
-		playerAssignments = list()
+		'''
+		The "A" matrix: one row per player and one column per pair of neighbouring teams. Column i holds each
+		player's partial play percentage if they are on team i, minus it if they are on team i + 1, and 0 otherwise
+		'''
+		playerAssignments = [[0] * (len(teamAssignmentsList) - 1) for i in range(totalPlayers)]
 		totalPreviousPlayers = 0
 		
-		for i in range(len(teamAssignmentsList)):
+		for i in range(len(teamAssignmentsList) - 1):
 			currentTeam = teamAssignmentsList[i]
-			currentRowValues = [0] * totalPreviousPlayers
-			playerAssignments.append(currentRowValues)
-			
-			for currentRating in currentTeam:
-				currentRowValues.append(getPartialPlayPercentage(currentRating[0]))
+			for currentPlayer, currentRating in currentTeam.asListOfTuples:
+				playerAssignments[totalPreviousPlayers][i] = getPartialPlayPercentage(currentPlayer)
 				totalPreviousPlayers += 1
 				
 			nextTeam = teamAssignmentsList[i + 1]
-			for nextTeamPlayerPair in nextTeam:
-				currentRowValues.append(-1 * getPartialPlayPercentage(nextTeamPlayerPair[0]))
+			nextTeamPlayerIndex = totalPreviousPlayers
+			for nextTeamPlayer, nextTeamRating in nextTeam.asListOfTuples:
+				playerAssignments[nextTeamPlayerIndex][i] = -1 * getPartialPlayPercentage(nextTeamPlayer)
+				nextTeamPlayerIndex += 1
 				
-		return Matrix(totalPlayers, len(teamAssignmentsList) - 1, playerAssignments)
+		return Matrix(playerAssignments)
@@ -1,8 +1,8 @@
+from fastnumerics import NumericsMode, getTruncatedGaussianCorrections
 from math import sqrt, e
-from numerics import atLeast, exactly, getDrawMarginFromDrawProbability, \
-	vExceedsMargin, wExceedsMargin, vWithinMargin, wWithinMargin
+from numerics import atLeast, exactly, getDrawMarginFromDrawProbability
 from objects import SkillCalculator, SupportedOptions, argumentNotNone, \
-	sortByRank, PairwiseComparison, Rating
+	sortByRank, PairwiseComparison, Rating, isEqual
 
 class TwoTeamTrueSkillCalculator(SkillCalculator):
 	'''
@@ -10,8 +10,15 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 
 	When you only have two teams, the math is still simple: no factor graphs are used yet
 	'''
-	def __init__(self):
+	def __init__(self, numerics=NumericsMode.EXACT):
+		'''numerics is the NumericsMode v and w are computed with'''
 		super(TwoTeamTrueSkillCalculator, self).__init__(SupportedOptions.NONE, exactly(2), atLeast(1))
+		self._numerics = numerics
+		self._vwExceedsMargin, self._vwWithinMargin = getTruncatedGaussianCorrections(numerics)
+		
+	@property
+	def numerics(self):
+		return self._numerics
 		
 	def calculateNewRatings(self, gameInfo, teams, teamRanks):
 		'''Implementation for a 2 team game. Returns a list of tuples of (player, rating)'''
@@ -30,9 +37,10 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 		return results
 		
 	def _updatePlayerRatings(self, gameInfo, newPlayerRatings, selfTeam, otherTeam, selfToOtherComparison):
-		drawMargin = getDrawMarginFromDrawProbability(gameInfo.drawProbability, gameInfo.beta)
-		betaSquared = gameInfo.beta**2.0
-		tauSquared = gameInfo.dynamicsFactor**2.0
+		profile = gameInfo.profile
+		drawMargin = profile.drawMargin
+		betaSquared = profile.betaSquared
+		tauSquared = profile.tauSquared
 
 		totalPlayers = selfTeam.size + otherTeam.size
 		
@@ -53,12 +61,10 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 		w = None
 		rankMultiplier = None
 		if selfToOtherComparison != PairwiseComparison.DRAW:
-			v = vExceedsMargin(meanDelta, drawMargin, c)
-			w = wExceedsMargin(meanDelta, drawMargin, c)
+			v, w = self._vwExceedsMargin(meanDelta, drawMargin, c)
 			rankMultiplier = selfToOtherComparison
 		else:
-			v = vWithinMargin(meanDelta, drawMargin, c)
-			w = wWithinMargin(meanDelta, drawMargin, c)
+			v, w = self._vwWithinMargin(meanDelta, drawMargin, c)
 			rankMultiplier = 1
 		
 		for playerTuple in selfTeam.asListOfTuples:
@@ -69,6 +75,64 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 			newMean = previousPlayerRating.mean + playerMeanDelta
 			newStdDev = sqrt(((previousPlayerRating.standardDeviation**2.0) + tauSquared) * (1 - w*stdDevMultiplier))
 			newPlayerRatings.append((playerTuple[0], Rating(newMean, newStdDev)))
+
+	def calculateNewRatingsBatch(self, gameInfo, means, standardDeviations, teamOffsets, wasDraw):
+		'''
+		Calculates the new ratings for many 2 team games in one call
+		means and standardDeviations are flat sequences holding every player of every game
+		teamOffsets splits the players into teams: team t is made of the players from teamOffsets[t] up to (but not
+		including) teamOffsets[t + 1]. Game i is played between team 2*i, the winner, and team 2*i + 1, so teamOffsets
+		has 2*len(wasDraw) + 1 entries and its last entry is the total number of players
+		wasDraw holds a true value for the games that ended in a draw
+		Returns a tuple of flat lists (means, standardDeviations) in the same player order as the input
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		gameCount = len(wasDraw)
+		playerCount = len(means)
+		isEqual(len(standardDeviations), playerCount, "standardDeviations")
+		isEqual(len(teamOffsets), 2*gameCount + 1, "teamOffsets")
+		isEqual(teamOffsets[-1], playerCount, "teamOffsets")
+
+		profile = gameInfo.profile
+		drawMargin = profile.drawMargin
+		betaSquared = profile.betaSquared
+		tauSquared = profile.tauSquared
+
+		# segmented reduction of the team sums, one pass over the players
+		variancesWithDynamics = [0.0]*playerCount
+		teamMeanSums = [0.0]*(2*gameCount)
+		teamVarianceSums = [0.0]*(2*gameCount)
+		for team in range(2*gameCount):
+			meanSum = 0.0
+			varianceSum = 0.0
+			for i in range(teamOffsets[team], teamOffsets[team + 1]):
+				variance = standardDeviations[i]**2.0
+				meanSum += means[i]
+				varianceSum += variance
+				variancesWithDynamics[i] = variance + tauSquared
+			teamMeanSums[team] = meanSum
+			teamVarianceSums[team] = varianceSum
+
+		newMeans = [0.0]*playerCount
+		newStandardDeviations = [0.0]*playerCount
+		for game in range(gameCount):
+			winningTeam = 2*game
+			losingTeam = winningTeam + 1
+			totalPlayers = teamOffsets[losingTeam + 1] - teamOffsets[winningTeam]
+			c = sqrt(teamVarianceSums[winningTeam] + teamVarianceSums[losingTeam] + totalPlayers*betaSquared)
+			cSquared = c**2.0
+			meanDelta = teamMeanSums[winningTeam] - teamMeanSums[losingTeam]
+			# both teams share v and w, the losing team only sees the sign of v flipped
+			if wasDraw[game]:
+				v, w = self._vwWithinMargin(meanDelta, drawMargin, c)
+			else:
+				v, w = self._vwExceedsMargin(meanDelta, drawMargin, c)
+			for team, rankMultiplier in ((winningTeam, 1.0), (losingTeam, -1.0)):
+				for i in range(teamOffsets[team], teamOffsets[team + 1]):
+					varianceWithDynamics = variancesWithDynamics[i]
+					newMeans[i] = means[i] + rankMultiplier*(varianceWithDynamics/c)*v
+					newStandardDeviations[i] = sqrt(varianceWithDynamics*(1 - w*varianceWithDynamics/cSquared))
+		return (newMeans, newStandardDeviations)
 			
 	def calculateMatchQuality(self, gameInfo, teams):
 		argumentNotNone(gameInfo, "gameInfo")
@@ -78,7 +142,7 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 		team2 = teams[1]
 		
 		totalPlayers = team1.size + team2.size
-		betaSquared = gameInfo.beta**2.0
+		betaSquared = gameInfo.profile.betaSquared
 		
 		team1MeanSum = team1.meanSum
 		team1StdDevSum = team1.standardDeviationSquaredSum
@@ -90,6 +154,29 @@ class TwoTeamTrueSkillCalculator(SkillCalculator):
 		expPart = e**((-1.0*(team1MeanSum - team2MeanSum)**2.0) / (2*(totalPlayers*betaSquared +team1StdDevSum + team2StdDevSum)))
 		return sqrtPart * expPart
 
+	def calculateMatchQualityBatch(self, gameInfo, team1MeanSums, team1VarianceSums, team2MeanSums, team2VarianceSums, totalPlayers):
+		'''
+		calculateMatchQuality for many candidate 2 team games in one call. Every argument after gameInfo is a sequence
+		with one entry per game: the sums of the means and of the variances (standard deviations squared) of the players
+		of each team, and the number of players in both teams together. Returns a list of qualities
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		gameCount = len(team1MeanSums)
+		isEqual(len(team1VarianceSums), gameCount, "team1VarianceSums")
+		isEqual(len(team2MeanSums), gameCount, "team2MeanSums")
+		isEqual(len(team2VarianceSums), gameCount, "team2VarianceSums")
+		isEqual(len(totalPlayers), gameCount, "totalPlayers")
+		betaSquared = gameInfo.profile.betaSquared
+		
+		qualities = [0.0]*gameCount
+		for i in range(gameCount):
+			totalPlayersBetaSquared = totalPlayers[i]*betaSquared
+			denominator = totalPlayersBetaSquared + team1VarianceSums[i] + team2VarianceSums[i]
+			sqrtPart = sqrt(totalPlayersBetaSquared / denominator)
+			expPart = e**((-1.0*(team1MeanSums[i] - team2MeanSums[i])**2.0) / (2*denominator))
+			qualities[i] = sqrtPart * expPart
+		return qualities
+
 class TwoPlayerTrueSkillCalculator(SkillCalculator):
 	'''
 	Calculates the new ratings for only two players
@@ -97,8 +184,15 @@ class TwoPlayerTrueSkillCalculator(SkillCalculator):
 	When you only have two players, a lot of the math simlifies. The main purpose of this class is to show 
 	the bare minimum of what a TrueSkill implementation should have
 	'''
-	def __init__(self):
+	def __init__(self, numerics=NumericsMode.EXACT):
+		'''numerics is the NumericsMode v and w are computed with'''
 		super(TwoPlayerTrueSkillCalculator, self).__init__(SupportedOptions.NONE, exactly(2), exactly(1))
+		self._numerics = numerics
+		self._vwExceedsMargin, self._vwWithinMargin = getTruncatedGaussianCorrections(numerics)
+		
+	@property
+	def numerics(self):
+		return self._numerics
 		
 	def calculateNewRatings(self, gameInfo, teams, teamRanks):
 		'''Implementation for a 2 player game. returns a list of tuples of (player, newRating)'''
@@ -130,8 +224,9 @@ class TwoPlayerTrueSkillCalculator(SkillCalculator):
 		return results
 		
 	def _calculateNewRating(self, gameInfo, selfRating, opponentRating, comparison):
-		drawMargin = getDrawMarginFromDrawProbability(gameInfo.drawProbability, gameInfo.beta)
-		c = sqrt((selfRating.standardDeviation**2.0) + (opponentRating.standardDeviation**2.0) + 2.0*(gameInfo.beta**2.0))
+		profile = gameInfo.profile
+		drawMargin = profile.drawMargin
+		c = sqrt((selfRating.standardDeviation**2.0) + (opponentRating.standardDeviation**2.0) + profile.twoBetaSquared)
 		winningMean = selfRating.mean
 		losingMean = opponentRating.mean
 		if comparison == PairwiseComparison.LOSE:
@@ -142,28 +237,90 @@ class TwoPlayerTrueSkillCalculator(SkillCalculator):
 		w = None
 		rankMultiplier = None
 		if comparison != PairwiseComparison.DRAW:
-			v = vExceedsMargin(meanDelta, drawMargin, c)
-			w = wExceedsMargin(meanDelta, drawMargin, c)
+			v, w = self._vwExceedsMargin(meanDelta, drawMargin, c)
 			rankMultiplier = comparison
 		else:
-			v = vWithinMargin(meanDelta, drawMargin, c)
-			w = wWithinMargin(meanDelta, drawMargin, c)
+			v, w = self._vwWithinMargin(meanDelta, drawMargin, c)
 			rankMultiplier = 1.0
-		meanMultiplier = ((selfRating.standardDeviation**2.0) + (gameInfo.dynamicsFactor**2.0)) / c
-		varianceWithDynamics = (selfRating.standardDeviation**2) + (gameInfo.dynamicsFactor**2)
+		meanMultiplier = ((selfRating.standardDeviation**2.0) + profile.tauSquared) / c
+		varianceWithDynamics = (selfRating.standardDeviation**2) + profile.tauSquared
 		stdDevMultiplier = varianceWithDynamics/(c**2.0)
 		newMean = selfRating.mean + (rankMultiplier*meanMultiplier*v)
 		newStdDev = sqrt(varianceWithDynamics*(1 - w*stdDevMultiplier))
 		return Rating(newMean, newStdDev)
+
+	def calculateNewRatingsBatch(self, gameInfo, winnerMeans, winnerStandardDeviations, loserMeans, loserStandardDeviations, wasDraw):
+		'''
+		Calculates the new ratings for many 2 player games in one call. Every argument after gameInfo is a sequence
+		(a list, an array.array or a numpy array) with one entry per game, and wasDraw holds a true value for the
+		games that ended in a draw, in which case it does not matter which player is listed as the winner.
+		Returns a tuple of lists (winnerMeans, winnerStandardDeviations, loserMeans, loserStandardDeviations)
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		gameCount = len(winnerMeans)
+		isEqual(len(winnerStandardDeviations), gameCount, "winnerStandardDeviations")
+		isEqual(len(loserMeans), gameCount, "loserMeans")
+		isEqual(len(loserStandardDeviations), gameCount, "loserStandardDeviations")
+		isEqual(len(wasDraw), gameCount, "wasDraw")
+
+		profile = gameInfo.profile
+		drawMargin = profile.drawMargin
+		twoBetaSquared = profile.twoBetaSquared
+		tauSquared = profile.tauSquared
+
+		newWinnerMeans = [0.0]*gameCount
+		newWinnerStandardDeviations = [0.0]*gameCount
+		newLoserMeans = [0.0]*gameCount
+		newLoserStandardDeviations = [0.0]*gameCount
+		for i in range(gameCount):
+			winnerMean = winnerMeans[i]
+			loserMean = loserMeans[i]
+			winnerVariance = winnerStandardDeviations[i]**2.0
+			loserVariance = loserStandardDeviations[i]**2.0
+			c = sqrt(winnerVariance + loserVariance + twoBetaSquared)
+			meanDelta = winnerMean - loserMean
+			# both players share v and w: the loser sees the same mean delta from the other side, which only flips
+			# the sign of v (for a draw, vWithinMargin is odd and wWithinMargin is even in the mean delta)
+			if wasDraw[i]:
+				v, w = self._vwWithinMargin(meanDelta, drawMargin, c)
+			else:
+				v, w = self._vwExceedsMargin(meanDelta, drawMargin, c)
+			winnerVarianceWithDynamics = winnerVariance + tauSquared
+			loserVarianceWithDynamics = loserVariance + tauSquared
+			newWinnerMeans[i] = winnerMean + (winnerVarianceWithDynamics/c)*v
+			newLoserMeans[i] = loserMean - (loserVarianceWithDynamics/c)*v
+			newWinnerStandardDeviations[i] = sqrt(winnerVarianceWithDynamics*(1 - w*winnerVarianceWithDynamics/(c**2.0)))
+			newLoserStandardDeviations[i] = sqrt(loserVarianceWithDynamics*(1 - w*loserVarianceWithDynamics/(c**2.0)))
+		return (newWinnerMeans, newWinnerStandardDeviations, newLoserMeans, newLoserStandardDeviations)
 		
 	def calculateMatchQuality(self, gameInfo, teams):
 		argumentNotNone(gameInfo, "gameInfo")
 		self._validateTeamCountAndPlayersCountPerTeam(teams)
 		player1Rating = teams[0].asListOfTuples[0][1]
 		player2Rating = teams[1].asListOfTuples[0][1]
-		betaSquared = (gameInfo.beta**2.0)
+		betaSquared = gameInfo.profile.betaSquared
 		player1SigmaSquared = (player1Rating.standardDeviation**2.0)
 		player2SigmaSquared = (player2Rating.standardDeviation**2.0)
 		sqrtPart = sqrt((2.0*betaSquared) / (2.0*betaSquared + player1SigmaSquared + player2SigmaSquared))
 		expPart = e**((-1.0*((player1Rating.mean - player2Rating.mean)**2.0)) / (2.0*(2.0*betaSquared + player1SigmaSquared + player2SigmaSquared)))
 		return sqrtPart*expPart
+		
+	def calculateMatchQualityBatch(self, gameInfo, player1Means, player1StandardDeviations, player2Means, player2StandardDeviations):
+		'''
+		calculateMatchQuality for many candidate 2 player games in one call. Every argument after gameInfo is a
+		sequence with one entry per game. Returns a list of qualities
+		'''
+		argumentNotNone(gameInfo, "gameInfo")
+		gameCount = len(player1Means)
+		isEqual(len(player1StandardDeviations), gameCount, "player1StandardDeviations")
+		isEqual(len(player2Means), gameCount, "player2Means")
+		isEqual(len(player2StandardDeviations), gameCount, "player2StandardDeviations")
+		twoBetaSquared = gameInfo.profile.twoBetaSquared
+		
+		qualities = [0.0]*gameCount
+		for i in range(gameCount):
+			denominator = twoBetaSquared + player1StandardDeviations[i]**2.0 + player2StandardDeviations[i]**2.0
+			sqrtPart = sqrt(twoBetaSquared / denominator)
+			expPart = e**((-1.0*((player1Means[i] - player2Means[i])**2.0)) / (2.0*denominator))
+			qualities[i] = sqrtPart*expPart
+		return qualities